@@ -6,6 +6,10 @@ from pydantic import BaseModel, ConfigDict
 from .user import router as user_router
 from .role import router as role_router
 from .permission import router as permission_router
+from .metrics import router as metrics_router
+from .monitor import router as monitor_router
+from .batch import router as batch_router
+from .department import router as department_router
 
 
 class RouteInfo(BaseModel):
@@ -21,6 +25,10 @@ router_list: list[RouteInfo] = [
     RouteInfo(prefix='/users', router=user_router, tags=['user']),
     RouteInfo(prefix='/roles', router=role_router, tags=['role']),
     RouteInfo(prefix='/permissions', router=permission_router, tags=['permission']),
+    RouteInfo(prefix='/departments', router=department_router, tags=['department']),
+    RouteInfo(prefix='', router=metrics_router, tags=['metrics']),
+    RouteInfo(prefix='/monitor', router=monitor_router, tags=['monitor']),
+    RouteInfo(prefix='', router=batch_router, tags=['batch']),
 ]
 
 __all__ = ['router_list']
@@ -0,0 +1,30 @@
+import asyncio
+from fastapi import APIRouter, Depends, Request
+
+from config import BATCH_CONFIG
+from common.auth import RoutePermission
+from common.batch import dispatch
+from common.depends import check_permission
+from common.query_budget import QueryBudget
+from common.response import CommonResponse
+from common.exception import ApiException
+from common.permission_enum import InterfaceEnum
+
+from models.user import UserModel
+from schemas.batch import BatchSchema
+
+
+router = APIRouter()
+
+
+@router.post('/batch', openapi_extra=RoutePermission(
+        interface_list=[InterfaceEnum.USER_SELF_GET]
+).to_openapi_extra() | QueryBudget(max_statements=3).to_openapi_extra())
+async def batch(data: BatchSchema, request: Request, user: UserModel = Depends(check_permission)):
+    ''' 批量请求接口，并发执行子请求，每个子请求按各自路由的权限校验 '''
+    if len(data.requests) > BATCH_CONFIG.max_requests:
+        raise ApiException(f'单次最多{BATCH_CONFIG.max_requests}个子请求')
+    if any(not item.path.startswith('/') or item.path.split('?')[0].rstrip('/') == '/batch' for item in data.requests):
+        raise ApiException('子请求路径不合法')
+    results = await asyncio.gather(*[dispatch(request.app, request.scope, item, user) for item in data.requests])
+    return CommonResponse.success(data=[result.model_dump() for result in results])
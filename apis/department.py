@@ -0,0 +1,31 @@
+import services.department as DepartmentService
+from fastapi import APIRouter, Depends
+
+from common.log import logger
+from db import AsyncSession, async_session
+from common.auth import RoutePermission
+from common.query_budget import QueryBudget
+from common.response import CommonResponse
+from common.permission_enum import MenuEnum, ButtonEnum
+from schemas.department import DepartmentSchema, DepartmentCreateSchema
+
+
+router = APIRouter()
+
+@router.get('/all', openapi_extra=RoutePermission(
+        menu_list=[MenuEnum.USER_MANAGE]
+).to_openapi_extra() | QueryBudget(max_statements=5).to_openapi_extra())
+async def get_all(session: AsyncSession = Depends(async_session)) -> CommonResponse:
+    ''' 当前用户数据范围内的部门，前端按parent_id组装成树 '''
+    obj_list = await DepartmentService.get_all(session)
+    return CommonResponse.success(data=[DepartmentSchema.model_validate(obj).model_dump() for obj in obj_list])
+
+
+@router.post('/', openapi_extra=RoutePermission(
+        menu_list=[MenuEnum.USER_MANAGE],
+        button_list=[ButtonEnum.USER_ADD]
+).to_openapi_extra() | QueryBudget(max_statements=8).to_openapi_extra())
+async def post(data: DepartmentCreateSchema, session: AsyncSession = Depends(async_session)) -> CommonResponse:
+    logger.info('data: %s', data)
+    obj = await DepartmentService.create_department(data, session)
+    return CommonResponse.success(data=DepartmentSchema.model_validate(obj).model_dump())
@@ -0,0 +1,20 @@
+from fastapi import APIRouter
+from fastapi.responses import PlainTextResponse
+
+from common.auth import RoutePermission
+from common.metrics import render_metrics
+from common.query_budget import QueryBudget
+from common.permission_enum import InterfaceEnum
+
+
+router = APIRouter()
+
+
+@router.get('/metrics', response_class=PlainTextResponse, openapi_extra=RoutePermission(
+        interface_list=[InterfaceEnum.MONITOR_GET]
+).to_openapi_extra() | QueryBudget(max_statements=3).to_openapi_extra())
+async def metrics():
+    ''' Prometheus文本格式的监控指标，包含所有路由的请求量和错误率，和/monitor下的接口一样需要监控权限
+    抓取时通过Authorization请求头携带有监控权限的用户的令牌
+    '''
+    return PlainTextResponse(render_metrics(), media_type='text/plain; version=0.0.4; charset=utf-8')
@@ -0,0 +1,51 @@
+from fastapi import APIRouter
+from fastapi.responses import FileResponse
+
+from common.auth import RoutePermission
+from common.query_budget import QueryBudget
+from common.response import CommonResponse
+from common.exception import ApiException
+from common.profiler import list_profiles, get_profile, get_profile_path
+from common.slow_query import slow_query_recorder
+from common.permission_enum import InterfaceEnum
+
+
+router = APIRouter()
+
+
+@router.get('/slow-queries', openapi_extra=RoutePermission(
+        interface_list=[InterfaceEnum.MONITOR_GET]
+).to_openapi_extra() | QueryBudget(max_statements=3).to_openapi_extra())
+async def slow_queries():
+    ''' 获取最近记录的慢查询及其执行计划 '''
+    return CommonResponse.success(data=slow_query_recorder.list())
+
+
+@router.get('/profiles', openapi_extra=RoutePermission(
+        interface_list=[InterfaceEnum.MONITOR_GET]
+).to_openapi_extra() | QueryBudget(max_statements=3).to_openapi_extra())
+async def profiles():
+    ''' 获取保存的请求剖析结果列表 '''
+    return CommonResponse.success(data=list_profiles())
+
+
+@router.get('/profiles/{profile_id}', openapi_extra=RoutePermission(
+        interface_list=[InterfaceEnum.MONITOR_GET]
+).to_openapi_extra() | QueryBudget(max_statements=3).to_openapi_extra())
+async def profile_detail(profile_id: str):
+    ''' 获取请求剖析结果的摘要，包括函数耗时和内存分配统计 '''
+    profile = get_profile(profile_id)
+    if profile is None:
+        raise ApiException('剖析结果不存在')
+    return CommonResponse.success(data=profile)
+
+
+@router.get('/profiles/{profile_id}/download', openapi_extra=RoutePermission(
+        interface_list=[InterfaceEnum.MONITOR_GET]
+).to_openapi_extra() | QueryBudget(max_statements=3).to_openapi_extra())
+async def profile_download(profile_id: str):
+    ''' 下载原始的pstats文件，可以使用snakeviz等工具查看 '''
+    path = get_profile_path(profile_id, '.prof')
+    if path is None or get_profile(profile_id) is None:
+        raise ApiException('剖析结果不存在')
+    return FileResponse(path, filename=f'{profile_id}.prof', media_type='application/octet-stream')
@@ -1,16 +1,22 @@
 from typing import Optional
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, Query
 import services.permission as PermissionService
 
 from common.log import logger
 from db import AsyncSession, async_session
 from common.auth import RoutePermission
+from common.query_budget import QueryBudget
+from common.rate_limit import RateLimit
+from common.admission import Bulkhead
+from common.single_flight import single_flight
 from common.response import CommonResponse
 from common.depends import get_query_params
+from common.export import ExportFormat, export_response
 from common.pagination import PaginationQuerySchema
 from common.permission_enum import MenuEnum, InterfaceEnum, ButtonEnum
 
 from models.enums import PermissionEnum
+from models.permission import PermissionModel
 from schemas.permission import PermissionSchema, PermissionCreateSchema, PermissionUpdateSchema
 
 
@@ -19,9 +25,9 @@ router = APIRouter()
 @router.put('/{id}', openapi_extra=RoutePermission(
         menu_list=[MenuEnum.PERMISSION_MANAGE],
         button_list=[ButtonEnum.PERMISSION_EDIT]
-).to_openapi_extra())
+).to_openapi_extra() | QueryBudget(max_statements=8).to_openapi_extra())
 async def update(id: int, data: PermissionUpdateSchema, session: AsyncSession = Depends(async_session)) -> CommonResponse:
-    logger.info(f'id: {id}, data: {data.model_dump()}')
+    logger.info('id: %s, data: %s', id, data)
     obj = await PermissionService.update_by_id(id, data, session)
     return CommonResponse.success(data=PermissionSchema.model_validate(obj).model_dump())
 
@@ -29,9 +35,9 @@ async def update(id: int, data: PermissionUpdateSchema, session: AsyncSession =
 @router.delete('/{id}', openapi_extra=RoutePermission(
         menu_list=[MenuEnum.PERMISSION_MANAGE],
         button_list=[ButtonEnum.PERMISSION_DEL]
-).to_openapi_extra())
+).to_openapi_extra() | QueryBudget(max_statements=8).to_openapi_extra())
 async def delete(id: int, session: AsyncSession = Depends(async_session)) -> CommonResponse:
-    logger.info(f'id: {id}')
+    logger.info('id: %s', id)
     await PermissionService.delete_by_id(id, session)
     return CommonResponse.success(data=True)
 
@@ -39,44 +45,65 @@ async def delete(id: int, session: AsyncSession = Depends(async_session)) -> Com
 @router.post('/', openapi_extra=RoutePermission(
         menu_list=[MenuEnum.PERMISSION_MANAGE],
         button_list=[ButtonEnum.PERMISSION_ADD]
-).to_openapi_extra())
+).to_openapi_extra() | QueryBudget(max_statements=7).to_openapi_extra())
 async def post(data: PermissionCreateSchema, session: AsyncSession = Depends(async_session)) -> CommonResponse:
-    logger.info(f'data: {data.model_dump()}')
+    logger.info('data: %s', data)
     obj = await PermissionService.create_obj(data, session)
     return CommonResponse.success(data=PermissionSchema.model_validate(obj).model_dump())
 
 
+@single_flight('permission')
+async def load_enabled_permissions(keyword: Optional[str], session: AsyncSession) -> list[dict]:
+    ''' 查询并序列化启用的权限，管理端加载时的大量并发请求共享一次查询 '''
+    obj_list = await PermissionService.all_permission_list_by_enable(session, keyword)
+    return [PermissionSchema.model_validate(obj).model_dump() for obj in obj_list]
+
+
 @router.get('/all', openapi_extra=RoutePermission(
         menu_list=[MenuEnum.PERMISSION_MANAGE]
-).to_openapi_extra())
+).to_openapi_extra() | QueryBudget(max_statements=5).to_openapi_extra())
 async def all_permission_list(keyword: Optional[str] = None, session: AsyncSession = Depends(async_session)):
-    obj_list = await PermissionService.all_permission_list_by_enable(session, keyword)
-    return CommonResponse.success(data=[PermissionSchema.model_validate(obj).model_dump() for obj in obj_list])
+    return CommonResponse.success(data=await load_enabled_permissions(keyword, session=session))
 
 
 @router.get('/group-all', openapi_extra=RoutePermission(
         menu_list=[MenuEnum.PERMISSION_MANAGE]
-).to_openapi_extra())
+).to_openapi_extra() | QueryBudget(max_statements=5).to_openapi_extra())
 async def all_permission_list_by_type(keyword: Optional[str] = None, session: AsyncSession = Depends(async_session)):
-    obj_list = await PermissionService.all_permission_list_by_enable(session, keyword)
     data_dict = {'menu': [], 'interface': [], 'button': []}
-    for obj in obj_list:
-        obj_dict = PermissionSchema.model_validate(obj).model_dump()
-        if getattr(obj, 'type') == PermissionEnum.MENU:
+    for obj_dict in await load_enabled_permissions(keyword, session=session):
+        if obj_dict['type'] == PermissionEnum.MENU:
             data_dict['menu'].append(obj_dict)
-        elif getattr(obj, 'type') == PermissionEnum.INTERFACE:
+        elif obj_dict['type'] == PermissionEnum.INTERFACE:
             data_dict['interface'].append(obj_dict)
-        elif getattr(obj, 'type') == PermissionEnum.BUTTON:
+        elif obj_dict['type'] == PermissionEnum.BUTTON:
             data_dict['button'].append(obj_dict)
     return CommonResponse.success(data=data_dict)
 
 
 @router.get('/list', openapi_extra=RoutePermission(
         menu_list=[MenuEnum.PERMISSION_MANAGE]
-).to_openapi_extra())
+).to_openapi_extra() | QueryBudget(max_statements=6).to_openapi_extra()
+  | Bulkhead(group='search').to_openapi_extra())
 async def pagelist(data: PaginationQuerySchema = Depends(get_query_params), session: AsyncSession = Depends(async_session)):
     pagination, obj_list = await PermissionService.pagelist(data, session)
     return CommonResponse.success(data={
         'records': [PermissionSchema.model_validate(obj).model_dump() for obj in obj_list],
         **pagination.model_dump()
     })
+
+
+@router.get('/export', openapi_extra=RoutePermission(
+        menu_list=[MenuEnum.PERMISSION_MANAGE]
+).to_openapi_extra() | QueryBudget(max_statements=4).to_openapi_extra()
+  | RateLimit(rate=0.1, burst=3, keys=['user']).to_openapi_extra()
+  | Bulkhead(group='export').to_openapi_extra())
+async def export(
+    file_format: ExportFormat = Query(default='csv', alias='format', description='导出格式'),
+    data: PaginationQuerySchema = Depends(get_query_params)
+):
+    ''' 按照列表的查询条件流式导出权限 '''
+    return export_response(PermissionModel, [
+        PermissionModel.id, PermissionModel.name, PermissionModel.code, PermissionModel.type,
+        PermissionModel.desc, PermissionModel.enable, PermissionModel.ctime
+    ], data, file_format, filename='permissions')
@@ -1,21 +1,28 @@
-from typing import Optional
+from typing import Hashable, Optional, Sequence
 import services.role as RoleService
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, Query
 
 from common.log import logger
 from config import AUTH_CONFIG
 from db import AsyncSession, async_session
 from common.auth import RoutePermission
+from common.query_budget import QueryBudget
+from common.rate_limit import RateLimit
+from common.admission import Bulkhead
+from common.single_flight import single_flight
+from common.data_scope import get_scope_key
 from common.response import CommonResponse
 from common.exception import ApiException
 from common.depends import get_query_params
+from common.export import ExportFormat, export_response
 from common.pagination import PaginationQuerySchema
 from common.permission_enum import MenuEnum, InterfaceEnum, ButtonEnum
 
 from models.user import UserModel
+from models.role import RoleModel
 from models.permission import PermissionEnum
 from schemas.permission import PermissionSchema
-from schemas.role import RoleSchema, RoleCreateSchema, RoleUpdateSchema, RoleUpdatePermissionSchema
+from schemas.role import RoleSchema, RoleCountSchema, RoleCreateSchema, RoleUpdateSchema, RoleUpdatePermissionSchema
 
 
 router = APIRouter()
@@ -23,9 +30,9 @@ router = APIRouter()
 @router.put('/{id}', openapi_extra=RoutePermission(
         menu_list=[MenuEnum.ROLE_MANAGE],
         button_list=[ButtonEnum.ROLE_EDIT]
-).to_openapi_extra())
+).to_openapi_extra() | QueryBudget(max_statements=12).to_openapi_extra())
 async def update(id: int, data: RoleUpdateSchema, session: AsyncSession = Depends(async_session)) -> CommonResponse:
-    logger.info(f'id: {id}, data: {data.model_dump()}')
+    logger.info('id: %s, data: %s', id, data)
     # 如果需要修改的角色信息不是超级管理员，随便修改
     role = await RoleService.get_obj_by_query({'id': id, 'code': AUTH_CONFIG.manage.super_admin_code}, session)
     if not role:
@@ -38,9 +45,9 @@ async def update(id: int, data: RoleUpdateSchema, session: AsyncSession = Depend
 @router.put('/dispatch-permission/{id}', openapi_extra=RoutePermission(
         menu_list=[MenuEnum.ROLE_MANAGE],
         button_list=[ButtonEnum.ROLE_DISPATCH_PERMISSION]
-).to_openapi_extra())
+).to_openapi_extra() | QueryBudget(max_statements=12).to_openapi_extra())
 async def update_permission(id: int, data: RoleUpdatePermissionSchema, session: AsyncSession = Depends(async_session)) -> CommonResponse:
-    logger.info(f'id: {id}, data: {data.model_dump()}')
+    logger.info('id: %s, data: %s', id, data)
     # 如果需要修改的角色信息不是超级管理员，随便修改
     role = await RoleService.get_obj_by_query({'id': id, 'code': AUTH_CONFIG.manage.super_admin_code}, session)
     if not role:
@@ -53,9 +60,9 @@ async def update_permission(id: int, data: RoleUpdatePermissionSchema, session:
 @router.delete('/{id}', openapi_extra=RoutePermission(
         menu_list=[MenuEnum.ROLE_MANAGE],
         button_list=[ButtonEnum.ROLE_DEL]
-).to_openapi_extra())
+).to_openapi_extra() | QueryBudget(max_statements=8).to_openapi_extra())
 async def delete(id: int, session: AsyncSession = Depends(async_session)) -> CommonResponse:
-    logger.info(f'id: {id}')
+    logger.info('id: %s', id)
     await RoleService.delete_by_id(id, session)
     return CommonResponse.success(data=True)
 
@@ -63,38 +70,83 @@ async def delete(id: int, session: AsyncSession = Depends(async_session)) -> Com
 @router.post('/', openapi_extra=RoutePermission(
         menu_list=[MenuEnum.ROLE_MANAGE],
         button_list=[ButtonEnum.ROLE_ADD]
-).to_openapi_extra())
+).to_openapi_extra() | QueryBudget(max_statements=7).to_openapi_extra())
 async def post(data: RoleCreateSchema, session: AsyncSession = Depends(async_session)) -> CommonResponse:
-    logger.info(f'data: {data.model_dump()}')
+    logger.info('data: %s', data)
     obj = await RoleService.create_obj(data, session)
     return CommonResponse.success(data=RoleSchema.model_validate(obj).model_dump())
 
 
+async def serialize_roles(obj_list: Sequence[RoleModel], with_count: bool, session: AsyncSession) -> list[dict]:
+    ''' 序列化角色列表，with_count为真时通过一次聚合查询附加用户数和各类型的权限数 '''
+    data = [RoleSchema.model_validate(obj).model_dump() for obj in obj_list]
+    if with_count and data:
+        counts = await RoleService.get_role_counts([item['id'] for item in data], session)
+        for item in data:
+            item.update(RoleCountSchema(**counts.get(item['id'], {})).model_dump())
+    return data
+
+
+@single_flight('role')
+async def load_enabled_roles(
+    keyword: Optional[str], with_count: bool, scope_key: Optional[Hashable], session: AsyncSession
+) -> list[dict]:
+    ''' 查询并序列化启用的角色，管理端加载时的大量并发请求共享一次查询
+    用户数按执行者的数据范围统计，scope_key只用于区分不同数据范围的调用者
+    '''
+    obj_list = await RoleService.all_role_list_by_enable(keyword, session)
+    return await serialize_roles(obj_list, with_count, session)
+
+
 @router.get('/all', openapi_extra=RoutePermission(
         menu_list=[MenuEnum.ROLE_MANAGE]
-).to_openapi_extra())
-async def all_role_list(keyword: Optional[str] = None, session: AsyncSession = Depends(async_session)):
-    obj_list = await RoleService.all_role_list_by_enable(keyword, session)
-    return CommonResponse.success(data=[RoleSchema.model_validate(obj).model_dump() for obj in obj_list])
+).to_openapi_extra() | QueryBudget(max_statements=5).to_openapi_extra())
+async def all_role_list(
+    keyword: Optional[str] = None, with_count: bool = Query(default=False, description='是否附加用户数和权限数'),
+    session: AsyncSession = Depends(async_session)
+):
+    # 不附加用户数时结果和数据范围无关，所有调用者共享
+    scope_key = get_scope_key() if with_count else None
+    return CommonResponse.success(data=await load_enabled_roles(keyword, with_count, scope_key, session=session))
 
 
 @router.get('/list', openapi_extra=RoutePermission(
         menu_list=[MenuEnum.ROLE_MANAGE]
-).to_openapi_extra())
-async def pagelist(data: PaginationQuerySchema = Depends(get_query_params), session: AsyncSession = Depends(async_session)):
+).to_openapi_extra() | QueryBudget(max_statements=6).to_openapi_extra()
+  | Bulkhead(group='search').to_openapi_extra())
+async def pagelist(
+    data: PaginationQuerySchema = Depends(get_query_params),
+    with_count: bool = Query(default=False, description='是否附加用户数和权限数'),
+    session: AsyncSession = Depends(async_session)
+):
     pagination, obj_list = await RoleService.pagelist(data, session)
     return CommonResponse.success(data={
-        'records': [RoleSchema.model_validate(obj).model_dump() for obj in obj_list],
+        'records': await serialize_roles(obj_list, with_count, session),
         **pagination.model_dump()
     })
 
 
+@router.get('/export', openapi_extra=RoutePermission(
+        menu_list=[MenuEnum.ROLE_MANAGE]
+).to_openapi_extra() | QueryBudget(max_statements=4).to_openapi_extra()
+  | RateLimit(rate=0.1, burst=3, keys=['user']).to_openapi_extra()
+  | Bulkhead(group='export').to_openapi_extra())
+async def export(
+    file_format: ExportFormat = Query(default='csv', alias='format', description='导出格式'),
+    data: PaginationQuerySchema = Depends(get_query_params)
+):
+    ''' 按照列表的查询条件流式导出角色 '''
+    return export_response(RoleModel, [
+        RoleModel.id, RoleModel.name, RoleModel.code, RoleModel.desc, RoleModel.enable, RoleModel.ctime
+    ], data, file_format, filename='roles')
+
+
 @router.get('/{id}', openapi_extra=RoutePermission(
         menu_list=[MenuEnum.ROLE_MANAGE],
         interface_list=[InterfaceEnum.ROLE_GET]
-).to_openapi_extra())
+).to_openapi_extra() | QueryBudget(max_statements=5).to_openapi_extra())
 async def get_by_id(id: int, session: AsyncSession = Depends(async_session)) -> CommonResponse:
-    logger.info(f'id: {id}')
+    logger.info('id: %s', id)
     role = await RoleService.get_obj_by_query({'id': id}, session)
     role_dict = RoleSchema.model_validate(role).model_dump()
     permission_dict = {'menu': [], 'interface': [], 'button': []}
@@ -1,6 +1,7 @@
 import os
-from uuid import uuid4
-from fastapi import APIRouter, Depends, File, UploadFile
+import asyncio
+from typing import Annotated
+from fastapi import APIRouter, Depends, File, Header, Query, UploadFile
 
 import services.user as UserService
 from db import AsyncSession, async_session
@@ -8,8 +9,16 @@ from config import AUTH_CONFIG, ENV_CONFIG, SOURCE_CONFIG
 
 from common.log import logger
 from common.response import CommonResponse
+from common.exception import ApiException
+from common.upload import save_image
+from common.image import schedule_variants, get_variant_urls
+from common.export import ExportFormat, export_response
 from common.pagination import PaginationQuerySchema
-from common.auth import RoutePermission, generate_token
+from common.auth import RoutePermission, generate_token, parse_token
+from common.revocation import revoke_token
+from common.query_budget import QueryBudget
+from common.rate_limit import RateLimit
+from common.admission import Bulkhead
 from common.depends import get_query_params, check_permission
 from common.permission_enum import MenuEnum, InterfaceEnum, ButtonEnum
 
@@ -30,18 +39,20 @@ router = APIRouter()
         menu_list=[MenuEnum.USER_MANAGE],
         interface_list=[InterfaceEnum.USER_ENABLE],
         button_list=[ButtonEnum.USER_EDIT]
-).to_openapi_extra())
+).to_openapi_extra() | QueryBudget(max_statements=6).to_openapi_extra())
 async def change_status(uid: int, data: UserChangeStatusSchema, session: AsyncSession = Depends(async_session)) -> CommonResponse:
-    logger.info(f'userId: {uid}, status: {data.enable}')
+    logger.info('userId: %s, status: %s', uid, data.enable)
     await UserService.change_status(uid, data.enable, session)
     return CommonResponse.success(data=True)
 
 
 @router.post('/update', openapi_extra=RoutePermission(
         interface_list=[InterfaceEnum.USER_SELF_EDIT]
-).to_openapi_extra())
+).to_openapi_extra() | QueryBudget(max_statements=10).to_openapi_extra())
 async def update_self(data: UserUpdateSchema, user: UserService.UserModel = Depends(check_permission), session: AsyncSession = Depends(async_session)):
     ''' 更新用户自己的信息接口 '''
+    # 部门决定数据范围，用户不能修改自己的部门
+    data.did = None
     user = await UserService.update_by_id(getattr(user, 'id'), data, session)
     user_dict = UserSchema.model_validate(user).model_dump()
     return CommonResponse.success(data=user_dict)
@@ -49,30 +60,23 @@ async def update_self(data: UserUpdateSchema, user: UserService.UserModel = Depe
 
 @router.post('/upload-avatar', openapi_extra=RoutePermission(
         interface_list=[InterfaceEnum.USER_SELF_EDIT]
-).to_openapi_extra())
+).to_openapi_extra() | QueryBudget(max_statements=3).to_openapi_extra()
+  | RateLimit(rate=0.2, burst=5, keys=['user']).to_openapi_extra())
 async def upload_avatar(avatar_file: UploadFile = File()):
     ''' 上传用户头像数据 '''
-    # 获取需要保存的文件路径
     save_dir = os.path.join(ENV_CONFIG.source_dir, SOURCE_CONFIG.avatar_source)
-    file_name = f'{uuid4()}.jpg'
-    save_path = os.path.join(save_dir, file_name)
-    
-    # 分批次保存文件，避免大文件占用内存过高
-    chunk_size = 1024 * 1024    # 每次读取 1MB
-    with open(save_path, 'ab') as fp:
-        while True:
-            chunk = await avatar_file.read(chunk_size) 
-            if not chunk:
-                break
-            fp.write(chunk)
+    relative_path = await save_image(avatar_file, save_dir, SOURCE_CONFIG.avatar_max_size)
+    # 后台生成缩略图，不阻塞上传接口
+    schedule_variants(os.path.join(save_dir, relative_path))
     # 返回不带http前缀的url地址
-    url = '/'.join([ENV_CONFIG.source_prefix, SOURCE_CONFIG.avatar_source, file_name])
-    return CommonResponse.success(data={ 'url': url })
+    url = '/'.join([ENV_CONFIG.source_prefix, SOURCE_CONFIG.avatar_source, *relative_path.split(os.sep)])
+    return CommonResponse.success(data={ 'url': url, 'variants': get_variant_urls(url) })
 
 
 @router.post('/change-pwd', openapi_extra=RoutePermission(
         interface_list=[InterfaceEnum.USER_SELF_EDIT]
-).to_openapi_extra())
+).to_openapi_extra() | QueryBudget(max_statements=10).to_openapi_extra()
+  | Bulkhead(group='password').to_openapi_extra())
 async def update_self_pwd(data: UserChangePasswordSchema, user: UserService.UserModel = Depends(check_permission), session: AsyncSession = Depends(async_session)):
     ''' 更新用户自己的密码接口 '''
     user = await UserService.update_pwd_by_id(getattr(user, 'id'), data, session)
@@ -83,9 +87,9 @@ async def update_self_pwd(data: UserChangePasswordSchema, user: UserService.User
 @router.post('/dispatch/{uid}', openapi_extra=RoutePermission(
         menu_list=[MenuEnum.USER_MANAGE],
         button_list=[ButtonEnum.USER_DISPATCH_ROLE]
-).to_openapi_extra())
+).to_openapi_extra() | QueryBudget(max_statements=8).to_openapi_extra())
 async def user_dispatch_role(uid: int, data: UserDispatchRoleSchema, session: AsyncSession = Depends(async_session)) -> CommonResponse:
-    logger.info(f'userId: {uid}, data: {data.model_dump()}')
+    logger.info('userId: %s, data: %s', uid, data)
     await UserService.user_dispatch_role(uid, data.rid, session)
     return CommonResponse.success(data=True)
 
@@ -94,9 +98,9 @@ async def user_dispatch_role(uid: int, data: UserDispatchRoleSchema, session: As
         menu_list=[MenuEnum.USER_MANAGE],
         interface_list=[InterfaceEnum.USER_PUT],
         button_list=[ButtonEnum.USER_EDIT]
-).to_openapi_extra())
+).to_openapi_extra() | QueryBudget(max_statements=9).to_openapi_extra())
 async def update(uid: int, data: UserUpdateSchema, session: AsyncSession = Depends(async_session)) -> CommonResponse:
-    logger.info(f'userId: {uid}, data: {data.model_dump()}')
+    logger.info('userId: %s, data: %s', uid, data)
     user = await UserService.update_by_id(uid, data, session)
     return CommonResponse.success(data=UserSchema.model_validate(user).model_dump())
 
@@ -105,21 +109,23 @@ async def update(uid: int, data: UserUpdateSchema, session: AsyncSession = Depen
         menu_list=[MenuEnum.USER_MANAGE],
         interface_list=[InterfaceEnum.USER_DEL],
         button_list=[ButtonEnum.USER_DEL]
-).to_openapi_extra())
+).to_openapi_extra() | QueryBudget(max_statements=8).to_openapi_extra())
 async def delete(uid: int, session: AsyncSession = Depends(async_session)) -> CommonResponse:
-    logger.info(f'userId: {uid}')
+    logger.info('userId: %s', uid)
     await UserService.delete_by_id(uid, session)
     return CommonResponse.success(data=True)
 
 
-@router.post('/login')
+@router.post('/login', openapi_extra=QueryBudget(max_statements=3).to_openapi_extra()
+  | RateLimit(rate=0.2, burst=10, keys=['ip']).to_openapi_extra()
+  | Bulkhead(group='password').to_openapi_extra())
 async def login(data: UserLoginSchema, session: AsyncSession = Depends(async_session)):
     ''' 用户登录接口 '''
     obj = await UserService.get_obj_by_query({ 'name': data.name }, session)
     if not obj:
         return CommonResponse.fail(msg='用户不存在')
     
-    if not obj.check_pwd(data.password):
+    if not await asyncio.to_thread(obj.check_pwd, data.password):
         return CommonResponse.fail(msg='用户名或密码错误')
     user_dict = UserSchema.model_validate(obj).model_dump(include={'id', 'name'})
     # 登录成功生成token并返回
@@ -128,9 +134,23 @@ async def login(data: UserLoginSchema, session: AsyncSession = Depends(async_ses
     })
 
 
+@router.post('/logout', openapi_extra=RoutePermission(
+        interface_list=[InterfaceEnum.USER_SELF_GET]
+).to_openapi_extra() | QueryBudget(max_statements=4).to_openapi_extra())
+async def logout(
+    Authorization: Annotated[str, Header()] = '',
+    user: UserService.UserModel = Depends(check_permission), session: AsyncSession = Depends(async_session)
+) -> CommonResponse:
+    ''' 退出登录接口，吊销当前令牌 '''
+    token_dict = parse_token(Authorization, AUTH_CONFIG.jwt.secret_key, AUTH_CONFIG.jwt.algorithm)
+    await revoke_token(token_dict, session)
+    logger.info('userId: %s logout', user.id)
+    return CommonResponse.success(data=True)
+
+
 @router.get('/info', openapi_extra=RoutePermission(
         interface_list=[InterfaceEnum.USER_SELF_GET]
-).to_openapi_extra())
+).to_openapi_extra() | QueryBudget(max_statements=3).to_openapi_extra())
 async def info(user: UserService.UserModel = Depends(check_permission), session: AsyncSession = Depends(async_session)):
     ''' 获取用户信息接口 '''
     user_dict = UserSchema.model_validate(user).model_dump()
@@ -144,7 +164,8 @@ async def info(user: UserService.UserModel = Depends(check_permission), session:
 
 @router.get('/list', openapi_extra=RoutePermission(
         menu_list=[MenuEnum.USER_MANAGE]
-).to_openapi_extra())
+).to_openapi_extra() | QueryBudget(max_statements=7).to_openapi_extra()
+  | Bulkhead(group='search').to_openapi_extra())
 async def pagelist(data: PaginationQuerySchema = Depends(get_query_params), session: AsyncSession = Depends(async_session)):
     pagination, obj_list = await UserService.pagelist(data, session)
     return CommonResponse.success(data={
@@ -153,12 +174,30 @@ async def pagelist(data: PaginationQuerySchema = Depends(get_query_params), sess
     })
 
 
+@router.get('/export', openapi_extra=RoutePermission(
+        menu_list=[MenuEnum.USER_MANAGE]
+).to_openapi_extra() | QueryBudget(max_statements=4).to_openapi_extra()
+  | RateLimit(rate=0.1, burst=3, keys=['user']).to_openapi_extra()
+  | Bulkhead(group='export').to_openapi_extra())
+async def export(
+    file_format: ExportFormat = Query(default='csv', alias='format', description='导出格式'),
+    data: PaginationQuerySchema = Depends(get_query_params)
+):
+    ''' 按照列表的查询条件流式导出用户 '''
+    return export_response(UserModel, [
+        UserModel.id, UserModel.name, UserModel.nickname, UserModel.gender, UserModel.email, UserModel.phone,
+        UserModel.address, UserModel.rid, UserModel.enable, UserModel.ctime
+    ], data, file_format, filename='users')
+
+
 @router.get('/{uid}', openapi_extra=RoutePermission(
         interface_list=[InterfaceEnum.USER_GET]
-).to_openapi_extra())
+).to_openapi_extra() | QueryBudget(max_statements=6).to_openapi_extra())
 async def get_info_by_id(uid: int, session: AsyncSession = Depends(async_session)):
     ''' 获取用户信息接口 '''
     user = await UserService.get_obj_by_query({'id': uid}, session)
+    if not user:
+        raise ApiException('用户不存在')
     user_dict = UserSchema.model_validate(user).model_dump()
     user_dict['role'] = RoleSchema.model_validate(user.role).model_dump() if user.role else {}
     return CommonResponse.success(data=user_dict)
@@ -168,8 +207,9 @@ async def get_info_by_id(uid: int, session: AsyncSession = Depends(async_session
         menu_list=[MenuEnum.USER_MANAGE],
         interface_list=[InterfaceEnum.USER_POST],
         button_list=[ButtonEnum.USER_ADD]
-).to_openapi_extra())
+).to_openapi_extra() | QueryBudget(max_statements=6).to_openapi_extra()
+  | Bulkhead(group='password').to_openapi_extra())
 async def post(data: UserCreateSchema, session: AsyncSession = Depends(async_session)) -> CommonResponse:
-    logger.info(f'data: {data.model_dump()}')
+    logger.info('data: %s', data)
     user = await UserService.create_user(data, session)
     return CommonResponse.success(data=UserSchema.model_validate(user).model_dump())
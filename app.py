@@ -1,33 +1,57 @@
+import asyncio
 from contextlib import asynccontextmanager
 from fastapi import FastAPI, Depends
-from fastapi.staticfiles import StaticFiles
 from fastapi.exceptions import RequestValidationError
 
 from apis import router_list
-from config import ENV_CONFIG
+from config import ENV_CONFIG, PROFILE_CONFIG, ARCHIVE_CONFIG
 from db import async_engine, DBBaseModel
 from common.log import logger
 from common.depends import check_permission
-from common.middleware import handle_exception_middleware, handler_validation_exception
+from common.admission import admission_control
+from common.rate_limit import ip_rate_limit
+from common.context import register_route_path
+from common.sql_monitor import install_sql_monitor
+from common.deadline import DeadlineMiddleware, install_statement_deadline
+from common.compression import CompressionMiddleware
+from common.profiler import ProfileMiddleware
+from common.image import shutdown_executor
+from common.audit import start_audit_writer, stop_audit_writer
+from common.revocation import load_revocations, run_revocation_sync
+from common.static import create_static_app
+from common.middleware import ExceptionMiddleware, AccessLogMiddleware, MetricsMiddleware, handler_validation_exception
 
 from scripts.data_manage import insert_permission, build_superadmin_role
+from scripts.archive import run_archive_schedule
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # app启动前执行的操作
     async with async_engine.begin() as connect:
-        logger.info(f'init tables, {DBBaseModel.metadata}')
+        logger.info('init tables, %s', DBBaseModel.metadata)
         await connect.run_sync(DBBaseModel.metadata.create_all)
     await insert_permission()
     await build_superadmin_role()
+    start_audit_writer()
+    await load_revocations()
+    revocation_task = asyncio.create_task(run_revocation_sync())
+    archive_task = asyncio.create_task(run_archive_schedule()) if ARCHIVE_CONFIG.interval_hours > 0 else None
     yield
     # app启动后执行的操作
+    revocation_task.cancel()
+    if archive_task is not None:
+        archive_task.cancel()
+    # 写入队列中剩余的审计事件
+    await stop_audit_writer()
+    shutdown_executor()
 
 
 def create_app() -> FastAPI:
-    # 添加通用权限处理依赖
-    app = FastAPI(lifespan=lifespan, dependencies=[Depends(check_permission)])
+    # 添加通用依赖: 按IP限流最先执行，被限流的请求不占用准入控制的名额；准入控制在权限校验之前，过载时被拒绝的请求不会访问数据库
+    app = FastAPI(lifespan=lifespan, dependencies=[
+        Depends(ip_rate_limit), Depends(admission_control), Depends(check_permission)
+    ])
 
     # 为app添加路由
     for route_info in router_list:
@@ -36,11 +60,23 @@ def create_app() -> FastAPI:
             router=route_info.router,
             tags=route_info.tags
         )
+        # 记录完整的路由模板，用于日志和指标
+        for route in route_info.router.routes:
+            register_route_path(route, route_info.prefix + getattr(route, 'path', ''))
     
-    # 添加自定义中间件
-    app.middleware('http')(handle_exception_middleware)
+    # 添加自定义中间件，后添加的在外层
+    app.add_middleware(ExceptionMiddleware)
+    # 截止时间在MetricsMiddleware创建的请求上下文中，超时的响应仍然经过访问日志和指标
+    app.add_middleware(DeadlineMiddleware)
+    app.add_middleware(CompressionMiddleware)
+    if PROFILE_CONFIG.enabled:
+        app.add_middleware(ProfileMiddleware)
+    app.add_middleware(AccessLogMiddleware)
+    app.add_middleware(MetricsMiddleware)
+    install_sql_monitor(async_engine)
+    install_statement_deadline(async_engine)
     app.exception_handler(RequestValidationError)(handler_validation_exception)
 
     # 挂载文件服务
-    app.mount(ENV_CONFIG.source_prefix, StaticFiles(directory=ENV_CONFIG.source_dir), name='source')
+    app.mount(ENV_CONFIG.source_prefix, create_static_app(), name='source')
     return app
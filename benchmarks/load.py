@@ -0,0 +1,142 @@
+'''
+进程内ASGI压测: 基于create_app()和预置的大数据量SQLite数据库，输出每个场景的吞吐量和p50/p95/p99延迟
+
+用法:
+    python -m benchmarks.load --db /tmp/bench.db                                  # 运行全部场景，输出JSON
+    python -m benchmarks.load --db /tmp/bench.db --compare benchmarks/baselines/load.json   # 和基线对比，有回归时退出码为1
+    python -m benchmarks.load --db /tmp/bench.db --save-baseline benchmarks/baselines/load.json
+
+对比时吞吐量和延迟变差超过--threshold，或者任一场景的错误数比基线多，都记为回归
+'''
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import platform
+import tempfile
+from typing import Callable
+from argparse import ArgumentParser
+
+from benchmarks.utils import prepare_config, summarize, save_report, compare_report
+from benchmarks.seed import seed, user_name, BENCH_ADMIN, PASSWORD
+
+
+class Scenario:
+    ''' 压测场景，build根据随机数生成器返回一次请求的(method, url, kwargs) '''
+    def __init__(self, name: str, build: Callable[[random.Random, dict], tuple], scale: float = 1.0, auth: bool = True) -> None:
+        self.name = name
+        self.build = build
+        self.scale = scale      # 相对于--requests的请求数比例，登录等重场景可以少跑一些
+        self.auth = auth
+
+
+def build_scenarios() -> list[Scenario]:
+    return [
+        Scenario('login', lambda r, d: (
+            'POST', '/users/login', {'json': {'name': user_name(r.randrange(d['users'] - 1)), 'password': PASSWORD}}
+        ), scale=0.05, auth=False),
+        Scenario('users_info', lambda r, d: ('GET', '/users/info', {})),
+        Scenario('users_list_shallow', lambda r, d: ('GET', '/users/list', {'params': {'page': 1, 'size': 10}})),
+        Scenario('users_list_deep', lambda r, d: (
+            'GET', '/users/list', {'params': {'page': max(1, (d['users'] - 1) // 10 - r.randrange(10)), 'size': 10}}
+        ), scale=0.25),
+        Scenario('permissions_group_all', lambda r, d: ('GET', '/permissions/group-all', {})),
+        Scenario('role_dispatch', lambda r, d: (
+            'PUT', f'/roles/dispatch-permission/{r.randrange(2, d["roles"] + 1)}',
+            {'json': {'permission_ids': r.sample(range(1, d['permissions'] + 1), r.randint(1, d['permissions']))}}
+        ), scale=0.25),
+        Scenario('users_change_status', lambda r, d: (
+            'PUT', f'/users/change_status/{r.randrange(2, d["users"] + 1)}', {'json': {'enable': r.random() < 0.5}}
+        ), scale=0.5),
+    ]
+
+
+async def run_scenario(client, scenario: Scenario, data: dict, headers: dict, total: int, concurrency: int) -> dict:
+    rand = random.Random(scenario.name)
+    latencies: list[float] = []
+    errors = 0
+    remain = total
+
+    async def worker():
+        nonlocal remain, errors
+        while remain > 0:
+            remain -= 1
+            method, url, kwargs = scenario.build(rand, data)
+            start = time.perf_counter()
+            resp = await client.request(method, url, headers=headers if scenario.auth else None, **kwargs)
+            latencies.append(time.perf_counter() - start)
+            if resp.status_code != 200 or resp.json().get('code') != 200:
+                errors += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*[worker() for _ in range(min(concurrency, total))])
+    return summarize(latencies, time.perf_counter() - start, errors)
+
+
+async def run(args) -> dict:
+    import httpx
+    from app import create_app
+
+    app = create_app()
+    async with app.router.lifespan_context(app):
+        data = await seed(args.users, args.roles)
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url='http://bench') as client:
+            resp = await client.post('/users/login', json={'name': BENCH_ADMIN, 'password': PASSWORD})
+            headers = {'Authorization': resp.json()['data']['token']}
+
+            results = {}
+            for scenario in build_scenarios():
+                if args.scenario and scenario.name not in args.scenario:
+                    continue
+                total = max(1, int(args.requests * scenario.scale))
+                # 预热，避免首次编译SQL等开销影响结果
+                await run_scenario(client, scenario, data, headers, min(total, 10), 1)
+                results[scenario.name] = await run_scenario(client, scenario, data, headers, total, args.concurrency)
+                print(f'{scenario.name}: {results[scenario.name]}', file=sys.stderr)
+
+    return {
+        'meta': {
+            'users': data['users'], 'roles': data['roles'], 'permissions': data['permissions'],
+            'requests': args.requests, 'concurrency': args.concurrency,
+            'python': platform.python_version(), 'time': time.strftime('%Y-%m-%d %H:%M:%S'),
+        },
+        'results': results,
+    }
+
+
+parser = ArgumentParser()
+parser.add_argument('--db', default=None, help='SQLite数据库路径，已经初始化过的数据库可以重复使用，默认使用临时目录')
+parser.add_argument('--users', type=int, default=100000, help='用户数')
+parser.add_argument('--roles', type=int, default=500, help='角色数')
+parser.add_argument('-n', '--requests', type=int, default=2000, help='每个场景的基准请求数')
+parser.add_argument('-c', '--concurrency', type=int, default=20, help='并发数')
+parser.add_argument('-s', '--scenario', action='append', help='只运行指定的场景，可以重复指定')
+parser.add_argument('-o', '--output', default=None, help='结果JSON保存路径，默认输出到标准输出')
+parser.add_argument('--compare', default=None, help='对比的基线JSON路径')
+parser.add_argument('--threshold', type=float, default=0.2, help='判定为回归的变化比例')
+parser.add_argument('--save-baseline', default=None, help='将结果保存为基线')
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as work_dir:
+        # 压测并发超过登录、搜索等分组的并发限制，关闭准入控制，只衡量接口本身的吞吐量和延迟
+        os.environ['APP_CONFIG'] = prepare_config(work_dir, args.db, {'admission': {'enabled': False}})
+        sys.path.insert(0, os.getcwd())
+        report = asyncio.run(run(args))
+
+    if args.output:
+        save_report(report, args.output)
+    else:
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+    if args.save_baseline:
+        save_report(report, args.save_baseline)
+    if args.compare:
+        regressions = compare_report(
+            report, args.compare, args.threshold, ('throughput',), ('p50_ms', 'p95_ms', 'p99_ms'), ('errors',)
+        )
+        for regression in regressions:
+            print(f'REGRESSION {regression}', file=sys.stderr)
+        sys.exit(1 if regressions else 0)
@@ -0,0 +1,163 @@
+'''
+热点函数微基准: 每个请求都会执行的鉴权、分页和序列化函数，输出每次调用的耗时(微秒)
+
+用法:
+    python -m benchmarks.micro                                                   # 运行全部用例，输出JSON
+    python -m benchmarks.micro --compare benchmarks/baselines/micro.json         # 和基线对比，有回归时退出码为1
+    python -m benchmarks.micro --save-baseline benchmarks/baselines/micro.json
+    python -m benchmarks.micro -k token                                          # 只运行名称包含token的用例
+'''
+import os
+import sys
+import json
+import time
+import timeit
+import platform
+import tempfile
+import statistics
+from typing import Callable
+from argparse import ArgumentParser
+from datetime import datetime
+
+from benchmarks.utils import prepare_config, save_report, compare_report
+
+
+def run_coroutine(coro):
+    ''' 直接驱动不会挂起的协程，避免事件循环的开销计入结果 '''
+    try:
+        coro.send(None)
+    except StopIteration as e:
+        return e.value
+    raise RuntimeError('coroutine suspended')
+
+
+def build_cases() -> dict[str, Callable[[], object]]:
+    ''' 构造用例，所有数据都在内存中，不访问数据库 '''
+    from starlette.requests import Request
+
+    from config import AUTH_CONFIG
+    from db import DBBaseModel
+    from common.auth import RoutePermission, generate_token, parse_token
+    from common.depends import get_query_params
+    from common.revocation import RevocationStore
+    from common.pagination import PaginationQuerySchema, build_pagination_statements
+    from common.permission_enum import MenuEnum, InterfaceEnum, ButtonEnum, PermissionEnum
+    from models.enums import GenderEnum, PermissionEnum as PermissionTypeEnum
+    from models.role import RoleModel
+    from models.user import UserModel
+    from models.permission import PermissionModel
+    from schemas.user import UserSchema
+
+    # 触发映射配置，之后可以在不绑定session的情况下构造模型对象
+    DBBaseModel.registry.configure()
+
+    now = datetime.now()
+    permissions = [
+        PermissionModel(id=i, name=item.value.name, code=item.value.code, type=type_)
+        for i, (item, type_) in enumerate(
+            [(item, PermissionTypeEnum.MENU) for item in MenuEnum]
+            + [(item, PermissionTypeEnum.INTERFACE) for item in InterfaceEnum]
+            + [(item, PermissionTypeEnum.BUTTON) for item in ButtonEnum],
+            start=1
+        )
+    ]
+    role = RoleModel(id=1, name='bench', code='bench', permissions=permissions)
+    interface_permission = RoutePermission(interface_list=[InterfaceEnum.USER_LIST])
+    # 最坏情况: 按钮和接口权限都不匹配，需要把所有判定都走一遍
+    missing_permission = RoutePermission(button_list=[list(ButtonEnum)[-1]], interface_list=[InterfaceEnum.MONITOR_GET])
+    missing_codes = PermissionEnum.get_codes(missing_permission.button_list + missing_permission.interface_list)
+    partial_role = RoleModel(id=2, name='partial', code='partial', permissions=[
+        item for item in permissions if item.code not in missing_codes
+    ])
+
+    secret, algorithm, expire = AUTH_CONFIG.jwt.secret_key, AUTH_CONFIG.jwt.algorithm, AUTH_CONFIG.jwt.expire_minute
+    token = generate_token({'uid': 1}, secret, expire, algorithm)
+    token_dict = parse_token(token, secret, algorithm)
+    # 已有一批吊销记录时，校验一个未吊销的令牌(布隆过滤器未命中)
+    revocation_store = RevocationStore(AUTH_CONFIG.revocation.bloom_capacity, AUTH_CONFIG.revocation.bloom_error_rate)
+    for i in range(1000):
+        revocation_store.add(f'revoked{i}', token_dict['exp'])
+
+    query_scope = {
+        'type': 'http', 'method': 'GET', 'path': '/users/list', 'headers': [],
+        'query_string': b'page=3&size=20&name=user&enable=true&rid=2',
+    }
+    pagination_query = PaginationQuerySchema(page=3, size=20, query={'name': 'user', 'rid': 2, 'is_delete': True})
+
+    users = [
+        UserModel(
+            id=i, uuid='2c7ad1d5-4b4f-4bcd-9e8c-6f4a0f3f2a1b', ctime=now, utime=now, created_by=None, updated_by=None,
+            enable=True, name=f'user{i}', nickname=f'nick{i}', gender=GenderEnum.UNKNOWN, email=f'user{i}@example.com',
+            phone=f'1{i:010d}', avatar=None, address=None, introduce=None,
+        )
+        for i in range(10)
+    ]
+
+    return {
+        'check_permission_allow': lambda: interface_permission.check_permission(role),
+        'check_permission_deny': lambda: missing_permission.check_permission(partial_role),
+        'group_permission': lambda: PermissionModel.group_permission(permissions),
+        'generate_token': lambda: generate_token({'uid': 1}, secret, expire, algorithm),
+        'parse_token': lambda: parse_token(token, secret, algorithm),
+        'token_revocation_check': lambda: revocation_store.is_revoked(token_dict['jti']),
+        'get_query_params': lambda: run_coroutine(get_query_params(Request(query_scope))),
+        'pagination_statements': lambda: build_pagination_statements(UserModel, pagination_query),
+        'schema_serialize_page': lambda: [UserSchema.model_validate(user).model_dump() for user in users],
+    }
+
+
+def measure(func: Callable[[], object], repeat: int, min_time: float) -> dict:
+    ''' 自动确定循环次数使单轮耗时不少于min_time，多轮取中位数和最小值 '''
+    timer = timeit.Timer(func)
+    number, _ = timer.autorange()
+    number = max(1, int(number * min_time / 0.2))
+    results = [t / number * 1e6 for t in timer.repeat(repeat=repeat, number=number)]
+    return {
+        'number': number,
+        'repeat': repeat,
+        'min_us': round(min(results), 3),
+        'median_us': round(statistics.median(results), 3),
+    }
+
+
+def run(args) -> dict:
+    cases = build_cases()
+    results = {}
+    for name, func in cases.items():
+        if args.keyword and not any(keyword in name for keyword in args.keyword):
+            continue
+        results[name] = measure(func, args.repeat, args.min_time)
+        print(f'{name}: {results[name]}', file=sys.stderr)
+    return {
+        'meta': {'python': platform.python_version(), 'time': time.strftime('%Y-%m-%d %H:%M:%S')},
+        'results': results,
+    }
+
+
+parser = ArgumentParser()
+parser.add_argument('-k', '--keyword', action='append', help='只运行名称包含关键字的用例，可以重复指定')
+parser.add_argument('-r', '--repeat', type=int, default=7, help='每个用例的测量轮数')
+parser.add_argument('--min-time', type=float, default=0.2, help='每轮的最短耗时(秒)')
+parser.add_argument('-o', '--output', default=None, help='结果JSON保存路径，默认输出到标准输出')
+parser.add_argument('--compare', default=None, help='对比的基线JSON路径')
+parser.add_argument('--threshold', type=float, default=0.2, help='判定为回归的变化比例')
+parser.add_argument('--save-baseline', default=None, help='将结果保存为基线')
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as work_dir:
+        os.environ['APP_CONFIG'] = prepare_config(work_dir)
+        sys.path.insert(0, os.getcwd())
+        report = run(args)
+
+    if args.output:
+        save_report(report, args.output)
+    else:
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+    if args.save_baseline:
+        save_report(report, args.save_baseline)
+    if args.compare:
+        regressions = compare_report(report, args.compare, args.threshold, (), ('median_us',))
+        for regression in regressions:
+            print(f'REGRESSION {regression}', file=sys.stderr)
+        sys.exit(1 if regressions else 0)
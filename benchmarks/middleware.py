@@ -0,0 +1,56 @@
+'''
+中间件压测脚本: 在进程内通过ASGI客户端反复请求 /users/info，输出每秒请求数
+
+用法: python -m benchmarks.middleware -n 5000 -c 50
+'''
+import os
+import sys
+import time
+import asyncio
+import tempfile
+from argparse import ArgumentParser
+
+from benchmarks.utils import prepare_config
+
+
+async def run(total: int, concurrency: int) -> float:
+    import httpx
+    from app import create_app
+    from scripts.data_manage import create_superadmin
+
+    app = create_app()
+    async with app.router.lifespan_context(app):
+        await create_superadmin(name='bench', password='bench123')
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url='http://bench') as client:
+            resp = await client.post('/users/login', json={'name': 'bench', 'password': 'bench123'})
+            headers = {'Authorization': resp.json()['data']['token']}
+            # 预热
+            for _ in range(20):
+                await client.get('/users/info', headers=headers)
+
+            remain = total
+
+            async def worker():
+                nonlocal remain
+                while remain > 0:
+                    remain -= 1
+                    resp = await client.get('/users/info', headers=headers)
+                    assert resp.json()['code'] == 200, resp.text
+
+            start = time.perf_counter()
+            await asyncio.gather(*[worker() for _ in range(concurrency)])
+            return total / (time.perf_counter() - start)
+
+
+parser = ArgumentParser()
+parser.add_argument('-n', '--total', type=int, default=5000, help='请求总数')
+parser.add_argument('-c', '--concurrency', type=int, default=50, help='并发数')
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as work_dir:
+        os.environ['APP_CONFIG'] = prepare_config(work_dir)
+        sys.path.insert(0, os.getcwd())
+        rps = asyncio.run(run(args.total, args.concurrency))
+        print(f'/users/info: {rps:.1f} req/s ({args.total} requests, concurrency {args.concurrency})')
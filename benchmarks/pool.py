@@ -0,0 +1,100 @@
+'''
+连接池压力检查: 并发数超过连接池容量时，按ID批量加载(dataloader)等路径不能出现持有连接等待另一个连接的死锁
+
+用法:
+    python -m benchmarks.pool --db /tmp/bench.db            # 有请求超时或者结束后连接没有全部归还时退出码为1
+    python -m benchmarks.pool --db /tmp/bench.db -c 60
+
+请求截止时间缩短为--timeout秒，死锁的请求会以超时结束而不是一直挂起
+'''
+import os
+import sys
+import time
+import random
+import asyncio
+import tempfile
+from argparse import ArgumentParser
+
+from benchmarks.utils import prepare_config
+from benchmarks.seed import seed, BENCH_ADMIN, PASSWORD
+
+
+# 名称 => 根据随机数生成器返回一次请求的(method, url, kwargs)，都是在请求session中查询后再按ID加载角色或用户的接口
+SCENARIOS = {
+    'role_dispatch': lambda r, d: (
+        'PUT', f'/roles/dispatch-permission/{r.randrange(2, d["roles"] + 1)}',
+        {'json': {'permission_ids': r.sample(range(1, d['permissions'] + 1), r.randint(1, d['permissions']))}}
+    ),
+    'user_dispatch_role': lambda r, d: (
+        'POST', f'/users/dispatch/{r.randrange(2, d["users"] + 1)}', {'json': {'rid': r.randrange(2, d['roles'] + 1)}}
+    ),
+    'user_update': lambda r, d: ('PUT', f'/users/{r.randrange(2, d["users"] + 1)}', {'json': {'nickname': 'pool'}}),
+}
+
+
+async def run(args) -> list[str]:
+    import httpx
+    from app import create_app
+    from db import async_engine
+
+    app = create_app()
+    pool = async_engine.sync_engine.pool
+    async with app.router.lifespan_context(app):
+        data = await seed(args.users, args.roles)
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url='http://bench', timeout=None) as client:
+            resp = await client.post('/users/login', json={'name': BENCH_ADMIN, 'password': PASSWORD})
+            headers = {'Authorization': resp.json()['data']['token']}
+            errors = []
+            for name, build in SCENARIOS.items():
+                # 每个场景单独以全部并发执行，所有请求同时持有连接并等待批量加载时才会出现死锁
+                rand = random.Random(name)
+                timeouts, codes, remain, max_checked_out = 0, {}, args.requests, 0
+
+                async def worker() -> None:
+                    nonlocal remain, timeouts, max_checked_out
+                    while remain > 0:
+                        remain -= 1
+                        method, url, kwargs = build(rand, data)
+                        resp = await client.request(method, url, headers=headers, **kwargs)
+                        is_json = resp.headers.get('content-type', '').startswith('application/json')
+                        code = resp.json().get('code') if is_json else resp.status_code
+                        codes[code] = codes.get(code, 0) + 1
+                        if resp.status_code == 504 or code == 504:
+                            timeouts += 1
+                        max_checked_out = max(max_checked_out, pool.checkedout())
+
+                start = time.perf_counter()
+                await asyncio.gather(*[worker() for _ in range(args.concurrency)])
+                print(
+                    f'{name}: {args.requests} requests in {time.perf_counter() - start:.2f}s, codes: {codes}, '
+                    f'max checked out: {max_checked_out}', file=sys.stderr
+                )
+                if timeouts:
+                    errors.append(f'{name}: {timeouts}个请求超时，可能存在持有连接等待另一个连接的死锁')
+
+        print(f'concurrency: {args.concurrency}, {pool.status()}', file=sys.stderr)
+        if pool.checkedout():
+            errors.append(f'请求结束后仍有{pool.checkedout()}个连接没有归还')
+        return errors
+
+
+parser = ArgumentParser()
+parser.add_argument('--db', default=None, help='SQLite数据库路径，已经初始化过的数据库可以重复使用，默认使用临时目录')
+parser.add_argument('--users', type=int, default=5000, help='用户数')
+parser.add_argument('--roles', type=int, default=50, help='角色数')
+parser.add_argument('-n', '--requests', type=int, default=100, help='每个场景的请求数')
+parser.add_argument('-c', '--concurrency', type=int, default=40, help='并发数，需要大于连接池容量(pool_size + max_overflow，默认15)')
+parser.add_argument('--timeout', type=float, default=10.0, help='请求截止时间(秒)')
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as work_dir:
+        config_path = prepare_config(work_dir, args.db, {'deadline': {'default_timeout': args.timeout}})
+        os.environ['APP_CONFIG'] = config_path
+        sys.path.insert(0, os.getcwd())
+        errors = asyncio.run(run(args))
+
+    for error in errors:
+        print(f'FAIL {error}', file=sys.stderr)
+    print('pool check ok' if not errors else f'{len(errors)} problem(s)', file=sys.stderr)
+    sys.exit(1 if errors else 0)
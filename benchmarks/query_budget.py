@@ -0,0 +1,225 @@
+'''
+SQL语句数预算检查: 基于create_app()和一个小的SQLite数据库，依次请求router_list中的每个路由，断言单次请求的语句数没有超出路由的预算
+
+用法:
+    python -m benchmarks.query_budget               # 有路由超出预算、没有定义预算或者没有被请求到时退出码为1
+    python -m benchmarks.query_budget --verbose     # 同时输出每个路由的语句数和预算
+
+请求分两轮: 超级管理员(数据范围为全部)以及数据范围为本部门及下级的部门管理员，
+后者的按ID查询不经过批量加载，语句数通常更多
+'''
+import os
+import sys
+import asyncio
+import tempfile
+from typing import Any, Iterator, Optional
+from argparse import ArgumentParser
+from contextlib import contextmanager
+
+from benchmarks.utils import prepare_config
+from benchmarks.seed import seed, BENCH_ADMIN, PASSWORD
+
+PNG = b'\x89PNG\r\n\x1a\n' + bytes(range(256)) * 4
+
+
+def iter_routes(router_list: list) -> Iterator[tuple[str, str, Any]]:
+    ''' 遍历router_list中的路由，返回(method, 完整路径, 路由) '''
+    for route_info in router_list:
+        for route in route_info.router.routes:
+            for method in sorted(getattr(route, 'methods', None) or []):
+                yield method, route_info.prefix + route.path, route
+
+
+@contextmanager
+def collect_statement_counts(engine: Any) -> Iterator[dict[tuple[str, str], int]]:
+    ''' 在上下文中收集各个路由单次请求执行的最大语句数，(method, route) => count '''
+    from sqlalchemy import event
+    from common.context import get_request_context, get_route_path
+
+    counts: dict[tuple[str, str], int] = {}
+
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany) -> None:
+        # 在SQL监控之后注册，此时请求上下文中的语句数已经累加
+        ctx = get_request_context()
+        if ctx is None or ctx.scope.get('route') is None:
+            return
+        key = (ctx.scope['method'], get_route_path(ctx.scope['route']))
+        counts[key] = max(counts.get(key, 0), ctx.statement_count)
+
+    event.listen(engine.sync_engine, 'after_cursor_execute', after_cursor_execute)
+    try:
+        yield counts
+    finally:
+        event.remove(engine.sync_engine, 'after_cursor_execute', after_cursor_execute)
+
+
+def check_query_budgets(router_list: list, counts: dict[tuple[str, str], int], visited: set[tuple[str, str]]) -> list[str]:
+    ''' 返回问题列表: 路由没有定义预算、没有被请求到或者语句数超出预算 '''
+    from common.query_budget import get_max_statements
+
+    errors = []
+    for method, path, route in iter_routes(router_list):
+        max_statements = get_max_statements(route)
+        if max_statements is None:
+            errors.append(f'{method} {path}: 没有定义SQL语句数预算')
+            continue
+        if (method, path) not in visited:
+            errors.append(f'{method} {path}: 没有被请求到，需要在build_requests中补充')
+            continue
+        count = counts.get((method, path), 0)
+        if count > max_statements:
+            errors.append(f'{method} {path}: 执行了{count}条SQL，超出预算{max_statements}')
+    return errors
+
+
+class Runner:
+    ''' 发送请求并记录请求到的路由，响应不是预期的结果时记为错误 '''
+    def __init__(self, client: Any) -> None:
+        self.client = client
+        self.visited: set[tuple[str, str]] = set()
+        self.errors: list[str] = []
+
+    def wrap(self, app: Any) -> Any:
+        ''' 包装ASGI应用，路由匹配后会把route写回同一个scope，请求结束时记录 '''
+        from common.context import get_route_path
+
+        async def recording_app(scope, receive, send) -> None:
+            await app(scope, receive, send)
+            if scope['type'] == 'http' and scope.get('route') is not None:
+                self.visited.add((scope['method'], get_route_path(scope['route'])))
+        return recording_app
+
+    async def call(self, method: str, url: str, headers: Optional[dict] = None, expect_fail: bool = False, **kwargs) -> Any:
+        resp = await self.client.request(method, url, headers=headers, **kwargs)
+        if 'application/json' not in resp.headers.get('content-type', ''):
+            if resp.status_code != 200 and not expect_fail:
+                self.errors.append(f'{method} {url}: HTTP {resp.status_code}')
+            return None
+        body = resp.json()
+        if body.get('code') != 200 and not expect_fail:
+            self.errors.append(f'{method} {url}: {body.get("code")} {body.get("msg")}')
+        return body.get('data')
+
+
+async def build_requests(runner: Runner) -> None:
+    ''' 按依赖顺序请求每一个路由，新增路由时需要在这里补充 '''
+    call = runner.call
+    token = (await call('POST', '/users/login', json={'name': BENCH_ADMIN, 'password': PASSWORD}))['token']
+    admin = {'Authorization': token}
+
+    # 超级管理员
+    await call('GET', '/users/info', admin)
+    await call('GET', '/users/list', admin, params={'page': 1, 'size': 10})
+    await call('GET', '/users/export', admin)
+    root = await call('POST', '/departments/', admin, json={'name': 'budget-root'})
+    child = await call('POST', '/departments/', admin, json={'name': 'budget-child', 'parent_id': root['id']})
+    await call('GET', '/departments/all', admin)
+
+    role = await call('POST', '/roles/', admin, json={
+        'name': 'budget-manager', 'code': 'budget-manager', 'enable': True, 'desc': None, 'data_scope': 'dept_tree'
+    })
+    await call('GET', '/roles/all', admin)
+    await call('GET', '/roles/list', admin)
+    await call('GET', '/roles/export', admin)
+    await call('GET', f'/roles/{role["id"]}', admin)
+    await call('PUT', f'/roles/{role["id"]}', admin, json={'name': 'budget-manager', 'code': 'budget-manager', 'desc': 'x'})
+    permissions = await call('GET', '/permissions/all', admin)
+    await call('PUT', f'/roles/dispatch-permission/{role["id"]}', admin, json={'permission_ids': [p['id'] for p in permissions]})
+
+    manager = await call('POST', '/users/', admin, json={'name': 'budget-manager', 'password': PASSWORD, 'did': root['id']})
+    member = await call('POST', '/users/', admin, json={'name': 'budget-member', 'password': PASSWORD, 'did': child['id']})
+    await call('POST', f'/users/dispatch/{manager["id"]}', admin, json={'rid': role['id']})
+    await call('GET', f'/users/{member["id"]}', admin)
+    await call('PUT', f'/users/{member["id"]}', admin, json={'nickname': 'member'})
+    await call('PUT', f'/users/change_status/{member["id"]}', admin, json={'enable': True})
+    await call('POST', '/users/update', admin, json={'nickname': 'admin'})
+    await call('POST', '/users/change-pwd', admin, json={'password': PASSWORD})
+    await call('POST', '/users/upload-avatar', admin, files={'avatar_file': ('avatar.png', PNG, 'image/png')})
+
+    await call('GET', '/permissions/group-all', admin)
+    await call('GET', '/permissions/list', admin)
+    await call('GET', '/permissions/export', admin)
+    permission = await call('POST', '/permissions/', admin, json={'name': 'budget', 'code': 'budget', 'type': 'menu', 'desc': None})
+    await call('PUT', f'/permissions/{permission["id"]}', admin, json={'desc': 'x'})
+    await call('DELETE', f'/permissions/{permission["id"]}', admin)
+
+    await call('GET', '/metrics', admin)
+    await call('GET', '/monitor/slow-queries', admin)
+    await call('GET', '/monitor/profiles', admin)
+    # 没有开启剖析时不存在剖析结果，只需要覆盖路由
+    await call('GET', '/monitor/profiles/none', admin, expect_fail=True)
+    await call('GET', '/monitor/profiles/none/download', admin, expect_fail=True)
+    await call('POST', '/batch', admin, json={'requests': [
+        {'method': 'GET', 'path': '/users/info'}, {'method': 'GET', 'path': '/roles/all'},
+    ]})
+
+    # 部门管理员，查询附加数据范围条件
+    token = (await call('POST', '/users/login', json={'name': 'budget-manager', 'password': PASSWORD}))['token']
+    scoped = {'Authorization': token}
+    await call('GET', '/users/info', scoped)
+    await call('GET', '/users/list', scoped, params={'page': 1, 'size': 10})
+    await call('GET', '/users/export', scoped)
+    await call('GET', '/departments/all', scoped)
+    await call('GET', f'/users/{member["id"]}', scoped)
+    await call('PUT', f'/users/{member["id"]}', scoped, json={'nickname': 'scoped'})
+    await call('PUT', f'/users/change_status/{member["id"]}', scoped, json={'enable': True})
+    await call('POST', '/departments/', scoped, json={'name': 'budget-grandchild', 'parent_id': child['id']})
+    created = await call('POST', '/users/', scoped, json={'name': 'budget-created', 'password': PASSWORD, 'did': child['id']})
+    await call('DELETE', f'/users/{created["id"]}', scoped)
+    await call('POST', '/users/logout', scoped)
+
+    await call('DELETE', f'/users/{member["id"]}', admin)
+    await call('DELETE', f'/roles/{role["id"]}', admin)
+    await call('POST', '/users/logout', admin)
+
+
+def use_work_dir_static(config_path: str, work_dir: str) -> None:
+    ''' 上传的头像写入临时目录，不污染项目中的静态资源目录 '''
+    import toml
+    with open(config_path, 'r', encoding='utf-8') as fp:
+        config = toml.load(fp)
+    config['env']['source_dir'] = os.path.join(work_dir, 'static')
+    with open(config_path, 'w', encoding='utf-8') as fp:
+        toml.dump(config, fp)
+
+
+async def run(args) -> list[str]:
+    import httpx
+    from app import create_app
+    from apis import router_list
+    from db import async_engine
+
+    app = create_app()
+    async with app.router.lifespan_context(app):
+        await seed(args.users, args.roles)
+        runner = Runner(None)
+        transport = httpx.ASGITransport(app=runner.wrap(app))
+        async with httpx.AsyncClient(transport=transport, base_url='http://budget') as client:
+            runner.client = client
+            with collect_statement_counts(async_engine) as counts:
+                await build_requests(runner)
+
+    if args.verbose:
+        for method, path, route in iter_routes(router_list):
+            from common.query_budget import get_max_statements
+            print(f'{method:6} {path:45} {counts.get((method, path), 0):3} / {get_max_statements(route)}', file=sys.stderr)
+    return runner.errors + check_query_budgets(router_list, counts, runner.visited)
+
+
+parser = ArgumentParser()
+parser.add_argument('--users', type=int, default=50, help='用户数')
+parser.add_argument('--roles', type=int, default=5, help='角色数')
+parser.add_argument('-v', '--verbose', action='store_true', help='输出每个路由的语句数和预算')
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as work_dir:
+        os.environ['APP_CONFIG'] = prepare_config(work_dir)
+        use_work_dir_static(os.environ['APP_CONFIG'], work_dir)
+        sys.path.insert(0, os.getcwd())
+        errors = asyncio.run(run(args))
+
+    for error in errors:
+        print(f'FAIL {error}', file=sys.stderr)
+    print('query budgets ok' if not errors else f'{len(errors)} problem(s)', file=sys.stderr)
+    sys.exit(1 if errors else 0)
@@ -0,0 +1,71 @@
+'''
+压测数据: 完整的权限目录、超级管理员、指定数量的角色和用户
+
+所有用户使用同一个密码，只加密一次，避免初始化数据时大量调用bcrypt
+'''
+import random
+from datetime import datetime
+
+BENCH_ADMIN = 'bench-admin'
+PASSWORD = 'bench123'
+CHUNK_SIZE = 5000
+
+
+def user_name(index: int) -> str:
+    return f'user{index:07d}'
+
+
+async def seed(users: int, roles: int, seed: int = 2024) -> dict:
+    ''' 初始化压测数据，已经初始化过的数据库直接跳过，返回数据概况 '''
+    from sqlalchemy import insert, select, func
+
+    from config import AUTH_CONFIG
+    from db import async_engine, AsyncSessionLocal, DBBaseModel
+    from models.user import UserModel
+    from models.role import RoleModel
+    from models.permission import PermissionModel
+    from models.role_permission import RolePermissionModel
+    from scripts.data_manage import insert_permission, build_superadmin_role
+
+    async with async_engine.begin() as connect:
+        await connect.run_sync(DBBaseModel.metadata.create_all)
+    await insert_permission()
+    await build_superadmin_role()
+
+    rand = random.Random(seed)
+    async with AsyncSessionLocal() as session:
+        user_count = await session.scalar(select(func.count()).select_from(UserModel))
+        role_count = await session.scalar(select(func.count()).select_from(RoleModel))
+        permission_ids = list(await session.scalars(select(PermissionModel.id)))
+        if user_count and user_count >= users and role_count and role_count > roles:
+            return {'users': user_count, 'roles': role_count, 'permissions': len(permission_ids), 'seeded': False}
+
+        # 角色以及角色权限
+        now = datetime.now()
+        await session.execute(insert(RoleModel), [
+            {'name': f'bench-role-{i}', 'code': f'bench-role-{i}', 'desc': 'benchmark role', 'ctime': now, 'utime': now}
+            for i in range(roles)
+        ])
+        role_ids = list(await session.scalars(select(RoleModel.id).filter(RoleModel.code.like('bench-role-%'))))
+        role_permissions = []
+        for rid in role_ids:
+            for pid in rand.sample(permission_ids, rand.randint(1, len(permission_ids))):
+                role_permissions.append({'rid': rid, 'pid': pid})
+        await session.execute(insert(RolePermissionModel), role_permissions)
+        await session.commit()
+
+        # 用户，按批次写入，避免单个事务过大
+        hashed_password = UserModel.pwd_context.hash(PASSWORD)
+        super_admin = await session.scalar(select(RoleModel.id).filter_by(code=AUTH_CONFIG.manage.super_admin_code))
+        await session.execute(insert(UserModel), [{'name': BENCH_ADMIN, 'hashed_password': hashed_password, 'rid': super_admin}])
+        for start in range(0, users, CHUNK_SIZE):
+            await session.execute(insert(UserModel), [
+                {
+                    'name': user_name(i), 'nickname': f'nick{i}', 'hashed_password': hashed_password,
+                    'email': f'{user_name(i)}@example.com', 'phone': f'1{i:010d}', 'rid': rand.choice(role_ids),
+                    'ctime': now, 'utime': now,
+                }
+                for i in range(start, min(start + CHUNK_SIZE, users))
+            ])
+            await session.commit()
+        return {'users': users + 1, 'roles': len(role_ids) + 1, 'permissions': len(permission_ids), 'seeded': True}
@@ -0,0 +1,76 @@
+'''
+压测公共方法: 生成独立配置、统计延迟分位数、保存和对比基线
+'''
+import os
+import json
+import toml
+from typing import Optional
+
+
+def prepare_config(work_dir: str, db_path: Optional[str] = None, overrides: Optional[dict] = None) -> str:
+    ''' 基于默认配置生成压测专用的配置文件，使用独立的SQLite数据库、关闭调试日志和限流(压测请求都来自同一个IP)
+    overrides按配置节覆盖其中的配置项，例如{'deadline': {'default_timeout': 10}}
+    '''
+    with open('config.toml', 'r', encoding='utf-8') as fp:
+        config = toml.load(fp)
+    db_path = os.path.abspath(db_path or os.path.join(work_dir, 'bench.db'))
+    config['db']['url'] = f'sqlite+aiosqlite:///{db_path}'
+    config['db']['echo'] = False
+    config['log']['level'] = 'WARNING'
+    config.setdefault('rate_limit', {})['enabled'] = False
+    for section, values in (overrides or {}).items():
+        config.setdefault(section, {}).update(values)
+    config_path = os.path.join(work_dir, 'config.toml')
+    with open(config_path, 'w', encoding='utf-8') as fp:
+        toml.dump(config, fp)
+    return config_path
+
+
+def percentile(sorted_values: list[float], p: float) -> float:
+    ''' 最近秩法计算分位数，sorted_values需要已经排序 '''
+    if not sorted_values:
+        return 0.0
+    index = max(0, min(len(sorted_values) - 1, int(round(p / 100 * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[index]
+
+
+def summarize(latencies: list[float], elapsed: float, errors: int) -> dict:
+    ''' 汇总单个场景的吞吐量和延迟(毫秒) '''
+    values = sorted(latencies)
+    return {
+        'requests': len(values),
+        'errors': errors,
+        'throughput': round(len(values) / elapsed, 2) if elapsed else 0.0,
+        'p50_ms': round(percentile(values, 50) * 1000, 3),
+        'p95_ms': round(percentile(values, 95) * 1000, 3),
+        'p99_ms': round(percentile(values, 99) * 1000, 3),
+    }
+
+
+def save_report(report: dict, path: str) -> None:
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, 'w', encoding='utf-8') as fp:
+        json.dump(report, fp, ensure_ascii=False, indent=2)
+
+
+def compare_report(report: dict, baseline_path: str, threshold: float, higher_is_better: tuple[str, ...],
+                   lower_is_better: tuple[str, ...], no_increase: tuple[str, ...] = ('errors',)) -> list[str]:
+    ''' 和基线对比，指标变差超过阈值(比例)的记为回归，no_increase中的指标(错误数)不允许有任何增加，返回回归描述列表 '''
+    with open(baseline_path, 'r', encoding='utf-8') as fp:
+        baseline = json.load(fp)
+
+    regressions = []
+    for name, result in report['results'].items():
+        base = baseline.get('results', {}).get(name)
+        if base is None:
+            continue
+        for key in higher_is_better:
+            if base.get(key) and result[key] < base[key] * (1 - threshold):
+                regressions.append(f'{name}.{key}: {base[key]} -> {result[key]}')
+        for key in lower_is_better:
+            if base.get(key) and result[key] > base[key] * (1 + threshold):
+                regressions.append(f'{name}.{key}: {base[key]} -> {result[key]}')
+        for key in no_increase:
+            if result.get(key, 0) > base.get(key, 0):
+                regressions.append(f'{name}.{key}: {base.get(key, 0)} -> {result[key]}')
+    return regressions
@@ -0,0 +1,132 @@
+'''
+准入控制: 按路由分组限制并发(舱壁)，昂贵的路由过载时不会拖慢其他路由
+
+路由通过openapi_extra声明所属分组，分组的并发数、排队长度和排队时间在配置文件[admission.groups]中定义:
+    openapi_extra=RoutePermission(...).to_openapi_extra() | Bulkhead(group='export').to_openapi_extra()
+
+- 分组内正在处理的请求达到并发上限时，新请求排队等待
+- 排队已满时立即拒绝，排队超过等待预算时拒绝，返回统一格式的失败响应，客户端可以按Retry-After重试
+- 作为app的全局依赖在权限校验之前执行，并发名额覆盖权限校验、接口处理以及响应发送(包括流式响应)
+'''
+import time
+import asyncio
+from collections import deque
+from typing import Any, AsyncIterator, Optional
+
+from pydantic import BaseModel, Field
+from fastapi import Request
+
+from config import ADMISSION_CONFIG, BulkheadConfig
+from common.log import logger
+from common.metrics import ADMISSION_ACTIVE, ADMISSION_QUEUED, ADMISSION_SHED, ADMISSION_WAIT
+from common.exception import OverloadException
+
+
+class Bulkhead(BaseModel):
+    ''' 路由所属的并发分组 '''
+    group: str = Field(description='分组名称，对应配置文件中[admission.groups]下的配置')
+
+    def to_openapi_extra(self) -> dict:
+        return {self.get_extra_key(): self.model_dump()}
+
+    @classmethod
+    def get_extra_key(cls) -> str:
+        return 'bulkhead'
+
+    @classmethod
+    def from_route(cls, route: Any) -> Optional['Bulkhead']:
+        data = (getattr(route, 'openapi_extra', None) or {}).get(cls.get_extra_key())
+        return cls(**data) if data else None
+
+
+class ConcurrencyLimiter:
+    ''' 带有限排队的并发限制，只在事件循环线程中使用；释放时把名额直接交给最早的等待者，保证先来先服务 '''
+    def __init__(self, name: str, config: BulkheadConfig) -> None:
+        self.name = name
+        self.max_concurrency = config.max_concurrency
+        self.max_queue = config.max_queue
+        self.max_wait = config.max_wait
+        self.active = 0
+        self.waiters: deque[asyncio.Future] = deque()
+
+    async def acquire(self) -> None:
+        if self.active < self.max_concurrency and not self.waiters:
+            self.active += 1
+            ADMISSION_ACTIVE.set(self.active, (self.name,))
+            return
+        if len(self.waiters) >= self.max_queue:
+            self.shed('queue_full')
+
+        future = asyncio.get_running_loop().create_future()
+        self.waiters.append(future)
+        ADMISSION_QUEUED.set(len(self.waiters), (self.name,))
+        start = time.perf_counter()
+        try:
+            await asyncio.wait_for(asyncio.shield(future), self.max_wait)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            if future.done() and not future.cancelled():
+                # 超时的同时拿到了名额，需要交还
+                self.release()
+            else:
+                future.cancel()
+                self.waiters.remove(future)
+                ADMISSION_QUEUED.set(len(self.waiters), (self.name,))
+            if isinstance(e, asyncio.CancelledError):
+                raise
+            self.shed('timeout')
+        finally:
+            ADMISSION_WAIT.observe(time.perf_counter() - start, (self.name,))
+
+    def release(self) -> None:
+        while self.waiters:
+            future = self.waiters.popleft()
+            if not future.done():
+                # 名额直接交给等待者，active不变
+                future.set_result(None)
+                ADMISSION_QUEUED.set(len(self.waiters), (self.name,))
+                return
+        self.active -= 1
+        ADMISSION_ACTIVE.set(self.active, (self.name,))
+
+    def shed(self, reason: str) -> None:
+        ADMISSION_SHED.inc((self.name, reason))
+        raise OverloadException('服务繁忙，请稍后重试', retry_after=max(1.0, self.max_wait))
+
+
+limiters: dict[str, ConcurrencyLimiter] = {}
+# 路由对象 => 分组的并发限制，避免每次请求都重新解析openapi_extra
+route_limiters: dict[int, Optional[ConcurrencyLimiter]] = {}
+
+
+def get_limiter(group: str) -> Optional[ConcurrencyLimiter]:
+    if group not in limiters:
+        config = ADMISSION_CONFIG.groups.get(group)
+        if config is None:
+            logger.warning('bulkhead group %s is not configured, requests are not limited', group)
+            return None
+        limiters[group] = ConcurrencyLimiter(group, config)
+    return limiters[group]
+
+
+def get_route_limiter(route: Any) -> Optional[ConcurrencyLimiter]:
+    key = id(route)
+    if key not in route_limiters:
+        bulkhead = Bulkhead.from_route(route)
+        route_limiters[key] = get_limiter(bulkhead.group) if bulkhead else None
+    return route_limiters[key]
+
+
+async def admission_control(request: Request) -> AsyncIterator[None]:
+    ''' 全局依赖，在check_permission之前执行
+    带yield的依赖在响应发送完成(包括流式响应)后才退出，因此并发名额覆盖整个请求
+    '''
+    route = request.scope.get('route')
+    limiter = get_route_limiter(route) if ADMISSION_CONFIG.enabled and route is not None else None
+    if limiter is None:
+        yield
+        return
+    await limiter.acquire()
+    try:
+        yield
+    finally:
+        limiter.release()
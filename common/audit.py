@@ -0,0 +1,142 @@
+'''
+审计日志: 写在请求之后(write-behind)
+
+- 请求中调用record_audit只把事件放入内存队列，不会给请求增加INSERT
+- 后台任务按批次(batch_size条或flush_interval秒)批量写入audit_log表，队列满时丢弃新事件并计数
+- lifespan结束时停止后台任务并写入队列中剩余的事件
+- 操作人来自check_permission校验通过的用户，同时用于填充created_by和updated_by
+'''
+import asyncio
+from datetime import datetime
+from typing import Any, Optional
+
+from sqlalchemy import event, insert
+from sqlalchemy.orm import Session
+
+from config import AUDIT_CONFIG
+from db import AsyncSessionLocal, DBBaseModel
+from common.log import logger
+from common.metrics import AUDIT_EVENTS
+from common.context import get_request_context
+from models.audit import AuditLogModel
+
+
+def get_current_user_id() -> Optional[int]:
+    ''' 当前请求中已经通过权限校验的用户ID，不在请求中或者接口不需要登录时返回None '''
+    ctx = get_request_context()
+    return ctx.user_id if ctx is not None else None
+
+
+@event.listens_for(Session, 'before_flush')
+def fill_operator(session: Session, flush_context, instances) -> None:
+    ''' 写入数据前根据当前用户填充创建者和更新者 '''
+    user_id = get_current_user_id()
+    if user_id is None:
+        return
+    for obj in session.new:
+        if isinstance(obj, DBBaseModel):
+            obj.created_by = obj.created_by or user_id
+            obj.updated_by = user_id
+    for obj in session.dirty:
+        if isinstance(obj, DBBaseModel) and session.is_modified(obj, include_collections=False):
+            obj.updated_by = user_id
+
+
+class AuditWriter:
+    ''' 审计事件队列以及批量写入的后台任务 '''
+    def __init__(self, queue_size: int, batch_size: int, flush_interval: float) -> None:
+        self.queue: asyncio.Queue[dict] = asyncio.Queue(maxsize=queue_size)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.task: Optional[asyncio.Task] = None
+        self.batch: list[dict] = []     # 后台任务中正在合并、尚未开始写入的批次
+        self.writing: Optional[asyncio.Task] = None     # 正在写入的批次
+
+    def put(self, item: dict) -> None:
+        try:
+            self.queue.put_nowait(item)
+        except asyncio.QueueFull:
+            AUDIT_EVENTS.inc(('dropped',))
+
+    def drain(self, batch: list[dict]) -> list[dict]:
+        while len(batch) < self.batch_size and not self.queue.empty():
+            batch.append(self.queue.get_nowait())
+        return batch
+
+    async def run(self) -> None:
+        while True:
+            self.batch = self.drain([await self.queue.get()])
+            if len(self.batch) < self.batch_size:
+                # 等待一个间隔再写入，让同一时间段内的事件合并为一次INSERT
+                await asyncio.sleep(self.flush_interval)
+                self.drain(self.batch)
+            # 批次交给写入任务后不再属于self.batch，后台任务在写入时被取消也不会由stop重复写入
+            batch, self.batch = self.batch, []
+            self.writing = asyncio.create_task(self.write(batch))
+            await asyncio.shield(self.writing)
+            self.writing = None
+
+    async def write(self, batch: list[dict]) -> None:
+        try:
+            async with AsyncSessionLocal() as session:
+                await session.execute(insert(AuditLogModel.__table__), batch)
+                await session.commit()
+            AUDIT_EVENTS.inc(('written',), len(batch))
+        except Exception as e:
+            AUDIT_EVENTS.inc(('failed',), len(batch))
+            logger.error('write %s audit events fail, detail is %s', len(batch), e)
+
+    def start(self) -> None:
+        self.task = asyncio.create_task(self.run())
+
+    async def stop(self) -> None:
+        ''' 停止后台任务，写入正在等待的批次和队列中剩余的事件 '''
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+        if self.writing is not None:
+            # 等待已经开始的写入完成
+            await self.writing
+            self.writing = None
+        if self.batch:
+            await self.write(self.batch)
+            self.batch = []
+        while not self.queue.empty():
+            await self.write(self.drain([]))
+
+
+audit_writer: Optional[AuditWriter] = None
+
+
+def record_audit(action: str, target: DBBaseModel, detail: Optional[dict[str, Any]] = None) -> None:
+    ''' 记录一条审计事件，只放入内存队列，不等待写入 '''
+    if audit_writer is None:
+        return
+    ctx = get_request_context()
+    audit_writer.put({
+        'action': action,
+        'target_type': target.__tablename__,
+        'target_id': target.id,
+        'created_by': ctx.user_id if ctx is not None else None,
+        'route': ctx.route_path if ctx is not None else None,
+        'detail': detail,
+        'ctime': datetime.now(),
+    })
+
+
+def start_audit_writer() -> None:
+    global audit_writer
+    if AUDIT_CONFIG.enabled and audit_writer is None:
+        audit_writer = AuditWriter(AUDIT_CONFIG.queue_size, AUDIT_CONFIG.batch_size, AUDIT_CONFIG.flush_interval)
+        audit_writer.start()
+
+
+async def stop_audit_writer() -> None:
+    global audit_writer
+    if audit_writer is not None:
+        writer, audit_writer = audit_writer, None
+        await writer.stop()
@@ -1,4 +1,5 @@
 import jwt
+from uuid import uuid4
 from pydantic import BaseModel, Field
 from datetime import datetime, timedelta, timezone
 
@@ -33,7 +34,7 @@ class RoutePermission(BaseModel):
         # 如果没有定义对应的item，表示不需要权限，直接通过校验
         if not require_codes:
             return True
-        print(require_codes, allow_codes, '++++++++++++++++')
+        logger.debug('require codes: %s, allow codes: %s', require_codes, allow_codes)
         intersection = list(set(require_codes) & set(allow_codes))
         return len(intersection) != 0
     
@@ -45,7 +46,7 @@ class RoutePermission(BaseModel):
             return True
         require_codes = [PermissionEnum.get_code(item) for item in require_items]
         allow_codes = [item.code for item in allow_items]
-        print(require_codes, allow_codes, '++++++++++++++++')
+        logger.debug('require codes: %s, allow codes: %s', require_codes, allow_codes)
         intersection = list(set(require_codes) & set(allow_codes))
         return len(intersection) != 0
     
@@ -85,7 +86,8 @@ class RoutePermission(BaseModel):
 def generate_token(data: dict, secret_key: str, expire_minutes: int, algorithm: str) -> str:
     ''' 生成jwt令牌 '''
     expire_datetime = datetime.now(timezone.utc) + timedelta(minutes=expire_minutes)
-    encode_dict = {'exp': expire_datetime, **data}
+    # jti用于吊销单个令牌
+    encode_dict = {'exp': expire_datetime, 'jti': uuid4().hex, **data}
     # 这里使用默认算法
     encode_jwt = jwt.encode(encode_dict, secret_key, algorithm)
     return encode_jwt
@@ -101,7 +103,6 @@ def parse_token(jwt_token: str, secret_key: str, algorithm: str) -> dict:
         
         if decode_dict['exp'] < now_timestamp:
             raise PermissionException('失效的令牌')
-        decode_dict.pop('exp')
         return decode_dict
     except jwt.ExpiredSignatureError as e:
         logger.exception(e)
@@ -0,0 +1,78 @@
+'''
+批量请求: 在进程内把子请求交给app处理，一次往返完成多个接口调用
+
+- 子请求经过完整的中间件和依赖(准入控制、限流、权限校验、SQL预算等)，和单独请求的行为一致
+- 子请求复用批量请求已经校验的用户，不再解析令牌和查询用户，但仍然按各自路由的RoutePermission校验权限
+- 子请求的响应不压缩，由批量请求的响应统一压缩
+'''
+import json
+import asyncio
+from typing import Any, Optional
+from urllib.parse import urlencode
+
+from starlette.types import ASGIApp, Scope, Message
+
+from common.depends import BATCH_USER_SCOPE_KEY
+from schemas.batch import BatchItemSchema, BatchResultSchema
+
+# 不传给子请求的请求头，请求体相关的头按子请求重新生成
+EXCLUDED_HEADERS = {
+    b'content-length', b'content-type', b'transfer-encoding', b'expect',
+    b'accept-encoding', b'if-none-match', b'if-modified-since',
+}
+
+
+def build_scope(parent: Scope, item: BatchItemSchema, body: bytes, user: Any) -> Scope:
+    headers = [(k, v) for k, v in parent['headers'] if k not in EXCLUDED_HEADERS]
+    if body:
+        headers += [(b'content-type', b'application/json'), (b'content-length', str(len(body)).encode())]
+    path, _, query_string = item.path.partition('?')
+    if item.query:
+        query_string = '&'.join(filter(None, [query_string, urlencode(item.query, doseq=True)]))
+    scope = {
+        key: parent[key] for key in ('asgi', 'http_version', 'scheme', 'server', 'client', 'root_path', 'state') if key in parent
+    }
+    scope.update({
+        'type': 'http', 'method': item.method, 'path': path, 'raw_path': path.encode(),
+        'query_string': query_string.encode(), 'headers': headers, BATCH_USER_SCOPE_KEY: user,
+    })
+    return scope
+
+
+async def dispatch(app: ASGIApp, parent: Scope, item: BatchItemSchema, user: Any) -> BatchResultSchema:
+    ''' 在进程内执行一个子请求，返回状态码和解析后的响应 '''
+    body = json.dumps(item.body).encode() if item.body is not None else b''
+    done = asyncio.Event()
+    body_sent = False
+    status = 500
+    content_type = ''
+    chunks: list[bytes] = []
+
+    async def receive() -> Message:
+        nonlocal body_sent
+        if not body_sent:
+            body_sent = True
+            return {'type': 'http.request', 'body': body, 'more_body': False}
+        # 子请求没有真实的连接，响应完成后才通知断开
+        await done.wait()
+        return {'type': 'http.disconnect'}
+
+    async def send(message: Message) -> None:
+        nonlocal status, content_type
+        if message['type'] == 'http.response.start':
+            status = message['status']
+            content_type = dict(message.get('headers', [])).get(b'content-type', b'').decode('latin-1')
+        elif message['type'] == 'http.response.body':
+            chunks.append(message.get('body', b''))
+            if not message.get('more_body', False):
+                done.set()
+
+    try:
+        await app(build_scope(parent, item, body, user), receive, send)
+    finally:
+        done.set()
+    content = b''.join(chunks)
+    result: Optional[Any] = None
+    if content:
+        result = json.loads(content) if content_type.startswith('application/json') else content.decode('utf-8', 'replace')
+    return BatchResultSchema(status=status, body=result)
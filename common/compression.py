@@ -0,0 +1,191 @@
+'''
+响应压缩: 按Accept-Encoding协商brotli、zstd或gzip，压缩接口返回的JSON等文本响应
+
+- 小于阈值的响应、流式响应(导出、磁盘文件)以及已经压缩过的响应不处理
+- 较大的响应在线程中压缩，不阻塞事件循环
+- GET请求没有ETag的响应按内容生成ETag，客户端携带If-None-Match且内容未变化时返回304
+- 压缩结果按(ETag, 编码)缓存在按总大小限制的LRU中，内容不变的响应不需要重复压缩
+'''
+import gzip
+import asyncio
+import hashlib
+from typing import Callable, Optional
+from collections import OrderedDict
+
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Scope, Receive, Send, Message
+
+from config import COMPRESSION_CONFIG
+from common.metrics import COMPRESSION_BYTES
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+COMPRESSIBLE_TYPES = ('text/', 'application/json', 'application/javascript', 'application/xml', 'image/svg+xml')
+
+
+def build_compressors() -> dict[str, Callable[[bytes], bytes]]:
+    ''' 当前环境中可用的压缩算法，brotli和zstd需要安装对应的库 '''
+    compressors: dict[str, Callable[[bytes], bytes]] = {
+        'gzip': lambda body: gzip.compress(body, compresslevel=COMPRESSION_CONFIG.gzip_level, mtime=0),
+    }
+    if brotli is not None:
+        compressors['br'] = lambda body: brotli.compress(body, quality=COMPRESSION_CONFIG.brotli_quality)
+    if zstandard is not None:
+        compressors['zstd'] = lambda body: zstandard.ZstdCompressor(level=COMPRESSION_CONFIG.zstd_level).compress(body)
+    return compressors
+
+
+def negotiate_encoding(accept_encoding: str, encodings: list[str]) -> Optional[str]:
+    ''' 按服务端的优先顺序选择客户端接受的编码，q=0表示不接受 '''
+    accepted: dict[str, float] = {}
+    for item in accept_encoding.split(','):
+        name, _, params = item.strip().partition(';')
+        quality = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                continue
+        accepted[name.strip().lower()] = quality
+    for encoding in encodings:
+        if accepted.get(encoding, accepted.get('*', 0)) > 0:
+            return encoding
+    return None
+
+
+class CompressedCache:
+    ''' 按总大小限制的LRU缓存，键为(ETag, 编码) '''
+    def __init__(self, max_size: int) -> None:
+        self.max_size = max_size
+        self.size = 0
+        self.items: OrderedDict[tuple[str, str], bytes] = OrderedDict()
+
+    def get(self, key: tuple[str, str]) -> Optional[bytes]:
+        body = self.items.get(key)
+        if body is not None:
+            self.items.move_to_end(key)
+        return body
+
+    def put(self, key: tuple[str, str], body: bytes) -> None:
+        if len(body) > self.max_size or key in self.items:
+            return
+        self.items[key] = body
+        self.size += len(body)
+        while self.size > self.max_size:
+            _, evicted = self.items.popitem(last=False)
+            self.size -= len(evicted)
+
+
+class CompressionMiddleware:
+    ''' 压缩响应的中间件，放在ExceptionMiddleware外层，统一格式的失败响应同样会被处理 '''
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+        self.compressors = build_compressors()
+        self.encodings = [encoding for encoding in COMPRESSION_CONFIG.encodings if encoding in self.compressors]
+        self.cache = CompressedCache(COMPRESSION_CONFIG.cache_size)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope['type'] != 'http' or not COMPRESSION_CONFIG.enabled or scope['method'] not in ('GET', 'POST', 'PUT', 'DELETE'):
+            await self.app(scope, receive, send)
+            return
+        request_headers = Headers(scope=scope)
+        encoding = negotiate_encoding(request_headers.get('accept-encoding', ''), self.encodings)
+        if_none_match = request_headers.get('if-none-match')
+        if encoding is None and scope['method'] != 'GET':
+            await self.app(scope, receive, send)
+            return
+
+        start_message: Optional[Message] = None
+        passthrough = False
+
+        async def send_wrapper(message: Message) -> None:
+            nonlocal start_message, passthrough
+            if passthrough:
+                await send(message)
+            elif message['type'] == 'http.response.start':
+                start_message = message
+            elif message['type'] == 'http.response.body':
+                assert start_message is not None
+                if message.get('more_body', False) or not self.is_compressible(start_message):
+                    # 流式响应和不需要压缩的响应原样发送
+                    passthrough = True
+                    await send(start_message)
+                    await send(message)
+                    return
+                await self.send_response(scope, send, start_message, message.get('body', b''), encoding, if_none_match)
+            else:
+                await send(message)
+
+        await self.app(scope, receive, send_wrapper)
+
+    @staticmethod
+    def is_compressible(start_message: Message) -> bool:
+        headers = Headers(raw=start_message['headers'])
+        return (
+            start_message['status'] not in (204, 304)
+            and 'content-encoding' not in headers
+            and headers.get('content-type', '').startswith(COMPRESSIBLE_TYPES)
+        )
+
+    async def send_response(
+        self, scope: Scope, send: Send, start_message: Message, body: bytes, encoding: Optional[str], if_none_match: Optional[str]
+    ) -> None:
+        headers = MutableHeaders(raw=list(start_message['headers']))
+        start_message['headers'] = headers.raw
+        # 只有GET请求使用ETag
+        cacheable = scope['method'] == 'GET' and start_message['status'] == 200
+        if len(body) < COMPRESSION_CONFIG.min_size:
+            encoding = None
+        if encoding is not None:
+            headers.add_vary_header('Accept-Encoding')
+
+        etag = headers.get('etag')
+        if etag is None and cacheable:
+            etag = f'"{hashlib.blake2b(body, digest_size=16).hexdigest()}"'
+            headers['etag'] = etag
+        if etag is not None and encoding is not None and not etag.startswith('W/'):
+            # 压缩后的字节和原始内容不同，使用弱ETag
+            headers['etag'] = f'W/{etag}'
+        if etag is not None and if_none_match is not None and cacheable:
+            tags = [tag.strip().removeprefix('W/') for tag in if_none_match.split(',')]
+            if etag.removeprefix('W/') in tags or '*' in tags:
+                await self.send_not_modified(send, headers)
+                return
+
+        if encoding is not None:
+            body = await self.compress(body, encoding, etag if cacheable else None)
+            headers['content-encoding'] = encoding
+            headers['content-length'] = str(len(body))
+        await send(start_message)
+        await send({'type': 'http.response.body', 'body': body, 'more_body': False})
+
+    async def compress(self, body: bytes, encoding: str, etag: Optional[str]) -> bytes:
+        # 内容相同的响应ETag相同，可以直接使用缓存的压缩结果
+        key = (etag.removeprefix('W/'), encoding) if etag is not None else None
+        compressed = self.cache.get(key) if key is not None else None
+        if compressed is None:
+            compressor = self.compressors[encoding]
+            if len(body) >= COMPRESSION_CONFIG.offload_size:
+                compressed = await asyncio.to_thread(compressor, body)
+            else:
+                compressed = compressor(body)
+            if key is not None:
+                self.cache.put(key, compressed)
+        COMPRESSION_BYTES.inc((encoding, 'raw'), len(body))
+        COMPRESSION_BYTES.inc((encoding, 'compressed'), len(compressed))
+        return compressed
+
+    @staticmethod
+    async def send_not_modified(send: Send, headers: MutableHeaders) -> None:
+        raw_headers = [(k, v) for k, v in headers.raw if k not in (b'content-length', b'content-type')]
+        await send({'type': 'http.response.start', 'status': 304, 'headers': raw_headers})
+        await send({'type': 'http.response.body', 'body': b'', 'more_body': False})
@@ -0,0 +1,48 @@
+import time
+from typing import Any, Optional
+from contextvars import ContextVar
+from starlette.types import Scope
+
+
+# 路由对象 => 带前缀的完整路由模板，部分FastAPI版本中scope里的路由只有路由器内的相对路径
+route_full_paths: dict[int, str] = {}
+
+
+def register_route_path(route: Any, full_path: str) -> None:
+    route_full_paths[id(route)] = full_path
+
+
+def get_route_path(route: Any, default: str = 'unmatched') -> str:
+    ''' 获取路由的完整模板路径，用于日志和指标的标签，避免使用实际路径导致标签数量无限增长 '''
+    if route is None:
+        return default
+    return route_full_paths.get(id(route)) or getattr(route, 'path', default)
+
+
+class RequestContext:
+    ''' 请求上下文，保存单次请求内需要跨层共享的信息(路由、SQL统计等) '''
+    __slots__ = ('scope', 'start', 'statement_count', 'db_time', 'budget_exceeded', 'user_id', 'deadline', 'deadline_resolved', 'data_scope')
+
+    def __init__(self, scope: Scope) -> None:
+        self.scope = scope
+        self.start = time.perf_counter()
+        self.statement_count = 0    # 本次请求执行的SQL语句数
+        self.db_time = 0.0          # 本次请求的SQL执行总耗时(秒)
+        self.budget_exceeded = False    # 是否已经超出路由的SQL语句数预算
+        self.user_id: Optional[int] = None  # 通过权限校验的用户ID
+        self.deadline: Optional[float] = None   # 请求的截止时间(perf_counter时间)，None表示不限制
+        self.deadline_resolved = False  # 是否已经按路由的配置确定截止时间
+        self.data_scope: Any = None     # 当前用户的数据权限范围(DataScope)，None表示不限制
+
+    @property
+    def route_path(self) -> str:
+        ''' 路由模板路径，路由匹配完成前或者没有匹配到路由时返回unmatched '''
+        return get_route_path(self.scope.get('route'))
+
+
+request_context: ContextVar[Optional[RequestContext]] = ContextVar('request_context', default=None)
+
+
+def get_request_context() -> Optional[RequestContext]:
+    ''' 获取当前请求的上下文，不在请求中时返回None '''
+    return request_context.get()
@@ -0,0 +1,128 @@
+'''
+数据权限: 角色配置数据范围(全部、本部门及下级、本部门、本人)，查询时编译为SQL过滤条件
+
+- 权限校验通过后按用户的角色和部门确定数据范围，保存在请求上下文中
+- 分页、导出(build_filters)以及服务中的get_obj_by_query自动追加过滤条件，没有配置规则的模型不受影响
+- 过滤条件按(表, 角色, 角色版本, 部门)缓存，角色修改后utime变化，自动使用新的条件
+- 部门使用物化路径，子树查询为path LIKE '/1/5/%'，不需要递归查询
+'''
+from datetime import datetime
+from collections import OrderedDict
+from typing import Any, Callable, Hashable, Optional
+
+from sqlalchemy import false
+from sqlalchemy.future import select
+from sqlalchemy.sql.elements import ColumnElement
+
+from common.context import get_request_context
+from models.enums import DataScopeEnum
+from models.user import UserModel
+from models.department import DepartmentModel
+
+# 缓存的过滤条件数量上限，超出后淘汰最久未使用的
+MAX_COMPILED_FILTERS = 1024
+
+
+class DataScope:
+    ''' 当前用户的数据范围 '''
+    __slots__ = ('scope', 'user_id', 'dept_id', 'dept_path', 'role_id', 'role_version')
+
+    def __init__(
+        self, scope: DataScopeEnum, user_id: int, dept_id: Optional[int], dept_path: Optional[str],
+        role_id: int, role_version: Optional[datetime]
+    ) -> None:
+        self.scope = scope
+        self.user_id = user_id
+        self.dept_id = dept_id
+        self.dept_path = dept_path
+        self.role_id = role_id
+        self.role_version = role_version
+
+    @property
+    def key(self) -> Hashable:
+        # 只有本人范围的条件和用户有关，其余范围同一部门的用户共用
+        user_id = self.user_id if self.scope == DataScopeEnum.SELF or self.dept_id is None else None
+        return self.role_id, self.role_version, self.scope, self.dept_id, self.dept_path, user_id
+
+
+def build_data_scope(user: UserModel) -> Optional[DataScope]:
+    ''' 根据用户的角色和部门确定数据范围，全部数据时返回None '''
+    role = user.role
+    scope = getattr(role, 'data_scope', None) or DataScopeEnum.ALL
+    if scope == DataScopeEnum.ALL:
+        return None
+    department = user.department
+    return DataScope(
+        scope, user.id, department.id if department else None, department.path if department else None,
+        role.id, role.utime
+    )
+
+
+######################## 规则 ########################
+ScopeRule = Callable[[DataScope], ColumnElement]
+scope_rules: dict[type, ScopeRule] = {}
+
+
+def scope_rule(model: type) -> Callable[[ScopeRule], ScopeRule]:
+    ''' 注册模型的数据范围规则，规则根据数据范围返回过滤条件 '''
+    def decorator(func: ScopeRule) -> ScopeRule:
+        scope_rules[model] = func
+        return func
+    return decorator
+
+
+@scope_rule(UserModel)
+def user_scope(data_scope: DataScope) -> ColumnElement:
+    if data_scope.scope == DataScopeEnum.SELF or data_scope.dept_id is None:
+        # 没有部门的用户只能看到自己
+        return UserModel.id == data_scope.user_id
+    if data_scope.scope == DataScopeEnum.DEPT:
+        return UserModel.did == data_scope.dept_id
+    subtree = select(DepartmentModel.id).filter(DepartmentModel.path.startswith(data_scope.dept_path))
+    return UserModel.did.in_(subtree)
+
+
+@scope_rule(DepartmentModel)
+def department_scope(data_scope: DataScope) -> ColumnElement:
+    if data_scope.dept_id is None:
+        return false()
+    if data_scope.scope == DataScopeEnum.DEPT_TREE:
+        return DepartmentModel.path.startswith(data_scope.dept_path)
+    return DepartmentModel.id == data_scope.dept_id
+
+
+######################## 过滤条件 ########################
+compiled_filters: OrderedDict[tuple, ColumnElement] = OrderedDict()
+
+
+def compile_scope_filter(model: type, data_scope: DataScope) -> Optional[ColumnElement]:
+    rule = scope_rules.get(model)
+    if rule is None:
+        return None
+    key = (model, data_scope.key)
+    clause = compiled_filters.get(key)
+    if clause is None:
+        # 表达式对象不可变，可以在多个语句和请求之间复用
+        clause = compiled_filters[key] = rule(data_scope)
+        if len(compiled_filters) > MAX_COMPILED_FILTERS:
+            compiled_filters.popitem(last=False)
+    else:
+        compiled_filters.move_to_end(key)
+    return clause
+
+
+def get_scope_filters(model: Any) -> list[ColumnElement]:
+    ''' 当前请求对模型的数据范围过滤条件，不在请求中、没有限制或者模型没有规则时返回空列表 '''
+    ctx = get_request_context()
+    data_scope: Optional[DataScope] = ctx.data_scope if ctx is not None else None
+    if data_scope is None:
+        return []
+    clause = compile_scope_filter(model, data_scope)
+    return [clause] if clause is not None else []
+
+
+def get_scope_key() -> Optional[Hashable]:
+    ''' 当前请求数据范围的标识，结果和数据范围有关的合并查询、缓存需要加入键中，没有限制时返回None '''
+    ctx = get_request_context()
+    data_scope: Optional[DataScope] = ctx.data_scope if ctx is not None else None
+    return data_scope.key if data_scope is not None else None
@@ -0,0 +1,96 @@
+'''
+跨请求的批量加载: 同一时间窗口(默认为事件循环的一轮)内不同请求按ID查询同一张表时，合并为一次WHERE id IN (...)查询
+
+- 批量查询使用独立的session，不计入任何请求的SQL统计，查询结果按ID分发给每个等待的调用者
+- 调用者拿到的是合并(merge)到自己session中的对象，可以像直接查询得到的对象一样修改和提交
+- 调用者session中已经存在的对象直接返回，不参与批量查询
+- 调用者的session已经占用连接(已经开始事务)时不使用批量加载，直接在自己的连接上查询:
+  否则持有连接的请求等待需要另一个连接的批量查询，并发数达到连接池上限时所有连接都被等待批量查询的请求占用，形成死锁
+'''
+import asyncio
+from typing import Any, Awaitable, Callable, Generic, Hashable, Optional, Type, TypeVar
+
+from sqlalchemy.orm.util import identity_key
+
+from config import DATALOADER_CONFIG
+from db import AsyncSession
+from common.log import logger
+from common.metrics import DATALOADER_BATCH_SIZE
+from common.context import request_context
+
+K = TypeVar('K', bound=Hashable)
+V = TypeVar('V')
+
+
+class DataLoader(Generic[K, V]):
+    ''' 收集时间窗口内的key，批量加载后分发结果，只在事件循环线程中使用 '''
+    def __init__(self, name: str, batch_load: Callable[[list[K]], Awaitable[dict[K, V]]]) -> None:
+        self.name = name
+        self.batch_load = batch_load
+        self.window = DATALOADER_CONFIG.window_us / 1_000_000
+        self.max_batch = DATALOADER_CONFIG.max_batch
+        self.pending: dict[K, asyncio.Future] = {}
+        self.handle: Optional[asyncio.Handle] = None
+        self.tasks: set[asyncio.Task] = set()   # 保留执行中批次的引用，避免被回收
+
+    async def load(self, key: K) -> Optional[V]:
+        future = self.pending.get(key)
+        if future is None:
+            loop = asyncio.get_running_loop()
+            future = self.pending[key] = loop.create_future()
+            if len(self.pending) >= self.max_batch:
+                self.dispatch()
+            elif self.handle is None:
+                # 窗口为0时在事件循环的下一轮执行，同一轮中到达的查询合并为一批
+                self.handle = loop.call_later(self.window, self.dispatch) if self.window > 0 else loop.call_soon(self.dispatch)
+        # 某个调用者被取消不影响同一批中的其他调用者
+        return await asyncio.shield(future)
+
+    def dispatch(self) -> None:
+        if self.handle is not None:
+            self.handle.cancel()
+            self.handle = None
+        batch, self.pending = self.pending, {}
+        if batch:
+            task = asyncio.create_task(self.run(batch))
+            self.tasks.add(task)
+            task.add_done_callback(self.tasks.discard)
+
+    async def run(self, batch: dict[K, asyncio.Future]) -> None:
+        # 批量查询不属于任何一个请求
+        request_context.set(None)
+        DATALOADER_BATCH_SIZE.observe(len(batch), (self.name,))
+        try:
+            result = await self.batch_load(list(batch))
+        except Exception as e:
+            logger.error('dataloader %s batch load fail, detail is %s', self.name, e)
+            for future in batch.values():
+                if not future.done():
+                    future.set_exception(e)
+                    # 调用者都已经取消时避免告警
+                    future.exception()
+            return
+        except asyncio.CancelledError:
+            for future in batch.values():
+                future.cancel()
+            raise
+        for key, future in batch.items():
+            if not future.done():
+                future.set_result(result.get(key))
+
+
+def can_batch(session: AsyncSession) -> bool:
+    ''' 调用者的session没有占用连接时才能等待批量查询，避免持有一个连接的同时等待另一个连接 '''
+    return DATALOADER_CONFIG.enabled and not session.in_transaction()
+
+
+async def load_into_session(loader: DataLoader, model: Type[Any], id: Any, session: AsyncSession) -> Optional[Any]:
+    ''' 通过loader按ID加载对象并合并到调用者的session中，不存在或者已经逻辑删除时返回None '''
+    obj = session.identity_map.get(identity_key(model, id))
+    if obj is None:
+        obj = await loader.load(id)
+        if obj is None:
+            return None
+        # load=False直接复制已加载的属性和关联对象，不再访问数据库
+        obj = await session.merge(obj, load=False)
+    return None if getattr(obj, 'is_delete', False) else obj
@@ -0,0 +1,217 @@
+'''
+请求截止时间: 在ASGI层为每个请求设置截止时间并保存在请求上下文中
+
+- 截止时间按路由配置(路由匹配后确定)，超时后取消请求的处理，尚未开始响应时返回超时的失败响应
+- 客户端断开连接时立即取消请求的处理
+- 截止时间传递到SQL语句: SQLite通过progress handler在截止时间后中断正在执行的语句，
+  PostgreSQL在每个事务的第一条语句前设置SET LOCAL statement_timeout，连接可以及时归还连接池
+'''
+import time
+import asyncio
+from typing import Optional
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.ext.asyncio import AsyncEngine
+from starlette.datastructures import Headers
+from starlette.types import ASGIApp, Scope, Receive, Send, Message
+
+from config import DEADLINE_CONFIG
+from common.log import logger
+from common.metrics import DEADLINE_EXCEEDED
+from common.context import RequestContext, get_request_context
+from common.exception import DeadlineException
+from common.middleware import build_exception_response
+
+# SQLite每执行多少条虚拟机指令检查一次截止时间
+SQLITE_PROGRESS_STEPS = 1000
+
+
+def get_route_timeout(route_path: str) -> Optional[float]:
+    ''' 路由的超时时间(秒)，0或负数表示不限制 '''
+    timeout = DEADLINE_CONFIG.routes.get(route_path, DEADLINE_CONFIG.default_timeout)
+    return timeout if timeout > 0 else None
+
+
+def resolve_deadline(ctx: RequestContext) -> Optional[float]:
+    ''' 路由匹配后按路由的配置确定截止时间(perf_counter时间)，路由匹配前使用默认配置 '''
+    if not ctx.deadline_resolved and ctx.scope.get('route') is not None:
+        timeout = get_route_timeout(ctx.route_path)
+        ctx.deadline = ctx.start + timeout if timeout is not None else None
+        ctx.deadline_resolved = True
+    return ctx.deadline
+
+
+######################## ASGI ########################
+def has_request_body(scope: Scope) -> bool:
+    headers = Headers(scope=scope)
+    return 'transfer-encoding' in headers or headers.get('content-length', '0') not in ('', '0')
+
+
+class DeadlineMiddleware:
+    ''' 设置请求截止时间，超时或者客户端断开连接时取消请求的处理，需要放在MetricsMiddleware内层 '''
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+        # 所有路由中最短的超时时间，第一次检查不能晚于它
+        timeouts = [timeout for timeout in [DEADLINE_CONFIG.default_timeout, *DEADLINE_CONFIG.routes.values()] if timeout > 0]
+        self.first_check = min(timeouts) if timeouts else None
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        ctx = get_request_context()
+        if scope['type'] != 'http' or ctx is None or not DEADLINE_CONFIG.enabled:
+            await self.app(scope, receive, send)
+            return
+
+        timeout = DEADLINE_CONFIG.default_timeout
+        ctx.deadline = ctx.start + timeout if timeout > 0 else None
+        loop = asyncio.get_running_loop()
+        disconnected = asyncio.Event()
+        has_body = has_request_body(scope)
+        state = {'body_done': not has_body, 'body_sent': has_body, 'response_started': False, 'response_done': False, 'reason': None}
+        watcher: Optional[asyncio.Task] = None
+
+        def cancel(reason: str) -> None:
+            if state['reason'] is None:
+                state['reason'] = reason
+                # 让正在执行的SQLite语句尽快中断
+                ctx.deadline, ctx.deadline_resolved = 0, True
+                task.cancel()
+
+        async def watch_disconnect() -> None:
+            ''' 请求体读取完成后，由这里独占receive等待断开连接的消息 '''
+            while True:
+                message = await receive()
+                if message['type'] == 'http.disconnect':
+                    disconnected.set()
+                    # 响应发送完成后服务器也会通知断开连接，此时只剩依赖的清理，不能取消
+                    if not state['response_done']:
+                        cancel('disconnect')
+                    return
+
+        def start_watcher() -> None:
+            nonlocal watcher
+            watcher = asyncio.create_task(watch_disconnect())
+
+        async def receive_wrapper() -> Message:
+            if not state['body_done']:
+                message = await receive()
+                if message['type'] == 'http.request' and not message.get('more_body', False):
+                    state['body_done'] = True
+                    start_watcher()
+                elif message['type'] == 'http.disconnect':
+                    disconnected.set()
+                return message
+            if not state['body_sent']:
+                # 没有请求体时receive已经交给watcher，这里返回一个空的请求体
+                state['body_sent'] = True
+                return {'type': 'http.request', 'body': b'', 'more_body': False}
+            await disconnected.wait()
+            return {'type': 'http.disconnect'}
+
+        async def send_wrapper(message: Message) -> None:
+            if message['type'] == 'http.response.start':
+                state['response_started'] = True
+            await send(message)
+            if message['type'] == 'http.response.body' and not message.get('more_body', False):
+                state['response_done'] = True
+
+        def check_deadline() -> None:
+            nonlocal timer
+            deadline = resolve_deadline(ctx)
+            if deadline is None or task.done():
+                return
+            remaining = deadline - time.perf_counter()
+            if remaining > 0:
+                timer = loop.call_later(remaining, check_deadline)
+            else:
+                cancel('timeout')
+
+        if not has_body:
+            start_watcher()
+        task = asyncio.create_task(self.app(scope, receive_wrapper, send_wrapper))
+        timer = loop.call_later(self.first_check, check_deadline) if self.first_check is not None else None
+        try:
+            await asyncio.shield(task)
+        except asyncio.CancelledError:
+            if not task.done():
+                # 外层被取消(例如服务关闭或者服务器取消请求)，同时取消请求的处理
+                cancel('cancelled')
+                raise
+            if state['reason'] is None:
+                raise
+            if state['reason'] == 'timeout' and not state['response_started']:
+                await build_exception_response(DeadlineException('请求超时'))(scope, receive, send)
+        finally:
+            if timer is not None:
+                timer.cancel()
+            if watcher is not None:
+                watcher.cancel()
+            # 被中断的SQL语句也可能以DeadlineException结束请求，这里统一记录
+            if state['reason'] is not None:
+                DEADLINE_EXCEEDED.inc((ctx.route_path, state['reason']))
+                logger.warning('request %s %s cancelled by %s', scope['method'], ctx.route_path, state['reason'])
+
+
+######################## 数据库 ########################
+class SQLiteDeadline:
+    ''' 保存连接当前执行的语句所属请求的上下文，progress handler在aiosqlite的线程中读取 '''
+    __slots__ = ('ctx',)
+
+    def __init__(self) -> None:
+        self.ctx: Optional[RequestContext] = None
+
+    def expired(self) -> int:
+        ctx = self.ctx
+        deadline = ctx.deadline if ctx is not None else None
+        # 返回非0时SQLite中断当前语句
+        return int(deadline is not None and time.perf_counter() > deadline)
+
+
+def on_connect(dbapi_connection, connection_record) -> None:
+    if connection_record is None or not hasattr(dbapi_connection, 'run_async'):
+        return
+    holder = connection_record.info['sqlite_deadline'] = SQLiteDeadline()
+    dbapi_connection.run_async(lambda conn: conn.set_progress_handler(holder.expired, SQLITE_PROGRESS_STEPS))
+
+
+def on_begin(conn) -> None:
+    conn.info['statement_timeout_pending'] = True
+
+
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany) -> None:
+    ctx = get_request_context()
+    holder: Optional[SQLiteDeadline] = conn.info.get('sqlite_deadline')
+    if holder is not None:
+        holder.ctx = ctx
+        return
+    if not conn.info.pop('statement_timeout_pending', False):
+        return
+    deadline = resolve_deadline(ctx) if ctx is not None else None
+    if deadline is None:
+        return
+    # 事务结束后自动恢复，不会影响连接池中的其他请求
+    timeout_ms = max(1, int((deadline - time.perf_counter()) * 1000))
+    cursor.execute(f'SET LOCAL statement_timeout = {timeout_ms}')
+
+
+def handle_error(exception_context) -> None:
+    ''' 因为截止时间被中断的语句转换为超时异常 '''
+    ctx = get_request_context()
+    if ctx is None or ctx.deadline is None or time.perf_counter() <= ctx.deadline:
+        return
+    raise DeadlineException('请求超时') from exception_context.original_exception
+
+
+def install_statement_deadline(engine: AsyncEngine) -> None:
+    ''' 为引擎注册截止时间相关的事件，重复调用不会重复注册 '''
+    sync_engine: Engine = engine.sync_engine
+    if not DEADLINE_CONFIG.enabled or event.contains(sync_engine, 'before_cursor_execute', before_cursor_execute):
+        return
+    if sync_engine.dialect.name == 'sqlite':
+        event.listen(sync_engine, 'connect', on_connect)
+    elif sync_engine.dialect.name == 'postgresql':
+        event.listen(sync_engine, 'begin', on_begin)
+    else:
+        return
+    event.listen(sync_engine, 'before_cursor_execute', before_cursor_execute)
+    event.listen(sync_engine, 'handle_error', handle_error)
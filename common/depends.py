@@ -1,18 +1,28 @@
+import time
 from typing import cast, Annotated
 from fastapi.routing import APIRoute
 from fastapi import Request, Header, Depends
 
 from config import AUTH_CONFIG
+from common.log import logger
 from db import AsyncSession, async_session
 
 from common.utils import get_model_fields
+from common.metrics import AUTH_LATENCY
+from common.context import get_route_path, get_request_context
 from common.auth import RoutePermission, parse_token
+from common.revocation import is_token_revoked
+from common.rate_limit import check_rate_limit
 from common.pagination import PaginationQuerySchema
+from common.data_scope import build_data_scope
 from common.exception import PermissionException, ApiException
 
 from models.role import RoleModel
 from services import user as UserService
 
+# 批量请求在子请求的scope中保存已经校验的用户
+BATCH_USER_SCOPE_KEY = 'batch_user'
+
 
 async def get_query_params(request: Request) -> PaginationQuerySchema:
     ''' 收集所有查询参数​并处理 '''
@@ -44,17 +54,45 @@ async def check_permission(request: Request, Authorization: Annotated[str, Heade
     if not route_permission.is_require_auth():
         return
     
+    start = time.perf_counter()
+    try:
+        batch_user = request.scope.get(BATCH_USER_SCOPE_KEY)
+        if batch_user is not None:
+            # 批量请求的子请求共用批量请求已经校验的用户，只需要按子请求的路由校验权限
+            user_obj = await session.merge(batch_user, load=False)
+            check_role_permission(route_permission, user_obj)
+        else:
+            user_obj = await verify_route_permission(route_permission, Authorization, session)
+        check_rate_limit(request.scope, route, 'user', user_obj.id)
+        # 记录当前用户，用于审计日志以及填充创建者和更新者；之后的查询按用户的数据范围过滤
+        ctx = get_request_context()
+        if ctx is not None:
+            ctx.user_id = user_obj.id
+            ctx.data_scope = build_data_scope(user_obj)
+        return user_obj
+    finally:
+        AUTH_LATENCY.observe(time.perf_counter() - start, (get_route_path(route),))
+
+
+async def verify_route_permission(route_permission: RoutePermission, Authorization: str, session: AsyncSession) -> UserService.UserModel:
+    ''' 校验令牌对应的用户是否拥有路由所定义的权限，校验通过返回用户 '''
     # 需要校验权限，判定用户是否有对应路由所定义的权限
     user_dict = parse_token(Authorization, AUTH_CONFIG.jwt.secret_key, AUTH_CONFIG.jwt.algorithm)
-    print(route_permission.model_dump(), '==============')
+    if is_token_revoked(user_dict):
+        raise PermissionException('令牌已失效，请重新登录')
+    logger.debug('route permission: %s', route_permission)
     user_obj = await UserService.get_obj_by_query({ 'id': user_dict.get('id') }, session)
     if not user_obj:
         raise PermissionException('用户不存在')
-    
+    check_role_permission(route_permission, user_obj)
+    return user_obj
+
+
+def check_role_permission(route_permission: RoutePermission, user_obj: UserService.UserModel) -> None:
+    ''' 校验用户的角色是否拥有路由所定义的权限 '''
     if not user_obj.role:
         raise PermissionException('未知角色，没有权限访问')
     role: RoleModel = user_obj.role
     # 基于路由权限需要基于角色判定是否有权限访问
     if not route_permission.check_permission(role):
         raise ApiException('没有权限')
-    return user_obj
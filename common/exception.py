@@ -4,6 +4,29 @@ class ApiException(Exception):
         super().__init__(*args)
 
 
+class RateLimitException(Exception):
+    ''' 请求过于频繁 '''
+    def __init__(self, *args: object, retry_after: float = 1) -> None:
+        self.code = 429
+        self.retry_after = retry_after
+        super().__init__(*args)
+
+
+class OverloadException(Exception):
+    ''' 服务过载，请求被拒绝 '''
+    def __init__(self, *args: object, retry_after: float = 1) -> None:
+        self.code = 503
+        self.retry_after = retry_after
+        super().__init__(*args)
+
+
+class DeadlineException(Exception):
+    ''' 请求超过截止时间 '''
+    def __init__(self, *args: object) -> None:
+        self.code = 504
+        super().__init__(*args)
+
+
 class PermissionException(Exception):
     ''' 权限校验异常 '''
     def __init__(self, *args: object) -> None:
@@ -0,0 +1,130 @@
+'''
+图片缩略图: 头像上传后在进程池中解码一次，生成多种尺寸和格式的缩略图，保存在原图旁边
+命名规则: 原图 <hash>.<ext>，缩略图 <hash>_<size>.<format>
+
+依赖Pillow，没有安装时跳过缩略图生成，接口也不会返回缩略图地址
+缩略图在后台生成，生成完成前以及生成失败时接口返回原图地址
+'''
+import os
+import re
+import asyncio
+from typing import Optional
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+
+from config import ENV_CONFIG, SOURCE_CONFIG
+from common.log import logger
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:
+    Image = ImageOps = None
+
+# 内容寻址保存的头像地址，只有这类地址才有缩略图
+AVATAR_URL_PATTERN = re.compile(
+    re.escape(f'{ENV_CONFIG.source_prefix}/{SOURCE_CONFIG.avatar_source}/') + r'([0-9a-f]{2}/[0-9a-f]{2}/[0-9a-f]{64})\.\w+$'
+)
+SAVE_OPTIONS = {
+    'webp': {'format': 'WEBP', 'quality': 80, 'method': 4},
+    'jpg': {'format': 'JPEG', 'quality': 85, 'optimize': True, 'progressive': True},
+}
+
+executor: Optional[ProcessPoolExecutor] = None
+# 正在执行的后台任务，保存引用避免被垃圾回收
+pending_tasks: set[asyncio.Task] = set()
+# 头像地址 => 已经全部生成的缩略图地址
+VARIANT_CACHE_SIZE = 4096
+variant_cache: OrderedDict[str, dict[str, dict[str, str]]] = OrderedDict()
+
+
+def is_available() -> bool:
+    return Image is not None and bool(SOURCE_CONFIG.avatar_variant_sizes)
+
+
+def get_variant_path(path: str, size: int, fmt: str) -> str:
+    return f'{os.path.splitext(path)[0]}_{size}.{fmt}'
+
+
+def build_variants(path: str, sizes: list[int], formats: list[str]) -> list[str]:
+    ''' 在子进程中执行: 解码一次原图，按尺寸居中裁剪为正方形并保存为各个格式，返回生成的文件 '''
+    created = []
+    with Image.open(path) as image:
+        image = ImageOps.exif_transpose(image)
+        image = image.convert('RGBA' if image.mode in ('RGBA', 'LA', 'P') else 'RGB')
+        for size in sizes:
+            resized = ImageOps.fit(image, (size, size), method=Image.Resampling.LANCZOS)
+            for fmt in formats:
+                variant_path = get_variant_path(path, size, fmt)
+                if os.path.exists(variant_path):
+                    continue
+                # JPEG不支持透明通道
+                output = resized.convert('RGB') if fmt == 'jpg' and resized.mode != 'RGB' else resized
+                tmp_path = f'{variant_path}.tmp'
+                output.save(tmp_path, **SAVE_OPTIONS[fmt])
+                os.replace(tmp_path, variant_path)
+                created.append(variant_path)
+    return created
+
+
+def get_executor() -> ProcessPoolExecutor:
+    global executor
+    if executor is None:
+        executor = ProcessPoolExecutor(max_workers=SOURCE_CONFIG.image_workers)
+    return executor
+
+
+def shutdown_executor() -> None:
+    global executor
+    if executor is not None:
+        executor.shutdown(wait=False, cancel_futures=True)
+        executor = None
+
+
+async def generate_variants(path: str) -> None:
+    try:
+        created = await asyncio.get_running_loop().run_in_executor(
+            get_executor(), build_variants, path,
+            SOURCE_CONFIG.avatar_variant_sizes, SOURCE_CONFIG.avatar_variant_formats
+        )
+        logger.info('%s variants created for %s', len(created), path)
+    except Exception as e:
+        logger.error('create variants for %s fail, detail is %s', path, e)
+
+
+def schedule_variants(path: str) -> None:
+    ''' 在后台生成缩略图，不等待结果 '''
+    if not is_available():
+        return
+    task = asyncio.create_task(generate_variants(path))
+    pending_tasks.add(task)
+    task.add_done_callback(pending_tasks.discard)
+
+
+def get_variant_urls(url: Optional[str]) -> Optional[dict[str, dict[str, str]]]:
+    ''' 根据头像地址计算缩略图地址: {尺寸: {格式: 地址}}，不是内容寻址的头像返回None
+    只返回磁盘上已经生成的缩略图，尚未生成或者生成失败的使用原图地址
+    '''
+    if not url or not is_available():
+        return None
+    cached = variant_cache.get(url)
+    if cached is not None:
+        return cached
+    match = AVATAR_URL_PATTERN.match(url)
+    if match is None:
+        return None
+    base = url[:match.start(1)] + match.group(1)
+    base_path = os.path.join(ENV_CONFIG.source_dir, base[len(ENV_CONFIG.source_prefix):].lstrip('/'))
+    complete = True
+    variants: dict[str, dict[str, str]] = {}
+    for size in SOURCE_CONFIG.avatar_variant_sizes:
+        variants[str(size)] = {}
+        for fmt in SOURCE_CONFIG.avatar_variant_formats:
+            exists = os.path.exists(get_variant_path(base_path, size, fmt))
+            complete = complete and exists
+            variants[str(size)][fmt] = f'{base}_{size}.{fmt}' if exists else url
+    if complete:
+        # 内容寻址的文件不会变化，全部生成后不需要再检查磁盘
+        variant_cache[url] = variants
+        if len(variant_cache) > VARIANT_CACHE_SIZE:
+            variant_cache.popitem(last=False)
+    return variants
@@ -1,20 +1,93 @@
 import os
+import json
+import queue
+import atexit
+import random
 import logging
-from logging.handlers import TimedRotatingFileHandler
+from datetime import date
+from logging.handlers import QueueHandler, QueueListener
 from config import LOG_CONFIG
 
 
-formatter = logging.Formatter(LOG_CONFIG.format)
+class DailyFileHandler(logging.FileHandler):
+    ''' 按天写入的文件日志处理器
+    TimedRotatingFileHandler通过重命名文件来切分日志，多个worker共用一个文件时会互相覆盖；
+    这里直接写入带日期后缀的文件并以追加模式打开，不需要重命名，多进程写同一个文件也是安全的
+    '''
+    def __init__(self, filename: str, encoding: str = 'utf-8') -> None:
+        self.base_path = os.path.abspath(filename)
+        self.current_date = date.today().isoformat()
+        super().__init__(self.get_dated_path(self.current_date), mode='a', encoding=encoding, delay=True)
+
+    def get_dated_path(self, day: str) -> str:
+        return f'{self.base_path}.{day}'
+
+    def emit(self, record: logging.LogRecord) -> None:
+        day = date.fromtimestamp(record.created).isoformat()
+        if day != self.current_date:
+            # 日期变更，关闭旧文件，下次写入时会自动打开新文件
+            self.current_date = day
+            self.close()
+            self.baseFilename = self.get_dated_path(day)
+        super().emit(record)
+
+
+class JsonFormatter(logging.Formatter):
+    ''' 结构化(JSON)日志格式，通过extra传入的字段会一并输出 '''
+    # LogRecord自带的属性，不作为额外字段输出
+    reserved_keys = set(logging.makeLogRecord({}).__dict__.keys()) | {'message', 'asctime'}
+
+    def format(self, record: logging.LogRecord) -> str:
+        data = {
+            'time': self.formatTime(record),
+            'level': record.levelname,
+            'logger': record.name,
+            'module': record.module,
+            'func': record.funcName,
+            'line': record.lineno,
+            'pid': record.process,
+            'msg': record.getMessage(),
+        }
+        for k, v in record.__dict__.items():
+            if k not in self.reserved_keys and not k.startswith('_'):
+                data[k] = v
+        if record.exc_info:
+            data['exc'] = self.formatException(record.exc_info)
+        return json.dumps(data, ensure_ascii=False, default=str)
+
+
+class NonBlockingQueueHandler(QueueHandler):
+    ''' 非阻塞的队列日志处理器
+    日志记录原样放入队列，消息格式化和写文件都在后台线程中完成；队列满时直接丢弃并计数，不阻塞事件循环
+    '''
+    dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # 监听线程和当前线程在同一个进程中，不需要像QueueHandler那样提前格式化
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            NonBlockingQueueHandler.dropped += 1
+
+
+class AccessSampleFilter(logging.Filter):
+    ''' 访问日志采样过滤器，按路由配置采样率，警告及以上级别的日志总是保留 '''
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING:
+            return True
+        rate = LOG_CONFIG.access_sample_routes.get(getattr(record, 'route', ''), LOG_CONFIG.access_sample_rate)
+        return rate >= 1 or random.random() < rate
+
+
+formatter = JsonFormatter() if LOG_CONFIG.json_format else logging.Formatter(LOG_CONFIG.format)
 
 LOG_DIR = 'logs'
 os.makedirs(LOG_DIR, exist_ok=True)
 log_path = os.path.join(LOG_DIR, LOG_CONFIG.file)
-file_handler = TimedRotatingFileHandler(
-    log_path, encoding='utf-8',
-    # 每一天午夜保存一份新日志 
-    when='midnight', interval=1
-)
-file_handler.suffix = '%Y-%m-%d'
+file_handler = DailyFileHandler(log_path, encoding='utf-8')
 file_handler.setLevel(LOG_CONFIG.level)
 file_handler.setFormatter(formatter)
 
@@ -22,7 +95,17 @@ console_handler = logging.StreamHandler()
 console_handler.setLevel(LOG_CONFIG.level)
 console_handler.setFormatter(formatter)
 
+# 日志先进入队列，由后台线程统一写入文件和控制台
+log_queue: queue.Queue = queue.Queue(LOG_CONFIG.queue_size)
+queue_handler = NonBlockingQueueHandler(log_queue)
+listener = QueueListener(log_queue, file_handler, console_handler, respect_handler_level=True)
+listener.start()
+atexit.register(listener.stop)
+
 logger = logging.getLogger(__name__)
-logger.addHandler(file_handler)
-logger.addHandler(console_handler)
+logger.addHandler(queue_handler)
 logger.setLevel(LOG_CONFIG.level)
+
+# 访问日志，支持按路由采样
+access_logger = logger.getChild('access')
+access_logger.addFilter(AccessSampleFilter())
@@ -0,0 +1,156 @@
+'''
+Prometheus文本格式的指标采集
+
+所有指标都在事件循环线程中记录，只做字典查找和数值累加，不加锁，开销足够小，可以在生产环境常开
+'''
+from bisect import bisect_left
+from typing import Callable, Iterator, Optional
+
+from common.log import NonBlockingQueueHandler
+
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+REGISTRY: list['Metric'] = []
+
+
+def escape_label_value(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def format_labels(names: tuple[str, ...], values: tuple, extra: str = '') -> str:
+    items = [f'{k}="{escape_label_value(str(v))}"' for k, v in zip(names, values)]
+    if extra:
+        items.append(extra)
+    return '{' + ','.join(items) + '}' if items else ''
+
+
+def format_value(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+class Metric:
+    ''' 指标基类，series以标签值元组为键 '''
+    type = 'untyped'
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple[str, ...] = ()) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.series: dict[tuple, object] = {}
+        REGISTRY.append(self)
+
+    def samples(self) -> Iterator[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.type}']
+        lines.extend(self.samples())
+        return '\n'.join(lines)
+
+
+class Counter(Metric):
+    ''' 只增不减的计数器 '''
+    type = 'counter'
+
+    def inc(self, labels: tuple = (), amount: float = 1) -> None:
+        self.series[labels] = self.series.get(labels, 0) + amount
+
+    def samples(self) -> Iterator[str]:
+        for labels, value in list(self.series.items()):
+            yield f'{self.name}{format_labels(self.labelnames, labels)} {format_value(value)}'
+
+
+class Gauge(Metric):
+    ''' 可增可减的仪表，也可以通过回调函数在输出时取值 '''
+    type = 'gauge'
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple[str, ...] = (),
+                 func: Optional[Callable[[], float]] = None) -> None:
+        super().__init__(name, documentation, labelnames)
+        self.func = func
+
+    def inc(self, labels: tuple = (), amount: float = 1) -> None:
+        self.series[labels] = self.series.get(labels, 0) + amount
+
+    def dec(self, labels: tuple = (), amount: float = 1) -> None:
+        self.series[labels] = self.series.get(labels, 0) - amount
+
+    def set(self, value: float, labels: tuple = ()) -> None:
+        self.series[labels] = value
+
+    def samples(self) -> Iterator[str]:
+        if self.func is not None:
+            yield f'{self.name} {format_value(self.func())}'
+            return
+        for labels, value in list(self.series.items()):
+            yield f'{self.name}{format_labels(self.labelnames, labels)} {format_value(value)}'
+
+
+class Histogram(Metric):
+    ''' 直方图，每个series保存各个桶的(非累计)计数和总和，输出时再累加 '''
+    type = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple[str, ...] = (),
+                 buckets: tuple[float, ...] = DEFAULT_BUCKETS) -> None:
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, labels: tuple = ()) -> None:
+        series = self.series.get(labels)
+        if series is None:
+            # [各个桶的计数(最后一个为+Inf), 总和]
+            series = self.series[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+        series[0][bisect_left(self.buckets, value)] += 1
+        series[1] += value
+
+    def samples(self) -> Iterator[str]:
+        for labels, (counts, total) in list(self.series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                le = '+Inf' if bound == float('inf') else format_value(bound)
+                le_label = f'le="{le}"'
+                yield f'{self.name}_bucket{format_labels(self.labelnames, labels, le_label)} {cumulative}'
+            yield f'{self.name}_sum{format_labels(self.labelnames, labels)} {format_value(total)}'
+            yield f'{self.name}_count{format_labels(self.labelnames, labels)} {cumulative}'
+
+
+def render_metrics() -> str:
+    ''' 以Prometheus文本格式输出所有指标 '''
+    return '\n'.join(metric.render() for metric in REGISTRY) + '\n'
+
+
+######################## 常用指标 ########################
+HTTP_REQUESTS = Counter('http_requests_total', '请求总数', ('method', 'route', 'status'))
+HTTP_LATENCY = Histogram('http_request_duration_seconds', '请求处理耗时', ('method', 'route'))
+HTTP_IN_FLIGHT = Gauge('http_requests_in_flight', '正在处理的请求数')
+
+DB_STATEMENTS = Counter('db_statements_total', '各路由执行的SQL语句数', ('route',))
+DB_TIME = Counter('db_statement_seconds_total', '各路由执行SQL的总耗时', ('route',))
+
+AUTH_LATENCY = Histogram('auth_check_duration_seconds', '接口权限校验耗时', ('route',))
+BCRYPT_LATENCY = Histogram(
+    'bcrypt_duration_seconds', '密码加密/校验耗时', ('op',),
+    buckets=(0.05, 0.1, 0.2, 0.3, 0.5, 0.75, 1.0, 2.0)
+)
+
+ADMISSION_ACTIVE = Gauge('admission_active_requests', '各并发分组正在处理的请求数', ('group',))
+ADMISSION_QUEUED = Gauge('admission_queued_requests', '各并发分组排队等待的请求数', ('group',))
+ADMISSION_SHED = Counter('admission_shed_total', '并发分组过载时拒绝的请求数', ('group', 'reason'))
+ADMISSION_WAIT = Histogram(
+    'admission_wait_seconds', '请求在并发分组中的排队时间', ('group',),
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.0)
+)
+DEADLINE_EXCEEDED = Counter('deadline_exceeded_total', '超时或者客户端断开连接被取消的请求数', ('route', 'reason'))
+SINGLE_FLIGHT_CALLS = Counter(
+    'single_flight_calls_total', '合并读请求的调用数，按发起执行(leader)、共享执行(shared)、命中缓存(cached)区分', ('func', 'result')
+)
+DATALOADER_BATCH_SIZE = Histogram(
+    'dataloader_batch_size', '跨请求批量加载每批的ID数量', ('loader',), buckets=(1, 2, 4, 8, 16, 32, 64, 128, 256)
+)
+COMPRESSION_BYTES = Counter('http_compression_bytes_total', '压缩前(raw)和压缩后(compressed)的响应字节数', ('encoding', 'kind'))
+RATE_LIMITED = Counter('rate_limited_total', '被限流拒绝的请求数', ('route', 'key'))
+AUDIT_EVENTS = Counter('audit_events_total', '审计事件数，按写入结果(written/dropped/failed)区分', ('status',))
+
+LOG_DROPPED = Gauge('log_records_dropped', '日志队列已满时丢弃的日志数', func=lambda: NonBlockingQueueHandler.dropped)
@@ -1,43 +1,141 @@
+import math
 import time
 from fastapi import Request, HTTPException
 from fastapi.exceptions import RequestValidationError
-from starlette.responses import Response, JSONResponse
+from starlette.responses import JSONResponse
+from starlette.types import ASGIApp, Scope, Receive, Send, Message
 
-from common.log import logger
+from common.log import logger, access_logger
+from common.context import RequestContext, request_context, get_route_path
+from common.metrics import HTTP_REQUESTS, HTTP_LATENCY, HTTP_IN_FLIGHT, DB_STATEMENTS, DB_TIME
 from common.response import CommonResponse
-from common.exception import PermissionException, ApiException
-
-async def handle_exception_middleware(request: Request, call_next):
-    ''' 处理异常为统一格式的中间件 '''
-    start_tm = time.time_ns()
-    client_info = f'{request.client.host}:{request.client.port}' if request.client else 'unknown'
-    logger.info(f'{client_info} - {request.method.upper()} {request.url.path}{"?" if request.query_params else ""}{request.query_params} {request.url.scheme.upper()}')
-    try:
-        resp: Response = await call_next(request)
-    except PermissionException as e:
+from common.exception import PermissionException, ApiException, RateLimitException, OverloadException, DeadlineException
+
+
+def build_exception_response(e: Exception) -> JSONResponse:
+    ''' 将异常转换为统一格式的响应 '''
+    if isinstance(e, PermissionException):
         logger.error(e)
-        resp = JSONResponse(
-            status_code=200, content=CommonResponse.fail(e.code, str(e)).model_dump()
+        return JSONResponse(status_code=200, content=CommonResponse.fail(e.code, str(e)).model_dump())
+    if isinstance(e, (RateLimitException, OverloadException)):
+        logger.warning(e)
+        return JSONResponse(
+            status_code=200, content=CommonResponse.fail(e.code, str(e)).model_dump(),
+            headers={'Retry-After': str(max(1, math.ceil(e.retry_after)))}
         )
-    except HTTPException as e:
+    if isinstance(e, DeadlineException):
+        logger.warning(e)
+        return JSONResponse(status_code=200, content=CommonResponse.fail(e.code, str(e)).model_dump())
+    if isinstance(e, HTTPException):
         logger.error(e)
-        resp = JSONResponse(
+        return JSONResponse(
             status_code=200, content=CommonResponse.fail(e.status_code, f'HTTP异常!\ndetail: {e.detail}').model_dump()
         )
-    except ApiException as e:
+    if isinstance(e, ApiException):
         logger.error(e)
-        resp = JSONResponse(
-            status_code=200, content=CommonResponse.fail(500, f'{e}').model_dump()
-        )
-    except Exception as e:
-        logger.exception(e)
-        resp = JSONResponse(
-            status_code=200, content=CommonResponse.fail(500, f'未知异常,请联系管理员!\ndetail: {e}').model_dump()
-        )
-    finally:
-        end_tm = time.time_ns()
-    logger.info(f'{client_info} - {request.method.upper()} {request.url.path}{"?" if request.query_params else ""}{request.query_params} {request.url.scheme.upper()} status code:{resp.status_code}, processing time:{(end_tm - start_tm) // 1e6:.0f}ms')
-    return resp
+        return JSONResponse(status_code=200, content=CommonResponse.fail(500, f'{e}').model_dump())
+    logger.exception(e)
+    return JSONResponse(
+        status_code=200, content=CommonResponse.fail(500, f'未知异常,请联系管理员!\ndetail: {e}').model_dump()
+    )
+
+
+class ExceptionMiddleware:
+    ''' 处理异常为统一格式的中间件
+    直接实现ASGI接口，不经过BaseHTTPMiddleware，避免额外的任务、内存流以及对流式响应的缓冲
+    '''
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        response_started = False
+
+        async def send_wrapper(message: Message) -> None:
+            nonlocal response_started
+            if message['type'] == 'http.response.start':
+                response_started = True
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        except Exception as e:
+            # 响应已经开始发送时无法再替换响应内容，只能继续抛出
+            if response_started:
+                logger.exception(e)
+                raise
+            await build_exception_response(e)(scope, receive, send)
+
+
+class AccessLogMiddleware:
+    ''' 记录访问日志和处理耗时的中间件 '''
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        start_tm = time.perf_counter_ns()
+        status_code = 500
+
+        async def send_wrapper(message: Message) -> None:
+            nonlocal status_code
+            if message['type'] == 'http.response.start':
+                status_code = message['status']
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            # 每个请求只记录一条访问日志，参数延迟格式化，并支持按路由采样
+            client = scope.get('client')
+            query_string = scope.get('query_string', b'')
+            access_logger.info(
+                '%s:%s - %s %s%s%s %s status code:%s, processing time:%.0fms',
+                *(client or ('unknown', '')), scope['method'], scope['path'],
+                '?' if query_string else '', query_string.decode('latin-1'),
+                scope.get('scheme', 'http').upper(), status_code, (time.perf_counter_ns() - start_tm) / 1e6,
+                extra={'route': get_route_path(scope.get('route'), scope['path']), 'status_code': status_code}
+            )
+
+
+class MetricsMiddleware:
+    ''' 创建请求上下文并采集请求指标的中间件，需要放在最外层 '''
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        ctx = RequestContext(scope)
+        token = request_context.set(ctx)
+        status_code = 500
+
+        async def send_wrapper(message: Message) -> None:
+            nonlocal status_code
+            if message['type'] == 'http.response.start':
+                status_code = message['status']
+            await send(message)
+
+        HTTP_IN_FLIGHT.inc()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            HTTP_IN_FLIGHT.dec()
+            request_context.reset(token)
+            route = ctx.route_path
+            HTTP_REQUESTS.inc((scope['method'], route, status_code))
+            HTTP_LATENCY.observe(time.perf_counter() - ctx.start, (scope['method'], route))
+            if ctx.statement_count:
+                DB_STATEMENTS.inc((route,), ctx.statement_count)
+                DB_TIME.inc((route,), ctx.db_time)
 
 
 async def handler_validation_exception(request: Request, exc: RequestValidationError):
@@ -1,10 +1,12 @@
 from sqlalchemy import func
 from sqlalchemy.future import select
+from sqlalchemy.sql import Select
 from typing import Sequence, Any
 from pydantic import BaseModel, Field
 
 from common.log import logger
 from common.utils import get_db_model_fields
+from common.data_scope import get_scope_filters
 from db import AsyncSession, DBBaseModel, Column
 
 
@@ -23,30 +25,40 @@ class PaginationSchema(BaseModel):
     total: int = Field(description='数据总数')
 
 
-async def pagination(
-    model: type[DBBaseModel], pagination_query: PaginationQuerySchema, session: AsyncSession
-) -> tuple[PaginationSchema, Sequence[DBBaseModel]]:
+def build_filters(model: type[DBBaseModel], query: dict[str, Any]) -> list:
+    ''' 根据查询参数构造过滤条件，字符串使用like，其他使用等于，模型中不存在的字段会被忽略
+    当前用户的数据范围条件会一并加入
+    '''
     fields = get_db_model_fields(model)
-    query = {k: v for k, v in pagination_query.query.items() if k in fields}
-    logger.info(f'pagination_query: {pagination_query.model_dump()}, query: {query}')
-    # 如果是字符串则使用like，其他使用等于
-    filter_colums = []
+    filter_colums = [model.is_delete == False, *get_scope_filters(model)]
     for k, v in query.items():
         # is_delete这个字段不支持外部控制
-        if k == 'is_delete':
+        if k not in fields or k == 'is_delete':
             continue
         column: Column = getattr(model, k)
         filter_colums.append(column.like(f'%{v}%') if isinstance(v, str) else column == v)
-    
+    return filter_colums
+
+
+def build_pagination_statements(model: type[DBBaseModel], pagination_query: PaginationQuerySchema) -> tuple[Select, Select]:
+    ''' 根据分页参数构造总数查询和分页查询语句 '''
+    logger.info('pagination_query: %s', pagination_query)
+    filter_colums = build_filters(model, pagination_query.query)
+    count_stmt = select(func.count()).select_from(model).filter(*filter_colums)
+    list_stmt = select(model).filter(*filter_colums).order_by(*model.get_default_sort())\
+        .offset((pagination_query.page - 1) * pagination_query.size).limit(pagination_query.size)
+    return count_stmt, list_stmt
+
+
+async def pagination(
+    model: type[DBBaseModel], pagination_query: PaginationQuerySchema, session: AsyncSession
+) -> tuple[PaginationSchema, Sequence[DBBaseModel]]:
+    count_stmt, list_stmt = build_pagination_statements(model, pagination_query)
     # 执行查询并将结果返回
-    pagination_stmt = select(func.count()).select_from(model).filter(*filter_colums).filter_by(is_delete=False)
-    result = await session.execute(pagination_stmt)
+    result = await session.execute(count_stmt)
     total = result.scalar_one_or_none() or 0
 
-    result = await session.execute(
-        select(model).filter(*filter_colums).filter_by(is_delete=False).order_by(*model.get_default_sort())
-        .offset((pagination_query.page - 1) * pagination_query.size).limit(pagination_query.size)
-    )
+    result = await session.execute(list_stmt)
     has_prev = pagination_query.page != 1
     has_next = (pagination_query.page * pagination_query.size) < total
     return PaginationSchema(
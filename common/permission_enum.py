@@ -53,6 +53,8 @@ class InterfaceEnum(PermissionEnum):
 
     ROLE_GET = PermissionEnumValue(name='获取角色信息', code='/roles/get')
 
+    MONITOR_GET = PermissionEnumValue(name='查看系统监控', code='/monitor/get')
+
 
 class ButtonEnum(PermissionEnum):
     ''' 按钮权限枚举 '''
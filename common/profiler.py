@@ -0,0 +1,190 @@
+'''
+按需性能剖析: 超级管理员在请求头或者查询参数中携带剖析标记时，使用cProfile和tracemalloc剖析该次请求
+结果保存在数量有限的目录中，通过监控接口查看
+
+没有携带标记的请求只做一次请求头和查询参数的检查；关闭剖析时不会添加中间件
+'''
+import io
+import os
+import re
+import json
+import time
+import uuid
+import pstats
+import asyncio
+import cProfile
+import tracemalloc
+from typing import Optional
+from urllib.parse import parse_qsl
+from starlette.types import ASGIApp, Scope, Receive, Send, Message
+
+from config import PROFILE_CONFIG, AUTH_CONFIG
+from db import AsyncSessionLocal
+from common.log import logger
+from common.auth import parse_token
+from common.revocation import is_token_revoked
+from common.context import request_context, get_route_path
+from common.exception import PermissionException
+from services import user as UserService
+
+PROFILE_HEADER = PROFILE_CONFIG.header.lower().encode('latin-1')
+PROFILE_QUERY = PROFILE_CONFIG.query_param.encode('latin-1') + b'='
+PROFILE_ID_PATTERN = re.compile(r'^[\w-]+$')
+FALSE_VALUES = ('', '0', 'false', 'no', 'off')
+
+
+def is_profile_requested(scope: Scope) -> bool:
+    ''' 请求是否携带了剖析标记 '''
+    query_string: bytes = scope.get('query_string', b'')
+    if PROFILE_QUERY in query_string:
+        value = dict(parse_qsl(query_string.decode('latin-1'))).get(PROFILE_CONFIG.query_param, '')
+        if value.lower() not in FALSE_VALUES:
+            return True
+    for key, value in scope['headers']:
+        if key == PROFILE_HEADER:
+            return value.decode('latin-1').lower() not in FALSE_VALUES
+    return False
+
+
+def get_authorization(scope: Scope) -> str:
+    for key, value in scope['headers']:
+        if key == b'authorization':
+            return value.decode('latin-1')
+    return ''
+
+
+async def is_super_admin(authorization: str) -> bool:
+    ''' 令牌对应的用户是否是超级管理员 '''
+    if not authorization:
+        return False
+    try:
+        user_dict = parse_token(authorization, AUTH_CONFIG.jwt.secret_key, AUTH_CONFIG.jwt.algorithm)
+    except PermissionException:
+        return False
+    if is_token_revoked(user_dict):
+        return False
+    # 校验使用的SQL不计入当前请求的统计和预算
+    token = request_context.set(None)
+    try:
+        async with AsyncSessionLocal() as session:
+            user = await UserService.get_obj_by_query({'id': user_dict.get('id')}, session)
+            return bool(user and user.role and user.role.code == AUTH_CONFIG.manage.super_admin_code)
+    finally:
+        request_context.reset(token)
+
+
+######################## 剖析结果存储 ########################
+def get_profile_path(profile_id: str, suffix: str) -> Optional[str]:
+    ''' 获取剖析结果文件路径，非法的ID返回None '''
+    if not PROFILE_ID_PATTERN.match(profile_id):
+        return None
+    return os.path.join(PROFILE_CONFIG.dir, f'{profile_id}{suffix}')
+
+
+def save_profile(profile_id: str, profiler: cProfile.Profile, allocations: list[str], meta: dict) -> None:
+    ''' 保存原始的pstats文件和摘要，并删除超出数量的旧结果 '''
+    os.makedirs(PROFILE_CONFIG.dir, exist_ok=True)
+    profiler.dump_stats(get_profile_path(profile_id, '.prof'))
+
+    stream = io.StringIO()
+    pstats.Stats(profiler, stream=stream).sort_stats('cumulative').print_stats(PROFILE_CONFIG.top_n)
+    summary = {**meta, 'id': profile_id, 'stats': stream.getvalue(), 'allocations': allocations}
+    with open(get_profile_path(profile_id, '.json'), 'w', encoding='utf-8') as fp:
+        json.dump(summary, fp, ensure_ascii=False)
+
+    names = sorted(name for name in os.listdir(PROFILE_CONFIG.dir) if name.endswith('.json'))
+    for name in names[:max(0, len(names) - PROFILE_CONFIG.max_files)]:
+        for suffix in ('.json', '.prof'):
+            path = os.path.join(PROFILE_CONFIG.dir, name[:-len('.json')] + suffix)
+            if os.path.exists(path):
+                os.remove(path)
+
+
+def get_profile(profile_id: str) -> Optional[dict]:
+    path = get_profile_path(profile_id, '.json')
+    if path is None or not os.path.exists(path):
+        return None
+    with open(path, 'r', encoding='utf-8') as fp:
+        return json.load(fp)
+
+
+def list_profiles() -> list[dict]:
+    ''' 按时间倒序返回剖析结果的概要信息 '''
+    if not os.path.isdir(PROFILE_CONFIG.dir):
+        return []
+    profiles = []
+    for name in sorted(os.listdir(PROFILE_CONFIG.dir), reverse=True):
+        if not name.endswith('.json'):
+            continue
+        profile = get_profile(name[:-len('.json')])
+        if profile:
+            profiles.append({k: v for k, v in profile.items() if k not in ('stats', 'allocations')})
+    return profiles
+
+
+######################## 中间件 ########################
+class ProfileMiddleware:
+    ''' 按需剖析单个请求的中间件
+    cProfile按线程统计，剖析期间事件循环中其他请求的调用也会被记录，因此同一时间只剖析一个请求
+    '''
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+        self.active = False
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope['type'] != 'http' or not is_profile_requested(scope):
+            await self.app(scope, receive, send)
+            return
+        if not await is_super_admin(get_authorization(scope)):
+            logger.warning('profile request ignored, %s %s is not from super admin', scope['method'], scope['path'])
+            await self.app(scope, receive, send)
+            return
+        if self.active:
+            logger.warning('profile request ignored, another request is being profiled')
+            await self.app(scope, receive, send)
+            return
+        await self.profile(scope, receive, send)
+
+    async def profile(self, scope: Scope, receive: Receive, send: Send) -> None:
+        profile_id = f'{time.strftime("%Y%m%d%H%M%S")}-{uuid.uuid4().hex[:8]}'
+        status_code = 500
+
+        async def send_wrapper(message: Message) -> None:
+            nonlocal status_code
+            if message['type'] == 'http.response.start':
+                status_code = message['status']
+                message['headers'] = [*message.get('headers', []), (b'x-profile-id', profile_id.encode('latin-1'))]
+            await send(message)
+
+        self.active = True
+        started_tracing = not tracemalloc.is_tracing()
+        if started_tracing:
+            tracemalloc.start()
+        before = tracemalloc.take_snapshot()
+        profiler = cProfile.Profile()
+        start = time.perf_counter()
+        profiler.enable()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            profiler.disable()
+            duration = time.perf_counter() - start
+            after = tracemalloc.take_snapshot()
+            if started_tracing:
+                tracemalloc.stop()
+            self.active = False
+
+            allocations = [str(stat) for stat in after.compare_to(before, 'lineno')[:PROFILE_CONFIG.top_n]]
+            meta = {
+                'method': scope['method'],
+                'path': scope['path'],
+                'route': get_route_path(scope.get('route'), scope['path']),
+                'status_code': status_code,
+                'duration_ms': round(duration * 1000, 2),
+                'time': time.strftime('%Y-%m-%d %H:%M:%S'),
+            }
+            try:
+                await asyncio.to_thread(save_profile, profile_id, profiler, allocations, meta)
+                logger.info('profile %s saved, %s %s %.1fms', profile_id, scope['method'], scope['path'], duration * 1000)
+            except Exception as e:
+                logger.exception(e)
@@ -0,0 +1,63 @@
+'''
+路由SQL语句数预算，用于发现N+1查询等导致语句数增长的问题
+
+预算和RoutePermission一样定义在路由的openapi_extra中:
+    openapi_extra=RoutePermission(...).to_openapi_extra() | QueryBudget(max_statements=3).to_openapi_extra()
+
+python -m benchmarks.query_budget 请求每一个路由并检查语句数没有超出预算，修改路由或者查询后需要运行
+'''
+from typing import Any, Optional
+from pydantic import BaseModel, Field
+
+from config import DB_CONFIG
+from common.log import logger
+from common.context import RequestContext, get_route_path
+from common.exception import ApiException
+
+
+class QueryBudget(BaseModel):
+    ''' 路由SQL语句数预算 '''
+    max_statements: int = Field(description='单次请求允许执行的最大SQL语句数')
+
+    def to_openapi_extra(self) -> dict:
+        return {self.get_extra_key(): self.model_dump()}
+
+    @classmethod
+    def get_extra_key(cls) -> str:
+        return 'query_budget'
+
+    @classmethod
+    def from_route(cls, route: Any) -> Optional['QueryBudget']:
+        data = (getattr(route, 'openapi_extra', None) or {}).get(cls.get_extra_key())
+        return cls(**data) if data else None
+
+
+# 路由对象 => 最大语句数，避免每条SQL都重新解析openapi_extra
+budget_cache: dict[int, Optional[int]] = {}
+
+
+def get_max_statements(route: Any) -> Optional[int]:
+    key = id(route)
+    if key not in budget_cache:
+        budget = QueryBudget.from_route(route)
+        budget_cache[key] = budget.max_statements if budget else None
+    return budget_cache[key]
+
+
+def check_query_budget(ctx: RequestContext) -> None:
+    ''' 每执行一条SQL调用一次，超出路由预算时按配置记录日志或者抛出异常 '''
+    route = ctx.scope.get('route')
+    if route is None or DB_CONFIG.query_budget_mode == 'off':
+        return
+
+    max_statements = get_max_statements(route)
+    if max_statements is None or ctx.statement_count <= max_statements or ctx.budget_exceeded:
+        return
+    # 同一个请求只报告一次
+    ctx.budget_exceeded = True
+    logger.warning(
+        'query budget exceeded on %s %s: %s statements, budget is %s',
+        ctx.scope['method'], get_route_path(route), ctx.statement_count, max_statements
+    )
+    if DB_CONFIG.query_budget_mode == 'raise':
+        raise ApiException(f'SQL语句数超出预算: {ctx.statement_count} > {max_statements}')
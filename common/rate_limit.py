@@ -0,0 +1,193 @@
+'''
+路由限流: 令牌桶，分别按客户端IP和登录用户计数
+
+限流和RoutePermission一样定义在路由的openapi_extra中:
+    openapi_extra=QueryBudget(max_statements=3).to_openapi_extra() | RateLimit(rate=0.5, burst=10, keys=['ip']).to_openapi_extra()
+
+IP通过全局依赖ip_rate_limit在准入控制和权限校验之前检查，被限流的请求不占用并发名额和排队位置，也不会访问数据库或者执行bcrypt；
+用户在check_permission中权限校验通过后检查
+
+令牌桶默认保存在进程内，按key的哈希分片，只在事件循环线程中访问，不需要加锁；
+每次取令牌时顺带清理一个分片中已经回满的桶(回满的桶和不存在的桶等价，删除不影响限流结果)
+开启shared时保存在本机共享内存中，多个worker共享计数，worker之间不加锁，并发时可能略微多放行
+'''
+import math
+import time
+import struct
+import hashlib
+from typing import Any, Literal, Optional
+from multiprocessing import shared_memory, resource_tracker
+
+from fastapi import Request
+from pydantic import BaseModel, Field
+from starlette.types import Scope
+from starlette.datastructures import Headers
+
+from config import RATE_LIMIT_CONFIG
+from common.log import logger
+from common.metrics import RATE_LIMITED
+from common.context import get_route_path
+from common.exception import RateLimitException
+
+RateLimitKey = Literal['ip', 'user']
+# 每取多少次令牌清理一个分片
+SWEEP_EVERY = 64
+
+
+class RateLimit(BaseModel):
+    ''' 路由限流配置 '''
+    rate: float = Field(description='每秒补充的令牌数')
+    burst: int = Field(description='桶的容量，即允许的突发请求数')
+    keys: list[RateLimitKey] = Field(default_factory=lambda: ['ip', 'user'], description='分别按哪些维度计数')
+
+    def to_openapi_extra(self) -> dict:
+        return {self.get_extra_key(): self.model_dump()}
+
+    @classmethod
+    def get_extra_key(cls) -> str:
+        return 'rate_limit'
+
+    @classmethod
+    def from_route(cls, route: Any) -> Optional['RateLimit']:
+        data = (getattr(route, 'openapi_extra', None) or {}).get(cls.get_extra_key())
+        return cls(**data) if data else None
+
+
+class ShardedBucketStore:
+    ''' 进程内的分片令牌桶存储，桶为(剩余令牌数, 更新时间, 回满时间) '''
+    def __init__(self, shards: int) -> None:
+        self.shards: list[dict[str, tuple[float, float, float]]] = [{} for _ in range(max(1, shards))]
+        self.calls = 0
+        self.sweep_index = 0
+
+    def take(self, key: str, rate: float, burst: int, now: float) -> float:
+        ''' 取一个令牌，成功返回0，否则返回需要等待的秒数 '''
+        shard = self.shards[hash(key) % len(self.shards)]
+        bucket = shard.get(key)
+        tokens = float(burst) if bucket is None else min(burst, bucket[0] + (now - bucket[1]) * rate)
+        wait = 0.0
+        if tokens >= 1:
+            tokens -= 1
+        else:
+            wait = (1 - tokens) / rate
+        shard[key] = (tokens, now, now + (burst - tokens) / rate)
+        self.sweep(now)
+        return wait
+
+    def sweep(self, now: float) -> None:
+        self.calls += 1
+        if self.calls % SWEEP_EVERY:
+            return
+        shard = self.shards[self.sweep_index]
+        self.sweep_index = (self.sweep_index + 1) % len(self.shards)
+        for key in [key for key, bucket in shard.items() if bucket[2] <= now]:
+            del shard[key]
+
+    def __len__(self) -> int:
+        return sum(len(shard) for shard in self.shards)
+
+
+class SharedBucketStore:
+    ''' 共享内存中的令牌桶，开放寻址的定长哈希表，每个槽为(key哈希, 剩余令牌数, 更新时间, 回满时间)
+    冲突时复用已经回满的槽，都没有回满时复用最早回满的槽
+    '''
+    SLOT = struct.Struct('<Qddd')
+    PROBES = 8
+
+    def __init__(self, name: str, slots: int) -> None:
+        self.slots = slots
+        size = self.SLOT.size * slots
+        try:
+            self.shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        except FileExistsError:
+            self.shm = shared_memory.SharedMemory(name=name)
+        # 共享内存由多个worker共用，不能在某个进程退出时被resource_tracker删除
+        resource_tracker.unregister(self.shm._name, 'shared_memory')    # type: ignore[attr-defined]
+        self.buf = self.shm.buf
+
+    @staticmethod
+    def hash_key(key: str) -> int:
+        # 内置hash在每个进程中不同，这里需要所有进程一致；0表示空槽
+        return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), 'little') or 1
+
+    def find_slot(self, key_hash: int, now: float) -> tuple[int, Optional[tuple]]:
+        ''' 返回key所在的槽以及槽中的数据，不存在时返回可以复用的槽 '''
+        start = key_hash % self.slots
+        reuse, reuse_full_at = start, float('inf')
+        for i in range(self.PROBES):
+            index = (start + i) % self.slots
+            slot = self.SLOT.unpack_from(self.buf, index * self.SLOT.size)
+            if slot[0] == key_hash:
+                return index, slot
+            if slot[0] == 0 or slot[3] <= now:
+                return index, None
+            if slot[3] < reuse_full_at:
+                reuse, reuse_full_at = index, slot[3]
+        return reuse, None
+
+    def take(self, key: str, rate: float, burst: int, now: float) -> float:
+        key_hash = self.hash_key(key)
+        index, slot = self.find_slot(key_hash, now)
+        tokens = float(burst) if slot is None else min(burst, slot[1] + (now - slot[2]) * rate)
+        wait = 0.0
+        if tokens >= 1:
+            tokens -= 1
+        else:
+            wait = (1 - tokens) / rate
+        self.SLOT.pack_into(self.buf, index * self.SLOT.size, key_hash, tokens, now, now + (burst - tokens) / rate)
+        return wait
+
+
+def create_store():
+    if RATE_LIMIT_CONFIG.shared:
+        try:
+            return SharedBucketStore(RATE_LIMIT_CONFIG.shared_name, RATE_LIMIT_CONFIG.shared_slots)
+        except OSError as e:
+            logger.error('create shared rate limit store fail, use in-process store, detail is %s', e)
+    return ShardedBucketStore(RATE_LIMIT_CONFIG.shards)
+
+
+store = create_store()
+# 路由对象 => 限流配置，避免每次请求都重新解析openapi_extra
+rate_limit_cache: dict[int, Optional[RateLimit]] = {}
+
+
+def get_rate_limit(route: Any) -> Optional[RateLimit]:
+    if not RATE_LIMIT_CONFIG.enabled:
+        return None
+    key = id(route)
+    if key not in rate_limit_cache:
+        rate_limit_cache[key] = RateLimit.from_route(route)
+    return rate_limit_cache[key]
+
+
+def get_client_ip(scope: Scope) -> str:
+    if RATE_LIMIT_CONFIG.trust_forwarded:
+        forwarded = Headers(scope=scope).get('x-forwarded-for')
+        if forwarded:
+            # 左侧的地址可以由客户端任意伪造，只信任可信代理从右侧追加的地址
+            entries = [item.strip() for item in forwarded.split(',') if item.strip()]
+            if entries:
+                return entries[max(0, len(entries) - RATE_LIMIT_CONFIG.trusted_hops)]
+    client = scope.get('client')
+    return client[0] if client else 'unknown'
+
+
+def check_rate_limit(scope: Scope, route: Any, key_type: RateLimitKey, value: Any = None) -> None:
+    ''' 按路由的限流配置取一个令牌，超出限制时抛出RateLimitException，value为空时使用客户端IP '''
+    rate_limit = get_rate_limit(route)
+    if rate_limit is None or key_type not in rate_limit.keys:
+        return
+    route_path = get_route_path(route)
+    value = get_client_ip(scope) if key_type == 'ip' else value
+    wait = store.take(f'{route_path}:{key_type}:{value}', rate_limit.rate, rate_limit.burst, time.time())
+    if wait > 0:
+        RATE_LIMITED.inc((route_path, key_type))
+        raise RateLimitException(f'请求过于频繁，请{math.ceil(wait)}秒后重试', retry_after=wait)
+
+
+async def ip_rate_limit(request: Request) -> None:
+    ''' 全局依赖，放在admission_control之前，按IP限流 '''
+    route = request.scope.get('route')
+    if route is not None:
+        check_rate_limit(request.scope, route, 'ip')
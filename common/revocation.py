@@ -0,0 +1,149 @@
+'''
+令牌吊销: 按令牌的jti吊销，吊销记录保存在数据库中
+
+每个进程在内存中维护一个布隆过滤器和吊销令牌的精确集合:
+- 请求校验时先查布隆过滤器，绝大多数令牌没有被吊销，几次哈希探测后直接返回，不访问数据库
+- 布隆过滤器命中时再查精确集合，排除误判
+- 后台任务定期增量同步其他进程吊销的令牌，并删除已经过期的记录后全量重建过滤器(布隆过滤器不支持删除)
+- 增量同步按创建时间而不是ID，并重新读取最近一段时间的记录: 并发事务中ID较小的记录可能晚于ID较大的记录提交
+'''
+import math
+import time
+import asyncio
+import hashlib
+from datetime import datetime, timedelta
+from typing import Optional
+
+from sqlalchemy import delete, select
+
+from config import AUTH_CONFIG
+from db import AsyncSession, AsyncSessionLocal
+from common.log import logger
+from models.token_revocation import TokenRevocationModel
+
+REVOCATION_CONFIG = AUTH_CONFIG.revocation
+
+
+class BloomFilter:
+    ''' 布隆过滤器，使用双重哈希从一次blake2b摘要中得到所有探测位置 '''
+    def __init__(self, capacity: int, error_rate: float) -> None:
+        self.size = max(64, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hash_count = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def positions(self, key: str) -> list[int]:
+        digest = hashlib.blake2b(key.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return [(h1 + i * h2) % self.size for i in range(self.hash_count)]
+
+    def add(self, key: str) -> None:
+        for position in self.positions(key):
+            self.bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, key: str) -> bool:
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self.positions(key))
+
+
+class RevocationStore:
+    ''' 当前进程中的吊销令牌集合 '''
+    def __init__(self, capacity: int, error_rate: float) -> None:
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.revoked: dict[str, float] = {}     # jti => 令牌过期时间戳
+        self.bloom = BloomFilter(capacity, error_rate)
+        self.synced_until: Optional[datetime] = None  # 已经同步的记录中最大的创建时间
+
+    def add(self, jti: str, exp: float) -> None:
+        self.revoked[jti] = exp
+        self.bloom.add(jti)
+
+    def is_revoked(self, jti: Optional[str]) -> bool:
+        # 没有jti的令牌是旧版本生成的，无法吊销
+        if not jti or jti not in self.bloom:
+            return False
+        return jti in self.revoked
+
+    async def fetch(self, session: AsyncSession, since: Optional[datetime]) -> list:
+        stmt = select(TokenRevocationModel.ctime, TokenRevocationModel.jti, TokenRevocationModel.expire_at)\
+            .filter(TokenRevocationModel.expire_at >= datetime.now())
+        if since is not None:
+            stmt = stmt.filter(TokenRevocationModel.ctime >= since)
+        result = await session.execute(stmt)
+        return list(result.all())
+
+    def advance(self, rows: list) -> None:
+        if rows:
+            latest = max(ctime for ctime, _, _ in rows)
+            self.synced_until = latest if self.synced_until is None else max(self.synced_until, latest)
+
+    async def sync(self, session: AsyncSession) -> int:
+        ''' 增量加载数据库中新增的吊销记录，返回新加载的数量
+        重新读取sync_overlap秒内创建的记录，覆盖提交较晚的事务以及进程之间的时钟偏差
+        '''
+        since = self.synced_until - timedelta(seconds=REVOCATION_CONFIG.sync_overlap) if self.synced_until is not None else None
+        rows = await self.fetch(session, since)
+        added = 0
+        for _, jti, expire_at in rows:
+            if jti not in self.revoked:
+                self.add(jti, expire_at.timestamp())
+                added += 1
+        self.advance(rows)
+        return added
+
+    async def reload(self, session: AsyncSession) -> None:
+        ''' 删除已过期的吊销记录，全量加载后替换当前的过滤器和集合 '''
+        await session.execute(delete(TokenRevocationModel).filter(TokenRevocationModel.expire_at < datetime.now()))
+        await session.commit()
+        rows = await self.fetch(session, None)
+        revoked = {jti: expire_at.timestamp() for _, jti, expire_at in rows}
+        # 加载期间当前进程吊销的令牌
+        now = time.time()
+        revoked.update({jti: exp for jti, exp in self.revoked.items() if exp >= now and jti not in revoked})
+        # 吊销数量接近预期容量时扩大过滤器，保持误判率
+        bloom = BloomFilter(max(self.capacity, len(revoked) * 2), self.error_rate)
+        for jti in revoked:
+            bloom.add(jti)
+        self.revoked, self.bloom = revoked, bloom
+        self.advance(rows)
+        logger.info('token revocation list reloaded, %s revoked tokens', len(revoked))
+
+
+revocation_store = RevocationStore(REVOCATION_CONFIG.bloom_capacity, REVOCATION_CONFIG.bloom_error_rate)
+
+
+def is_token_revoked(token_dict: dict) -> bool:
+    ''' 令牌是否已经被吊销，只访问内存 '''
+    return revocation_store.is_revoked(token_dict.get('jti'))
+
+
+async def revoke_token(token_dict: dict, session: AsyncSession) -> None:
+    ''' 吊销令牌，写入数据库后立即在当前进程生效，其他进程在下一次同步后生效 '''
+    jti = token_dict.get('jti')
+    if not jti or jti in revocation_store.revoked:
+        return
+    session.add(TokenRevocationModel(jti=jti, uid=token_dict.get('id'), expire_at=datetime.fromtimestamp(token_dict['exp'])))
+    await session.commit()
+    revocation_store.add(jti, token_dict['exp'])
+
+
+async def run_revocation_sync() -> None:
+    ''' 后台任务: 定期同步吊销记录，并定期清理过期记录 '''
+    last_reload = time.monotonic()
+    while True:
+        await asyncio.sleep(REVOCATION_CONFIG.sync_interval)
+        try:
+            async with AsyncSessionLocal() as session:
+                if time.monotonic() - last_reload >= REVOCATION_CONFIG.purge_interval:
+                    await revocation_store.reload(session)
+                    last_reload = time.monotonic()
+                else:
+                    await revocation_store.sync(session)
+        except Exception as e:
+            logger.error('sync token revocation list fail, detail is %s', e)
+
+
+async def load_revocations() -> None:
+    ''' 启动时清理过期记录并加载所有吊销的令牌 '''
+    async with AsyncSessionLocal() as session:
+        await revocation_store.reload(session)
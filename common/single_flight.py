@@ -0,0 +1,125 @@
+'''
+合并相同的并发读请求: 参数相同的并发调用共享同一次执行，可选缓存结果一小段时间
+
+    @single_flight('permission')
+    async def load_enabled_permissions(keyword: Optional[str], session: AsyncSession) -> list[dict]:
+        ...
+
+- 以函数和规范化后的参数(不包括session)为键，第一个调用者使用自己的session执行，其余调用者等待同一个结果
+- 执行者被取消(超时、断开连接)时，等待的调用者重新发起执行，不会一起失败
+- 结果需要是序列化后的数据而不是ORM对象，调用者之间共享同一份结果，不能修改
+- 数据修改后通过invalidate按命名空间清除缓存，多个进程之间依赖较短的缓存时间
+'''
+import time
+import asyncio
+from functools import wraps
+from typing import Any, Awaitable, Callable, Hashable, Optional, TypeVar
+
+from config import SINGLE_FLIGHT_CONFIG
+from common.metrics import SINGLE_FLIGHT_CALLS
+
+T = TypeVar('T')
+
+
+def normalize(value: Any) -> Hashable:
+    ''' 把参数转换为可以作为键的值，关键字参数的顺序、列表和元组的区别不影响结果 '''
+    if isinstance(value, (list, tuple, set, frozenset)):
+        items = [normalize(item) for item in value]
+        return tuple(sorted(items, key=repr)) if isinstance(value, (set, frozenset)) else tuple(items)
+    if isinstance(value, dict):
+        return tuple(sorted((key, normalize(item)) for key, item in value.items()))
+    return value
+
+
+class SingleFlight:
+    ''' 一个函数的执行中调用和结果缓存，只在事件循环线程中使用 '''
+    def __init__(self, func: Callable[..., Awaitable[Any]], namespace: str, ttl: float, exclude: tuple[str, ...]) -> None:
+        self.func = func
+        self.name = f'{func.__module__}.{func.__qualname__}'
+        self.namespace = namespace
+        self.ttl = ttl
+        self.exclude = exclude
+        self.flights: dict[Hashable, asyncio.Future] = {}
+        self.cache: dict[Hashable, tuple[float, Any]] = {}
+        self.generation = 0     # 每次清除缓存加一，清除前发起的执行结果不再缓存
+
+    def make_key(self, args: tuple, kwargs: dict) -> Hashable:
+        return normalize(args), normalize({k: v for k, v in kwargs.items() if k not in self.exclude})
+
+    async def __call__(self, *args: Any, **kwargs: Any) -> Any:
+        if not SINGLE_FLIGHT_CONFIG.enabled:
+            return await self.func(*args, **kwargs)
+        key = self.make_key(args, kwargs)
+        while True:
+            cached = self.cache.get(key)
+            if cached is not None:
+                if cached[0] > time.monotonic():
+                    SINGLE_FLIGHT_CALLS.inc((self.name, 'cached'))
+                    return cached[1]
+                del self.cache[key]
+
+            future = self.flights.get(key)
+            if future is None:
+                return await self.lead(key, args, kwargs)
+            SINGLE_FLIGHT_CALLS.inc((self.name, 'shared'))
+            # wait不会因为future被取消而抛出异常，只有当前调用者被取消时才抛出
+            await asyncio.wait([future])
+            if not future.cancelled():
+                return future.result()
+            # 执行者被取消，重新发起
+
+    async def lead(self, key: Hashable, args: tuple, kwargs: dict) -> Any:
+        SINGLE_FLIGHT_CALLS.inc((self.name, 'leader'))
+        future = self.flights[key] = asyncio.get_running_loop().create_future()
+        generation = self.generation
+        try:
+            result = await self.func(*args, **kwargs)
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # 没有等待者时避免告警
+            future.exception()
+            raise
+        finally:
+            if self.flights.get(key) is future:
+                del self.flights[key]
+        future.set_result(result)
+        if self.ttl > 0 and generation == self.generation:
+            self.cache[key] = (time.monotonic() + self.ttl, result)
+        return result
+
+    def invalidate(self) -> None:
+        self.generation += 1
+        self.cache.clear()
+        # 之后的调用重新发起执行，不再等待清除前开始的执行
+        self.flights.clear()
+
+
+registry: dict[str, list[SingleFlight]] = {}
+
+
+def single_flight(
+    namespace: str, ttl: Optional[float] = None, exclude: tuple[str, ...] = ('session',)
+) -> Callable[[Callable[..., Awaitable[T]]], Callable[..., Awaitable[T]]]:
+    ''' 合并相同参数的并发调用
+    namespace用于数据修改后清除缓存，ttl为空时使用配置文件中的缓存时间，exclude中的关键字参数不参与比较
+    '''
+    def decorator(func: Callable[..., Awaitable[T]]) -> Callable[..., Awaitable[T]]:
+        flight = SingleFlight(func, namespace, SINGLE_FLIGHT_CONFIG.ttl if ttl is None else ttl, exclude)
+        registry.setdefault(namespace, []).append(flight)
+
+        @wraps(func)
+        async def wrapper(*args: Any, **kwargs: Any) -> T:
+            return await flight(*args, **kwargs)
+        wrapper.flight = flight     # type: ignore[attr-defined]
+        return wrapper
+    return decorator
+
+
+def invalidate(*namespaces: str) -> None:
+    ''' 数据修改后清除命名空间下所有函数的缓存 '''
+    for namespace in namespaces:
+        for flight in registry.get(namespace, []):
+            flight.invalidate()
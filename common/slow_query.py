@@ -0,0 +1,107 @@
+'''
+慢查询记录: 超过阈值的SQL会记录日志，并按语句结构抓取一次执行计划，保存在有限长度的缓冲区中供管理员查看
+'''
+import re
+import time
+from typing import Any, Optional
+from collections import OrderedDict
+
+from config import DB_CONFIG
+from common.log import logger
+
+# IN (?, ?, ?) 这类展开的参数列表长度不同，归一化为同一种语句结构
+IN_LIST_PATTERN = re.compile(r'\((\s*(\?|%s|\$\d+|:\w+)\s*,)+\s*(\?|%s|\$\d+|:\w+)\s*\)')
+SPACE_PATTERN = re.compile(r'\s+')
+EXPLAIN_PREFIX = {'sqlite': 'EXPLAIN QUERY PLAN ', 'postgresql': 'EXPLAIN ', 'mysql': 'EXPLAIN '}
+REDACTED = '******'
+
+
+def normalize_statement(statement: str) -> str:
+    ''' 将SQL归一化为语句结构，用于判断是否是同一类查询 '''
+    statement = SPACE_PATTERN.sub(' ', statement).strip()
+    return IN_LIST_PATTERN.sub('(?...)', statement)
+
+
+def is_sensitive(name: Any) -> bool:
+    return isinstance(name, str) and any(key in name for key in DB_CONFIG.redact_params)
+
+
+def redact_parameters(parameters: Any, context: Any = None) -> Any:
+    ''' 脱敏绑定参数，位置参数通过编译后的参数名判断是否需要脱敏 '''
+    if isinstance(parameters, dict):
+        return {k: REDACTED if is_sensitive(k) else v for k, v in parameters.items()}
+    if isinstance(parameters, (list, tuple)):
+        compiled = getattr(context, 'compiled', None)
+        names = getattr(compiled, 'positiontup', None) or []
+        if len(names) == len(parameters):
+            return [REDACTED if is_sensitive(name) else v for name, v in zip(names, parameters)]
+        # 无法对应参数名时，整体脱敏含敏感字段的语句参数
+        if compiled is not None and any(is_sensitive(name) for name in getattr(compiled, 'binds', {})):
+            return [REDACTED] * len(parameters)
+        return list(parameters)
+    return parameters
+
+
+class SlowQueryRecorder:
+    ''' 慢查询记录器，按语句结构保存最近的慢查询及其执行计划 '''
+    def __init__(self, threshold_ms: int, max_size: int) -> None:
+        self.threshold = threshold_ms / 1000
+        self.max_size = max_size
+        self.records: OrderedDict[str, dict] = OrderedDict()
+
+    @property
+    def enabled(self) -> bool:
+        return self.threshold > 0
+
+    def record(self, conn, statement: str, parameters: Any, context: Any,
+               executemany: bool, duration: float, route: str) -> None:
+        params = f'<{len(parameters)} rows>' if executemany else redact_parameters(parameters, context)
+        logger.warning('slow query %.1fms on %s: %s, params: %s', duration * 1000, route, statement, params)
+
+        shape = normalize_statement(statement)
+        record = self.records.get(shape)
+        if record is not None:
+            # 同一结构的语句只抓取一次执行计划，后续只更新统计
+            record['count'] += 1
+            record['max_ms'] = max(record['max_ms'], round(duration * 1000, 2))
+            record['last_time'] = time.time()
+            record['last_route'] = route
+            self.records.move_to_end(shape)
+            return
+
+        self.records[shape] = {
+            'statement': shape,
+            'parameters': params,
+            'route': route,
+            'last_route': route,
+            'count': 1,
+            'max_ms': round(duration * 1000, 2),
+            'first_time': time.time(),
+            'last_time': time.time(),
+            'plan': None if executemany else self.explain(conn, statement, parameters),
+        }
+        if len(self.records) > self.max_size:
+            self.records.popitem(last=False)
+
+    def explain(self, conn, statement: str, parameters: Any) -> Optional[list[str]]:
+        ''' 在同一个连接上获取查询语句的执行计划，直接使用DBAPI游标，不触发引擎事件 '''
+        prefix = EXPLAIN_PREFIX.get(conn.dialect.name)
+        if prefix is None or not statement.lstrip().upper().startswith(('SELECT', 'WITH')):
+            return None
+        try:
+            cursor = conn.connection.cursor()
+            try:
+                cursor.execute(prefix + statement, parameters)
+                return [' | '.join(str(col) for col in row) for row in cursor.fetchall()]
+            finally:
+                cursor.close()
+        except Exception as e:
+            logger.warning('explain slow query fail, detail is %s', e)
+            return None
+
+    def list(self) -> list[dict]:
+        ''' 按最大耗时倒序返回记录的慢查询 '''
+        return sorted(self.records.values(), key=lambda record: record['max_ms'], reverse=True)
+
+
+slow_query_recorder = SlowQueryRecorder(DB_CONFIG.slow_query_ms, DB_CONFIG.slow_query_buffer_size)
@@ -0,0 +1,52 @@
+'''
+基于SQLAlchemy引擎事件的SQL监控，统计每个请求执行的语句数和耗时，记录慢查询，并检查路由的语句数预算
+'''
+import time
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+from common.context import get_request_context
+from common.metrics import DB_STATEMENTS, DB_TIME
+from common.slow_query import slow_query_recorder
+from common.query_budget import check_query_budget
+
+
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_start_time', []).append(time.perf_counter())
+
+
+def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    duration = time.perf_counter() - conn.info['query_start_time'].pop()
+    ctx = get_request_context()
+    if slow_query_recorder.enabled and duration >= slow_query_recorder.threshold:
+        slow_query_recorder.record(
+            conn, statement, parameters, context, executemany, duration,
+            ctx.route_path if ctx is not None else 'none'
+        )
+    if ctx is None:
+        # 不在请求中执行的语句(启动初始化、脚本等)直接记录
+        DB_STATEMENTS.inc(('none',))
+        DB_TIME.inc(('none',), duration)
+        return
+    # 请求中的语句先累加到上下文，请求结束时按路由汇总，减少指标记录次数
+    ctx.statement_count += 1
+    ctx.db_time += duration
+    check_query_budget(ctx)
+
+
+def handle_error(exception_context):
+    # 执行失败时不会触发after_cursor_execute，需要弹出开始时间
+    start_list = exception_context.connection.info.get('query_start_time') if exception_context.connection else None
+    if start_list:
+        start_list.pop()
+
+
+def install_sql_monitor(engine: AsyncEngine) -> None:
+    ''' 为引擎注册SQL监控事件，重复调用不会重复注册 '''
+    sync_engine: Engine = engine.sync_engine
+    if event.contains(sync_engine, 'before_cursor_execute', before_cursor_execute):
+        return
+    event.listen(sync_engine, 'before_cursor_execute', before_cursor_execute)
+    event.listen(sync_engine, 'after_cursor_execute', after_cursor_execute)
+    event.listen(sync_engine, 'handle_error', handle_error)
@@ -0,0 +1,217 @@
+'''
+静态资源服务: 在StaticFiles的基础上增加缓存策略
+- 内容寻址的文件(文件名是sha256)内容不会变化，返回immutable和长期的max-age
+- 小文件(包括预压缩文件)按(路径, 编码)保存在按总大小限制的LRU内存缓存中，命中时仍然stat确认文件存在且未变化
+- 客户端支持时优先返回预压缩的.br/.gz文件，文本类资源始终返回Vary: Accept-Encoding
+- 支持Range请求(磁盘文件由FileResponse处理，内存缓存只支持单个区间)
+'''
+import os
+import re
+import stat
+import hashlib
+import mimetypes
+from typing import Optional
+from collections import OrderedDict
+from email.utils import formatdate, parsedate
+
+import anyio
+from starlette.datastructures import Headers
+from starlette.exceptions import HTTPException
+from starlette.responses import Response, FileResponse
+from starlette.staticfiles import StaticFiles, NotModifiedResponse
+from starlette.types import Scope
+
+from config import ENV_CONFIG
+
+# 内容寻址的文件名: <sha256>.<ext> 以及缩略图 <sha256>_<size>.<ext>
+IMMUTABLE_PATTERN = re.compile(r'(^|/)[0-9a-f]{64}(_\d+)?\.\w+$')
+# 只有文本类资源才查找预压缩文件，图片等已经压缩过的文件不需要额外的stat
+COMPRESSIBLE_TYPES = ('text/', 'application/javascript', 'application/json', 'image/svg+xml', 'application/xml')
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+RANGE_PATTERN = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+def read_file(path: str) -> bytes:
+    with open(path, 'rb') as fp:
+        return fp.read()
+
+
+def accepts_encoding(scope: Scope, encoding: str) -> bool:
+    accept_encoding = Headers(scope=scope).get('accept-encoding', '')
+    return any(item.split(';')[0].strip() == encoding for item in accept_encoding.split(','))
+
+
+class CachedFile:
+    ''' 内存中缓存的文件 '''
+    __slots__ = ('body', 'media_type', 'encoding', 'vary', 'etag', 'last_modified', 'mtime', 'size')
+
+    def __init__(self, body: bytes, media_type: str, stat_result: os.stat_result, encoding: str, vary: bool) -> None:
+        self.body = body
+        self.media_type = media_type
+        self.encoding = encoding    # 预压缩文件的编码，原始文件为空字符串
+        self.vary = vary            # 同一地址是否会按Accept-Encoding返回不同的内容
+        self.etag = f'"{hashlib.sha1(body).hexdigest()}"'
+        self.last_modified = formatdate(stat_result.st_mtime, usegmt=True)
+        self.mtime = stat_result.st_mtime
+        self.size = stat_result.st_size
+
+    def is_fresh(self, stat_result: os.stat_result) -> bool:
+        return (self.mtime, self.size) == (stat_result.st_mtime, stat_result.st_size)
+
+    def response(self, scope: Scope, cache_control: str) -> Response:
+        request_headers = Headers(scope=scope)
+        headers = {
+            'etag': self.etag, 'last-modified': self.last_modified,
+            'cache-control': cache_control, 'accept-ranges': 'bytes',
+        }
+        if self.encoding:
+            headers['content-encoding'] = self.encoding
+        if self.vary:
+            headers['vary'] = 'Accept-Encoding'
+        if self.is_not_modified(request_headers):
+            return NotModifiedResponse(Headers(headers))
+
+        body, status_code = self.body, 200
+        range_header = request_headers.get('range')
+        if_range = request_headers.get('if-range')
+        if range_header and (not if_range or if_range in (self.etag, self.last_modified)):
+            byte_range = self.parse_range(range_header)
+            if byte_range is None:
+                return Response(status_code=416, headers={'content-range': f'bytes */{len(self.body)}'})
+            if byte_range:
+                start, end = byte_range
+                body, status_code = self.body[start:end + 1], 206
+                headers['content-range'] = f'bytes {start}-{end}/{len(self.body)}'
+
+        headers['content-length'] = str(len(body))
+        if scope['method'] == 'HEAD':
+            body = b''
+        return Response(body, status_code=status_code, headers=headers, media_type=self.media_type)
+
+    def is_not_modified(self, request_headers: Headers) -> bool:
+        ''' If-None-Match优先，没有时比较If-Modified-Since '''
+        if_none_match = request_headers.get('if-none-match')
+        if if_none_match:
+            return self.etag in [tag.strip().removeprefix('W/') for tag in if_none_match.split(',')]
+        if_modified_since = parsedate(request_headers.get('if-modified-since', ''))
+        last_modified = parsedate(self.last_modified)
+        return if_modified_since is not None and last_modified is not None and if_modified_since >= last_modified
+
+    def parse_range(self, value: str) -> Optional[tuple[int, int]]:
+        ''' 解析单个区间，返回(start, end)；多个区间返回空元组表示忽略；无法满足时返回None '''
+        match = RANGE_PATTERN.match(value.strip())
+        if match is None:
+            return ()
+        first, last = match.groups()
+        size = len(self.body)
+        if not first and not last:
+            return ()
+        if not first:
+            start, end = max(0, size - int(last)), size - 1
+        else:
+            start, end = int(first), min(int(last), size - 1) if last else size - 1
+        if start >= size or start > end:
+            return None
+        return start, end
+
+
+class FileCache:
+    ''' 按总字节数限制的LRU缓存，只在事件循环线程中访问，不需要加锁 '''
+    def __init__(self, max_bytes: int) -> None:
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self.items: OrderedDict[tuple[str, str], CachedFile] = OrderedDict()
+
+    def get(self, key: tuple[str, str]) -> Optional[CachedFile]:
+        item = self.items.get(key)
+        if item is not None:
+            self.items.move_to_end(key)
+        return item
+
+    def put(self, key: tuple[str, str], item: CachedFile) -> None:
+        if len(item.body) > self.max_bytes:
+            return
+        old = self.items.pop(key, None)
+        if old is not None:
+            self.bytes -= len(old.body)
+        self.items[key] = item
+        self.bytes += len(item.body)
+        while self.bytes > self.max_bytes:
+            _, evicted = self.items.popitem(last=False)
+            self.bytes -= len(evicted.body)
+
+
+class CachedStaticFiles(StaticFiles):
+    ''' 带缓存策略的静态资源服务 '''
+    def __init__(self, *args, cache_size: int, cache_file_size: int, max_age: int, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self.cache = FileCache(cache_size)
+        self.cache_file_size = cache_file_size
+        self.max_age = max_age
+
+    def get_cache_control(self, path: str) -> str:
+        if IMMUTABLE_PATTERN.search(path):
+            return 'public, max-age=31536000, immutable'
+        return f'public, max-age={self.max_age}'
+
+    async def get_response(self, path: str, scope: Scope) -> Response:
+        if scope['method'] not in ('GET', 'HEAD'):
+            raise HTTPException(status_code=405, headers={'Allow': 'GET, HEAD'})
+
+        try:
+            full_path, stat_result = await anyio.to_thread.run_sync(self.lookup_path, path)
+        except (OSError, ValueError):
+            full_path, stat_result = '', None
+        if stat_result is None or not stat.S_ISREG(stat_result.st_mode):
+            # 目录、不存在以及非法路径，沿用StaticFiles的处理
+            return await super().get_response(path, scope)
+
+        cache_control = self.get_cache_control(path)
+        media_type = mimetypes.guess_type(full_path)[0] or 'application/octet-stream'
+        compressible = media_type.startswith(COMPRESSIBLE_TYPES)
+        if compressible:
+            # 预压缩文件优先于原始文件，包括原始文件已经在缓存中的情况
+            for encoding, suffix in ENCODINGS:
+                if not accepts_encoding(scope, encoding):
+                    continue
+                try:
+                    encoded_stat = await anyio.to_thread.run_sync(os.stat, full_path + suffix)
+                except OSError:
+                    continue
+                return await self.cached_response(path, full_path + suffix, encoded_stat, media_type, encoding, True, scope, cache_control)
+        return await self.cached_response(path, full_path, stat_result, media_type, '', compressible, scope, cache_control)
+
+    async def cached_response(
+        self, path: str, full_path: str, stat_result: os.stat_result, media_type: str, encoding: str, vary: bool,
+        scope: Scope, cache_control: str
+    ) -> Response:
+        ''' 小文件从内存缓存返回，缓存不存在或者文件已经变化时重新读取，大文件直接从磁盘返回 '''
+        key = (path, encoding)
+        cached = self.cache.get(key)
+        if cached is not None and cached.is_fresh(stat_result):
+            return cached.response(scope, cache_control)
+
+        if stat_result.st_size <= self.cache_file_size:
+            body = await anyio.to_thread.run_sync(read_file, full_path)
+            cached = CachedFile(body, media_type, stat_result, encoding, vary)
+            self.cache.put(key, cached)
+            return cached.response(scope, cache_control)
+
+        headers = {'cache-control': cache_control}
+        if encoding:
+            headers['content-encoding'] = encoding
+        if vary:
+            headers['vary'] = 'Accept-Encoding'
+        response = FileResponse(full_path, stat_result=stat_result, media_type=media_type, headers=headers)
+        if self.is_not_modified(response.headers, Headers(scope=scope)):
+            return NotModifiedResponse(response.headers)
+        return response
+
+
+def create_static_app() -> CachedStaticFiles:
+    return CachedStaticFiles(
+        directory=ENV_CONFIG.source_dir,
+        cache_size=ENV_CONFIG.static_cache_size,
+        cache_file_size=ENV_CONFIG.static_cache_file_size,
+        max_age=ENV_CONFIG.static_max_age,
+    )
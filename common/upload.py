@@ -0,0 +1,88 @@
+'''
+文件上传: 边接收边计算sha256，文件读写在线程中执行，按内容哈希分目录保存，相同内容只保存一份
+接收中的文件写在静态资源目录之外的临时目录，完整接收后再移动到最终位置
+'''
+import os
+import asyncio
+import hashlib
+from uuid import uuid4
+from typing import Optional, BinaryIO
+from fastapi import UploadFile
+
+from config import UPLOAD_TMP_DIR
+from common.log import logger
+from common.exception import ApiException
+
+CHUNK_SIZE = 1024 * 1024    # 每次读取 1MB
+# 文件头魔数 => 扩展名，只根据真实内容判断类型，不信任文件名和Content-Type
+IMAGE_SIGNATURES = (
+    (b'\xff\xd8\xff', 'jpg'),
+    (b'\x89PNG\r\n\x1a\n', 'png'),
+    (b'GIF87a', 'gif'),
+    (b'GIF89a', 'gif'),
+)
+
+
+def sniff_image_type(head: bytes) -> Optional[str]:
+    ''' 根据文件头判断图片类型，不是支持的图片返回None '''
+    for signature, ext in IMAGE_SIGNATURES:
+        if head.startswith(signature):
+            return ext
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+        return 'webp'
+    return None
+
+
+def write_chunk(fp: BinaryIO, digest, chunk: bytes) -> None:
+    fp.write(chunk)
+    digest.update(chunk)
+
+
+def commit_file(tmp_path: str, save_path: str) -> bool:
+    ''' 将临时文件移动到最终位置，已存在相同内容的文件时直接删除临时文件，返回是否是新文件 '''
+    if os.path.exists(save_path):
+        os.remove(tmp_path)
+        return False
+    os.makedirs(os.path.dirname(save_path), exist_ok=True)
+    os.replace(tmp_path, save_path)
+    return True
+
+
+def remove_file(path: str) -> None:
+    if os.path.exists(path):
+        os.remove(path)
+
+
+async def save_image(upload_file: UploadFile, save_dir: str, max_size: int) -> str:
+    ''' 保存上传的图片，返回相对于save_dir的路径: 哈希前两位/哈希3-4位/哈希.扩展名 '''
+    if upload_file.size is not None and upload_file.size > max_size:
+        raise ApiException(f'文件大小超过限制: {max_size}字节')
+
+    head = await upload_file.read(CHUNK_SIZE)
+    ext = sniff_image_type(head)
+    if ext is None:
+        raise ApiException('不支持的图片格式，仅支持jpg、png、gif和webp')
+
+    # 临时文件不能放在静态资源目录中，否则写入过程中就可以被访问
+    tmp_path = os.path.join(UPLOAD_TMP_DIR, f'{uuid4().hex}.tmp')
+    digest, size = hashlib.sha256(), 0
+    fp = await asyncio.to_thread(open, tmp_path, 'wb')
+    try:
+        chunk = head
+        while chunk:
+            size += len(chunk)
+            if size > max_size:
+                raise ApiException(f'文件大小超过限制: {max_size}字节')
+            await asyncio.to_thread(write_chunk, fp, digest, chunk)
+            chunk = await upload_file.read(CHUNK_SIZE)
+    except BaseException:
+        await asyncio.to_thread(fp.close)
+        await asyncio.to_thread(remove_file, tmp_path)
+        raise
+    await asyncio.to_thread(fp.close)
+
+    file_hash = digest.hexdigest()
+    relative_path = os.path.join(file_hash[:2], file_hash[2:4], f'{file_hash}.{ext}')
+    created = await asyncio.to_thread(commit_file, tmp_path, os.path.join(save_dir, relative_path))
+    logger.info('image %s saved, size: %s, new file: %s', relative_path, size, created)
+    return relative_path
@@ -1,10 +1,17 @@
 import os
 import toml
+from typing import Literal
 from pydantic import BaseModel, Field
 
 
 class SourceConfig(BaseModel):
     avatar_source: str = Field(description='头像资源名称')
+    avatar_max_size: int = Field(default=2 * 1024 * 1024, description='头像文件大小上限(字节)')
+    avatar_variant_sizes: list[int] = Field(default_factory=lambda: [64, 128], description='头像缩略图边长(像素)')
+    avatar_variant_formats: list[Literal['webp', 'jpg']] = Field(
+        default_factory=lambda: ['webp', 'jpg'], description='头像缩略图格式'
+    )
+    image_workers: int = Field(default=2, description='生成缩略图的进程数')
 
 
 class EnvConfig(BaseModel):
@@ -16,6 +23,9 @@ class EnvConfig(BaseModel):
     source_dir: str = Field(description='静态资源地址')
     source_prefix: str = Field(description='静态资源前缀')
     source: SourceConfig = Field(description='具体的资源配置')
+    static_cache_size: int = Field(default=32 * 1024 * 1024, description='静态资源内存缓存的总大小(字节)')
+    static_cache_file_size: int = Field(default=256 * 1024, description='可以进入内存缓存的单个文件大小上限(字节)')
+    static_max_age: int = Field(default=3600, description='非内容寻址的静态资源缓存时间(秒)')
 
 
 class LogConfig(BaseModel):
@@ -23,12 +33,21 @@ class LogConfig(BaseModel):
     level: str = Field(description='日志等级')
     format: str = Field(description='日志格式')
     file: str = Field(description='日志保存位置')
+    json_format: bool = Field(default=False, description='是否输出结构化(JSON)日志')
+    queue_size: int = Field(default=10000, description='日志队列大小，队列满时丢弃新日志')
+    access_sample_rate: float = Field(default=1.0, description='访问日志默认采样率')
+    access_sample_routes: dict[str, float] = Field(default_factory=dict, description='按路由配置的访问日志采样率')
 
 
 class DBConfig(BaseModel):
     ''' 数据库配置 '''
     url: str = Field(description='数据库连接地址')
     echo: bool = Field(description='是否打印SQL语句')
+    sqlite_busy_timeout: float = Field(default=30.0, description='SQLite等待写锁的超时时间(秒)，只对SQLite生效')
+    slow_query_ms: int = Field(default=200, description='慢查询阈值(毫秒)，小于等于0表示关闭')
+    slow_query_buffer_size: int = Field(default=100, description='保存的慢查询语句结构数量')
+    redact_params: list[str] = Field(default_factory=lambda: ['password'], description='慢查询日志中需要脱敏的参数名关键字')
+    query_budget_mode: Literal['off', 'log', 'raise'] = Field(default='log', description='超出路由SQL语句数预算时的处理方式')
 
 
 class AuthJWTConfig(BaseModel):
@@ -45,10 +64,114 @@ class AuthManageConfig(BaseModel):
     super_admin_desc: str = Field(description='超级管理员描述')
 
 
+class AuthRevocationConfig(BaseModel):
+    ''' 令牌吊销配置 '''
+    bloom_capacity: int = Field(default=100000, description='布隆过滤器预期容纳的吊销令牌数量')
+    bloom_error_rate: float = Field(default=0.001, description='布隆过滤器的误判率')
+    sync_interval: float = Field(default=5, description='从数据库同步其他进程吊销的令牌的间隔(秒)')
+    sync_overlap: float = Field(default=60, description='每次同步重新读取最近多少秒内创建的吊销记录，覆盖提交较晚的事务和进程之间的时钟偏差')
+    purge_interval: float = Field(default=3600, description='清理已过期吊销记录并重建过滤器的间隔(秒)')
+
+
 class AuthConfig(BaseModel):
     ''' 权限配置 '''
     jwt: AuthJWTConfig = Field(description='jwt配置')
     manage: AuthManageConfig = Field(description='权限管理配置')
+    revocation: AuthRevocationConfig = Field(default_factory=AuthRevocationConfig, description='令牌吊销配置')
+
+
+class ProfileConfig(BaseModel):
+    ''' 按需性能剖析配置 '''
+    enabled: bool = Field(default=True, description='是否允许超级管理员按需剖析单个请求')
+    header: str = Field(default='X-Profile', description='触发剖析的请求头')
+    query_param: str = Field(default='_profile', description='触发剖析的查询参数')
+    dir: str = Field(default='logs/profiles', description='剖析结果保存目录')
+    max_files: int = Field(default=50, description='最多保存的剖析结果数量，超出时删除最早的结果')
+    top_n: int = Field(default=50, description='摘要中保留的函数耗时和内存分配条数')
+
+
+class ArchiveConfig(BaseModel):
+    ''' 逻辑删除数据归档配置 '''
+    retention_days: int = Field(default=30, description='逻辑删除超过多少天的数据会被归档')
+    batch_size: int = Field(default=1000, description='每个事务归档的数量')
+    interval_hours: float = Field(default=0, description='应用内定时归档的间隔(小时)，0表示不在应用内执行')
+
+
+class AuditConfig(BaseModel):
+    ''' 审计日志配置 '''
+    enabled: bool = Field(default=True, description='是否记录审计日志')
+    queue_size: int = Field(default=10000, description='内存中最多缓存的审计事件数，队列满时丢弃新事件')
+    batch_size: int = Field(default=500, description='每次批量写入的最大数量')
+    flush_interval: float = Field(default=1.0, description='批量写入的间隔(秒)')
+
+
+class RateLimitConfig(BaseModel):
+    ''' 限流配置，具体的速率在路由的openapi_extra中定义 '''
+    enabled: bool = Field(default=True, description='是否启用限流')
+    shards: int = Field(default=64, description='进程内令牌桶存储的分片数')
+    trust_forwarded: bool = Field(default=False, description='是否使用X-Forwarded-For中的客户端IP，只有部署在可信代理后时才能开启')
+    trusted_hops: int = Field(default=1, ge=1, description='可信代理的层数，使用X-Forwarded-For中从右数第几个地址作为客户端IP')
+    shared: bool = Field(default=False, description='是否通过本机共享内存在多个worker之间共享令牌桶')
+    shared_name: str = Field(default='fastapi-admin-rate-limit', description='共享内存名称')
+    shared_slots: int = Field(default=65536, description='共享内存中的令牌桶数量')
+
+
+class BulkheadConfig(BaseModel):
+    ''' 并发分组配置 '''
+    max_concurrency: int = Field(description='分组内同时处理的最大请求数')
+    max_queue: int = Field(default=0, description='最多排队等待的请求数，超出时立即拒绝')
+    max_wait: float = Field(default=0.5, description='最长排队时间(秒)，超出时拒绝')
+
+
+class AdmissionConfig(BaseModel):
+    ''' 准入控制配置，路由通过openapi_extra中的Bulkhead声明所属分组 '''
+    enabled: bool = Field(default=True, description='是否启用并发分组限制')
+    groups: dict[str, BulkheadConfig] = Field(default_factory=lambda: {
+        'password': BulkheadConfig(max_concurrency=4, max_queue=32, max_wait=2.0),
+        'search': BulkheadConfig(max_concurrency=16, max_queue=64, max_wait=1.0),
+        'export': BulkheadConfig(max_concurrency=2, max_queue=4, max_wait=1.0),
+    }, description='分组名称 => 分组配置')
+
+
+class DeadlineConfig(BaseModel):
+    ''' 请求截止时间配置，超时的请求被取消，执行中的SQL语句被中断 '''
+    enabled: bool = Field(default=True, description='是否启用请求截止时间')
+    default_timeout: float = Field(default=30.0, description='默认的超时时间(秒)，0表示不限制')
+    routes: dict[str, float] = Field(default_factory=lambda: {
+        '/users/export': 0, '/roles/export': 0, '/permissions/export': 0,
+    }, description='路由模板 => 超时时间(秒)，0表示不限制')
+
+
+class SingleFlightConfig(BaseModel):
+    ''' 合并相同的并发读请求配置 '''
+    enabled: bool = Field(default=True, description='是否合并参数相同的并发调用')
+    ttl: float = Field(default=1.0, description='结果的默认缓存时间(秒)，0表示只合并并发调用不缓存')
+
+
+class DataLoaderConfig(BaseModel):
+    ''' 跨请求批量加载配置 '''
+    enabled: bool = Field(default=True, description='是否合并不同请求中按ID的查询')
+    window_us: int = Field(default=0, description='收集查询的时间窗口(微秒)，0表示合并事件循环同一轮中的查询')
+    max_batch: int = Field(default=200, description='每批最多的ID数量，达到后立即查询')
+
+
+class CompressionConfig(BaseModel):
+    ''' 响应压缩配置 '''
+    enabled: bool = Field(default=True, description='是否压缩响应')
+    encodings: list[str] = Field(
+        default_factory=lambda: ['br', 'zstd', 'gzip'], description='按优先顺序排列的压缩算法，br和zstd需要安装brotli和zstandard'
+    )
+    min_size: int = Field(default=1024, description='小于该大小(字节)的响应不压缩')
+    offload_size: int = Field(default=64 * 1024, description='大于该大小(字节)的响应在线程中压缩')
+    cache_size: int = Field(default=16 * 1024 * 1024, description='压缩结果缓存的总大小(字节)')
+    gzip_level: int = Field(default=6, description='gzip压缩级别')
+    brotli_quality: int = Field(default=4, description='brotli压缩质量')
+    zstd_level: int = Field(default=3, description='zstd压缩级别')
+
+
+class BatchConfig(BaseModel):
+    ''' 批量请求配置 '''
+    max_requests: int = Field(default=20, description='单次批量请求最多的子请求数')
 
 
 class Config(BaseModel):
@@ -57,19 +180,45 @@ class Config(BaseModel):
     log: LogConfig = Field(description='日志配置')
     db: DBConfig = Field(description='数据库配置')
     auth: AuthConfig = Field(description='权限配置')
+    profile: ProfileConfig = Field(default_factory=ProfileConfig, description='按需性能剖析配置')
+    archive: ArchiveConfig = Field(default_factory=ArchiveConfig, description='逻辑删除数据归档配置')
+    audit: AuditConfig = Field(default_factory=AuditConfig, description='审计日志配置')
+    rate_limit: RateLimitConfig = Field(default_factory=RateLimitConfig, description='限流配置')
+    admission: AdmissionConfig = Field(default_factory=AdmissionConfig, description='准入控制配置')
+    deadline: DeadlineConfig = Field(default_factory=DeadlineConfig, description='请求截止时间配置')
+    single_flight: SingleFlightConfig = Field(default_factory=SingleFlightConfig, description='合并相同的并发读请求配置')
+    dataloader: DataLoaderConfig = Field(default_factory=DataLoaderConfig, description='跨请求批量加载配置')
+    compression: CompressionConfig = Field(default_factory=CompressionConfig, description='响应压缩配置')
+    batch: BatchConfig = Field(default_factory=BatchConfig, description='批量请求配置')
 
 
 ######################## 加载配置并导出常用配置 ########################
-with open('config.toml', 'r', encoding='utf-8') as fp:
+# 可以通过环境变量指定配置文件，便于压测等场景使用独立的数据库
+CONFIG_PATH = os.environ.get('APP_CONFIG', 'config.toml')
+with open(CONFIG_PATH, 'r', encoding='utf-8') as fp:
     CONFIG = Config(**toml.load(fp))
 
 ENV_CONFIG = CONFIG.env
 LOG_CONFIG = CONFIG.log
 DB_CONFIG = CONFIG.db
 AUTH_CONFIG = CONFIG.auth
+PROFILE_CONFIG = CONFIG.profile
+ARCHIVE_CONFIG = CONFIG.archive
+AUDIT_CONFIG = CONFIG.audit
+RATE_LIMIT_CONFIG = CONFIG.rate_limit
+ADMISSION_CONFIG = CONFIG.admission
+DEADLINE_CONFIG = CONFIG.deadline
+SINGLE_FLIGHT_CONFIG = CONFIG.single_flight
+DATALOADER_CONFIG = CONFIG.dataloader
+COMPRESSION_CONFIG = CONFIG.compression
+BATCH_CONFIG = CONFIG.batch
 SOURCE_CONFIG = ENV_CONFIG.source
 
 # 初始化资源
 os.makedirs(ENV_CONFIG.source_dir, exist_ok=True)
 # 创建具体资源
 os.makedirs(os.path.join(ENV_CONFIG.source_dir, SOURCE_CONFIG.avatar_source), exist_ok=True)
+# 上传中的临时文件放在静态资源目录旁边: 不能被静态资源服务访问到，和最终位置在同一个文件系统中，移动是原子的
+_source_dir = os.path.abspath(ENV_CONFIG.source_dir)
+UPLOAD_TMP_DIR = os.path.join(os.path.dirname(_source_dir), f'.{os.path.basename(_source_dir)}_upload_tmp')
+os.makedirs(UPLOAD_TMP_DIR, exist_ok=True)
@@ -15,7 +15,9 @@ async_engine = create_async_engine(
     SQLALCHEMY_DATABASE_URL,
     echo=DB_CONFIG.echo,    # 是否打印 SQL
     future=True,            # 使用 SQLAlchemy 2.0 特性
-    pool_pre_ping=True      # 检测连接有效性
+    pool_pre_ping=True,     # 检测连接有效性
+    # SQLite同一时间只有一个写事务，其余写入在驱动中等待写锁
+    connect_args={'timeout': DB_CONFIG.sqlite_busy_timeout} if SQLALCHEMY_DATABASE_URL.startswith('sqlite') else {}
 )
 
 # 异步会话工厂（每次请求对应一个会话）
@@ -48,6 +50,15 @@ class DBBaseModel(Base):
         return (cls.utime.desc(), cls.ctime.desc(), cls.id.asc())
 
 
+class DBAppendOnlyModel(Base):
+    ''' 只追加不修改的数据基本模型(审计日志等)，没有更新时间、逻辑删除等可变字段 '''
+    __abstract__ = True
+
+    id = Column(Integer, primary_key=True, autoincrement=True, comment='主键')
+    ctime = Column(DateTime, default=datetime.now, comment='创建时间')
+    created_by = Column(Integer, nullable=True, comment='创建者ID')
+
+
 class DBBaseSchema(BaseModel):
     ''' 数据基本模型 '''
     id: int = Field(description='主键')
@@ -5,12 +5,37 @@ from argparse import ArgumentParser
 from app import create_app
 from config import ENV_CONFIG
 from scripts.data_manage import create_superadmin
+from scripts.user_transfer import import_users, export_users
+from scripts.archive import ARCHIVES, archive_deleted, restore_archived
 
 
 app = create_app()
 
 parser = ArgumentParser()
 parser.add_argument('-c', '--create_superadmin', action='store_true', help='是否创建超级管理员，默认为true')
+subparsers = parser.add_subparsers(dest='command')
+
+import_parser = subparsers.add_parser('import-users', help='从CSV/JSONL文件批量导入用户，中断后重新执行会从断点继续')
+import_parser.add_argument('file', help='文件路径，CSV需要包含表头')
+import_parser.add_argument('--format', choices=['csv', 'jsonl'], default=None, help='文件格式，默认按扩展名判断')
+import_parser.add_argument('--batch-size', type=int, default=1000, help='每个事务写入的数量')
+import_parser.add_argument('--workers', type=int, default=None, help='加密密码的进程数，默认为CPU核数')
+import_parser.add_argument('--rid', type=int, default=None, help='文件中没有指定角色时使用的角色ID')
+import_parser.add_argument('--restart', action='store_true', help='忽略断点，从头开始导入')
+
+export_parser = subparsers.add_parser('export-users', help='流式导出用户到CSV/JSONL文件')
+export_parser.add_argument('file', help='文件路径')
+export_parser.add_argument('--format', choices=['csv', 'jsonl'], default=None, help='文件格式，默认按扩展名判断')
+export_parser.add_argument('--batch-size', type=int, default=1000, help='每次从数据库读取的数量')
+
+archive_parser = subparsers.add_parser('archive', help='将逻辑删除超过保留期的用户、角色和权限移动到归档表')
+archive_parser.add_argument('--days', type=int, default=None, help='保留天数，默认使用配置文件中的值')
+archive_parser.add_argument('--batch-size', type=int, default=None, help='每个事务归档的数量')
+
+restore_parser = subparsers.add_parser('restore', help='将归档的数据恢复到业务表')
+restore_parser.add_argument('kind', choices=list(ARCHIVES), help='数据类型')
+restore_parser.add_argument('ids', type=int, nargs='+', help='要恢复的ID')
+restore_parser.add_argument('--undelete', action='store_true', help='恢复后同时取消逻辑删除')
 
 if __name__ == "__main__":
     args = parser.parse_args()
@@ -18,6 +43,20 @@ if __name__ == "__main__":
         name = input('用户名：')
         password = input('密码：')
         asyncio.run(create_superadmin(name=name, password=password))
+    elif args.command == 'import-users':
+        result = asyncio.run(import_users(
+            args.file, fmt=args.format, batch_size=args.batch_size, workers=args.workers, rid=args.rid, restart=args.restart
+        ))
+        print(f'处理{result["rows"]}行，导入{result["inserted"]}个，已存在{result["skipped"]}个，不合法{result["invalid"]}个')
+    elif args.command == 'export-users':
+        total = asyncio.run(export_users(args.file, fmt=args.format, batch_size=args.batch_size))
+        print(f'导出{total}个用户')
+    elif args.command == 'archive':
+        result = asyncio.run(archive_deleted(retention_days=args.days, batch_size=args.batch_size))
+        print(f'归档用户{result["users"]}个，角色{result["roles"]}个，权限{result["permissions"]}个')
+    elif args.command == 'restore':
+        count = asyncio.run(restore_archived(args.kind, args.ids, undelete=args.undelete))
+        print(f'恢复{count}条数据')
     else:
         uvicorn.run(
             'main:app', host=ENV_CONFIG.host, port=ENV_CONFIG.port,
@@ -0,0 +1,27 @@
+from sqlalchemy import Table, Column, DateTime
+
+from db import DBBaseModel
+from models.user import UserModel
+from models.role import RoleModel
+from models.permission import PermissionModel
+from models.role_permission import RolePermissionModel
+
+
+def build_archive_table(model: type[DBBaseModel]) -> Table:
+    ''' 基于业务表生成结构相同的归档表，不包含外键，额外记录归档时间 '''
+    table: Table = model.__table__   # type: ignore[assignment]
+    return Table(
+        f'{table.name}_archive', DBBaseModel.metadata,
+        *[
+            Column(column.name, column.type, primary_key=column.primary_key, autoincrement=False, comment=column.comment)
+            for column in table.columns
+        ],
+        Column('archived_at', DateTime, nullable=False, index=True, comment='归档时间'),
+        comment=f'{table.name}归档表',
+    )
+
+
+UserArchiveTable = build_archive_table(UserModel)
+RoleArchiveTable = build_archive_table(RoleModel)
+PermissionArchiveTable = build_archive_table(PermissionModel)
+RolePermissionArchiveTable = build_archive_table(RolePermissionModel)
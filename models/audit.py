@@ -0,0 +1,14 @@
+from sqlalchemy import Column, Integer, String, JSON
+
+from db import DBAppendOnlyModel
+
+
+class AuditLogModel(DBAppendOnlyModel):
+    ''' 审计日志模型，只追加不修改，created_by为操作人，ctime为操作时间 '''
+    __tablename__ = 'audit_log'
+
+    action = Column(String(64), nullable=False, index=True, comment='操作类型')
+    target_type = Column(String(64), nullable=False, comment='操作对象类型(表名)')
+    target_id = Column(Integer, index=True, comment='操作对象ID')
+    route = Column(String(255), comment='触发操作的路由')
+    detail = Column(JSON, comment='操作详情')
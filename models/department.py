@@ -0,0 +1,13 @@
+from sqlalchemy import Column, String, Integer, ForeignKey
+
+from db import DBBaseModel
+
+
+class DepartmentModel(DBBaseModel):
+    ''' 部门模型 '''
+    __tablename__ = 'department'
+
+    name = Column(String(255), nullable=False, comment='部门名称')
+    parent_id = Column(Integer, ForeignKey('department.id'), comment='上级部门ID')
+    # 物化路径，从根部门到当前部门的ID，例如/1/5/，按前缀查询即可得到整个子树
+    path = Column(String(512), nullable=False, default='/', index=True, comment='部门路径')
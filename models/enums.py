@@ -13,3 +13,11 @@ class PermissionEnum(Enum):
     MENU = 'menu'
     BUTTON = 'button'
     INTERFACE = 'interface'
+
+
+class DataScopeEnum(Enum):
+    ''' 数据权限范围 '''
+    ALL = 'all'                 # 全部数据
+    DEPT_TREE = 'dept_tree'     # 本部门及下级部门
+    DEPT = 'dept'               # 仅本部门
+    SELF = 'self'               # 仅本人
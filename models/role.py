@@ -1,7 +1,8 @@
-from sqlalchemy import Column, String
+from sqlalchemy import Column, String, Enum
 from sqlalchemy.orm import relationship
 
 from db import DBBaseModel
+from models.enums import DataScopeEnum
 from models.permission import PermissionModel
 from models.role_permission import RolePermissionModel
 
@@ -13,6 +14,7 @@ class RoleModel(DBBaseModel):
     name = Column(String(255), nullable=False, comment='角色名称')
     code = Column(String(255), nullable=False, comment='角色编码')
     desc = Column(String(512), comment='角色描述')
+    data_scope = Column(Enum(DataScopeEnum, create_type=True), default=DataScopeEnum.ALL, comment='数据权限范围')
 
     ############## 关联关系 ##############
     users = relationship('UserModel', back_populates='role')    # 用户与角色是一对一关系
@@ -0,0 +1,14 @@
+from sqlalchemy import Column, Integer, String, DateTime, Index
+
+from db import DBBaseModel
+
+
+class TokenRevocationModel(DBBaseModel):
+    ''' 吊销的令牌，过期后的记录会被定期清理 '''
+    __tablename__ = 'token_revocation'
+    # 增量同步按创建时间查询
+    __table_args__ = (Index('ix_token_revocation_ctime', 'ctime'),)
+
+    jti = Column(String(64), nullable=False, unique=True, comment='令牌ID')
+    uid = Column(Integer, comment='令牌所属的用户ID')
+    expire_at = Column(DateTime, nullable=False, index=True, comment='令牌过期时间')
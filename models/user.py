@@ -1,9 +1,12 @@
+import time
 from passlib.context import CryptContext
 from sqlalchemy import Column, String, Enum, Integer, ForeignKey
 from sqlalchemy.orm import relationship
 
 from db import DBBaseModel
+from common.metrics import BCRYPT_LATENCY
 from .enums import GenderEnum
+from .department import DepartmentModel
 
 class UserModel(DBBaseModel):
     ''' 用户模型 '''
@@ -22,6 +25,8 @@ class UserModel(DBBaseModel):
     ############## 关联关系 ##############
     rid = Column(Integer, ForeignKey('role.id'), comment='角色ID')
     role = relationship('RoleModel', back_populates='users', lazy='selectin')
+    did = Column(Integer, ForeignKey('department.id'), index=True, comment='部门ID')
+    department = relationship(DepartmentModel, lazy='joined')  # 数据权限需要用户的部门路径
 
     pwd_context = CryptContext(
         schemes=["bcrypt"],  # 使用 bcrypt 算法
@@ -34,8 +39,21 @@ class UserModel(DBBaseModel):
     
     @password.setter
     def password(self, value: str):
-        self.hashed_password = self.pwd_context.hash(value)
+        self.hashed_password = self.hash_pwd(value)
+
+    @classmethod
+    def hash_pwd(cls, pwd: str) -> str:
+        ''' 加密密码，耗时较长，接口中需要在线程中执行 '''
+        start = time.perf_counter()
+        try:
+            return cls.pwd_context.hash(pwd)
+        finally:
+            BCRYPT_LATENCY.observe(time.perf_counter() - start, ('hash',))
 
     def check_pwd(self, pwd: str) -> bool:
         ''' 校验密码是否合法 '''
-        return self.pwd_context.verify(pwd, self.password)
+        start = time.perf_counter()
+        try:
+            return self.pwd_context.verify(pwd, self.password)
+        finally:
+            BCRYPT_LATENCY.observe(time.perf_counter() - start, ('verify',))
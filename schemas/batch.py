@@ -0,0 +1,18 @@
+from typing import Any, Literal, Optional
+from pydantic import BaseModel, Field
+
+
+class BatchItemSchema(BaseModel):
+    method: Literal['GET', 'POST', 'PUT', 'DELETE'] = Field(default='GET', description='请求方法')
+    path: str = Field(description='接口路径，例如/users/list')
+    query: dict[str, Any] = Field(default_factory=dict, description='查询参数')
+    body: Optional[Any] = Field(default=None, description='JSON请求体')
+
+
+class BatchSchema(BaseModel):
+    requests: list[BatchItemSchema] = Field(description='子请求列表，按顺序返回结果')
+
+
+class BatchResultSchema(BaseModel):
+    status: int = Field(description='子请求的HTTP状态码')
+    body: Any = Field(description='子请求的响应，JSON响应解析后返回')
@@ -0,0 +1,15 @@
+from typing import Optional
+from pydantic import BaseModel, Field
+
+from db import DBBaseSchema
+
+
+class DepartmentSchema(DBBaseSchema):
+    name: str = Field(description='部门名称')
+    parent_id: Optional[int] = Field(description='上级部门ID')
+    path: str = Field(description='部门路径，从根部门到当前部门的ID，例如/1/5/')
+
+
+class DepartmentCreateSchema(BaseModel):
+    name: str = Field(description='部门名称')
+    parent_id: Optional[int] = Field(default=None, description='上级部门ID，为空时创建根部门')
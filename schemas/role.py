@@ -2,12 +2,19 @@ from typing import Optional
 from pydantic import BaseModel, Field
 
 from db import DBBaseSchema
+from models.enums import DataScopeEnum
 
 
 class RoleSchema(DBBaseSchema):
     name: str = Field(description='角色名称')
     code: str = Field(description='角色编码')
     desc: Optional[str] = Field(description='角色描述')
+    data_scope: Optional[DataScopeEnum] = Field(default=None, description='数据权限范围')
+
+
+class RoleCountSchema(BaseModel):
+    user_count: int = Field(default=0, description='角色下的用户数')
+    permission_counts: dict[str, int] = Field(default_factory=dict, description='各类型(menu/interface/button)的权限数')
 
 
 class RoleUpdateSchema(BaseModel):
@@ -15,6 +22,7 @@ class RoleUpdateSchema(BaseModel):
     code: str = Field(description='角色编码')
     enable: Optional[bool] = Field(default=None, description='是否启用')
     desc: Optional[str] = Field(default=None, description='角色描述')
+    data_scope: Optional[DataScopeEnum] = Field(default=None, description='数据权限范围')
 
 
 class RoleUpdatePermissionSchema(BaseModel):
@@ -26,3 +34,4 @@ class RoleCreateSchema(BaseModel):
     code: str = Field(description='角色编码')
     enable: bool = Field(description='是否启用')
     desc: Optional[str] = Field(description='角色描述')
+    data_scope: DataScopeEnum = Field(default=DataScopeEnum.ALL, description='数据权限范围')
@@ -1,7 +1,8 @@
 from typing import Optional
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, computed_field
 
 from db import DBBaseSchema
+from common.image import get_variant_urls
 from models.enums import GenderEnum
 
 
@@ -14,6 +15,12 @@ class UserSchema(DBBaseSchema):
     avatar: Optional[str] = Field(description='头像地址')
     address: Optional[str] = Field(description='地址')
     introduce: Optional[str] = Field(description='个人介绍')
+    did: Optional[int] = Field(default=None, description='部门ID')
+
+    @computed_field(description='头像缩略图地址，{尺寸: {格式: 地址}}，尚未生成的缩略图为原图地址')
+    @property
+    def avatar_variants(self) -> Optional[dict[str, dict[str, str]]]:
+        return get_variant_urls(self.avatar)
 
 
 class UserLoginSchema(BaseModel):
@@ -42,6 +49,7 @@ class UserUpdateSchema(BaseModel):
     avatar: Optional[str] = Field(default=None, description='头像地址')
     address: Optional[str] = Field(default=None, description='地址')
     introduce: Optional[str] = Field(default=None, description='个人介绍')
+    did: Optional[int] = Field(default=None, description='部门ID')
 
 
 class UserCreateSchema(BaseModel):
@@ -54,3 +62,4 @@ class UserCreateSchema(BaseModel):
     avatar: Optional[str] = Field(default=None, description='头像地址')
     address: Optional[str] = Field(default=None, description='地址')
     introduce: Optional[str] = Field(default=None, description='个人介绍')
+    did: Optional[int] = Field(default=None, description='部门ID')
@@ -0,0 +1,123 @@
+'''
+逻辑删除数据归档: 将逻辑删除超过保留期的用户、角色和权限分批移动到归档表，同时移走关联的角色权限记录
+归档后的数据可以按ID恢复
+
+    python main.py archive [--days 30] [--batch-size 1000]
+    python main.py restore roles 3 4 [--undelete]
+'''
+import asyncio
+from datetime import datetime, timedelta
+from typing import Optional
+
+from sqlalchemy import Table, insert, delete, select, update, literal, exists, and_, DateTime
+
+from config import ARCHIVE_CONFIG
+from db import AsyncSession, AsyncSessionLocal, DBBaseModel
+from common.log import logger
+from models.user import UserModel
+from models.role import RoleModel
+from models.permission import PermissionModel
+from models.role_permission import RolePermissionModel
+from models.archive import UserArchiveTable, RoleArchiveTable, PermissionArchiveTable, RolePermissionArchiveTable
+
+# 归档顺序: 先归档用户，角色才可能不再被引用
+ARCHIVES: dict[str, tuple[type[DBBaseModel], Table]] = {
+    'users': (UserModel, UserArchiveTable),
+    'roles': (RoleModel, RoleArchiveTable),
+    'permissions': (PermissionModel, PermissionArchiveTable),
+}
+# 角色、权限归档时关联的角色权限记录对应的列
+RELATION_COLUMNS = {'roles': RolePermissionModel.rid, 'permissions': RolePermissionModel.pid}
+
+
+async def move_rows(session: AsyncSession, source: Table, target: Table, condition, archived_at: Optional[datetime] = None) -> int:
+    ''' 在当前事务中将满足条件的数据从source移动到target，archived_at为None时表示从归档表恢复 '''
+    names = [column.name for column in source.columns if column.name != 'archived_at']
+    columns = [source.c[name] for name in names]
+    if archived_at is not None:
+        columns.append(literal(archived_at, DateTime))
+        names.append('archived_at')
+    await session.execute(insert(target).from_select(names, select(*columns).where(condition)))
+    result = await session.execute(delete(source).where(condition))
+    return result.rowcount
+
+
+def get_candidates(kind: str, cutoff: datetime, batch_size: int):
+    model, _ = ARCHIVES[kind]
+    stmt = select(model.id).where(model.is_delete == True, model.utime < cutoff).order_by(model.id).limit(batch_size)
+    if kind == 'roles':
+        # 仍然被用户(包括尚未归档的已删除用户)引用的角色不能归档
+        stmt = stmt.where(~exists().where(UserModel.rid == RoleModel.id))
+    return stmt
+
+
+async def archive_kind(kind: str, cutoff: datetime, batch_size: int) -> int:
+    ''' 分批归档一种数据，每批一个事务，返回归档数量 '''
+    model, archive_table = ARCHIVES[kind]
+    total = 0
+    while True:
+        async with AsyncSessionLocal() as session:
+            ids = list(await session.scalars(get_candidates(kind, cutoff, batch_size)))
+            if not ids:
+                break
+            now = datetime.now()
+            if kind in RELATION_COLUMNS:
+                await move_rows(
+                    session, RolePermissionModel.__table__, RolePermissionArchiveTable,
+                    RELATION_COLUMNS[kind].in_(ids), archived_at=now
+                )
+            total += await move_rows(session, model.__table__, archive_table, model.id.in_(ids), archived_at=now)
+            await session.commit()
+        logger.info('archived %s %s', total, kind)
+        if len(ids) < batch_size:
+            break
+    return total
+
+
+async def archive_deleted(retention_days: Optional[int] = None, batch_size: Optional[int] = None) -> dict[str, int]:
+    ''' 归档逻辑删除超过保留期的用户、角色和权限 '''
+    retention_days = ARCHIVE_CONFIG.retention_days if retention_days is None else retention_days
+    cutoff = datetime.now() - timedelta(days=retention_days)
+    result = {}
+    for kind in ARCHIVES:
+        result[kind] = await archive_kind(kind, cutoff, batch_size or ARCHIVE_CONFIG.batch_size)
+    return result
+
+
+async def restore_archived(kind: str, ids: list[int], undelete: bool = False) -> int:
+    ''' 将归档的数据恢复到业务表，默认仍然保持逻辑删除状态，返回恢复的数量 '''
+    model, archive_table = ARCHIVES[kind]
+    async with AsyncSessionLocal() as session:
+        if kind == 'users':
+            # 用户引用的角色已经归档时，需要先恢复角色
+            missing_roles = set(await session.scalars(
+                select(archive_table.c.rid).where(archive_table.c.id.in_(ids), archive_table.c.rid.in_(select(RoleArchiveTable.c.id)))
+            ))
+            if missing_roles:
+                raise Exception(f'用户关联的角色已归档，请先恢复角色: {sorted(missing_roles)}')
+
+        count = await move_rows(session, archive_table, model.__table__, archive_table.c.id.in_(ids))
+        if kind in RELATION_COLUMNS:
+            # 只恢复角色和权限都在业务表中的关联记录，另一侧仍在归档中的记录等另一侧恢复时再恢复
+            relation = RolePermissionArchiveTable.c
+            await move_rows(session, RolePermissionArchiveTable, RolePermissionModel.__table__, and_(
+                relation[RELATION_COLUMNS[kind].name].in_(ids),
+                relation.rid.in_(select(RoleModel.id)),
+                relation.pid.in_(select(PermissionModel.id)),
+            ))
+        if undelete:
+            await session.execute(update(model).where(model.id.in_(ids)).values(is_delete=False))
+        await session.commit()
+    logger.info('restored %s %s: %s', count, kind, ids)
+    return count
+
+
+async def run_archive_schedule() -> None:
+    ''' 在应用内按间隔定时归档，由lifespan启动和取消 '''
+    while True:
+        await asyncio.sleep(ARCHIVE_CONFIG.interval_hours * 3600)
+        try:
+            result = await archive_deleted()
+            logger.info('scheduled archive finished, %s', result)
+        except Exception as e:
+            logger.exception(e)
@@ -20,9 +20,9 @@ async def insert_by_enum(pe: type[PermissionDetailEnum], type: PermissionEnum, s
         data = PermissionCreateSchema(**item.model_dump(), type=type)
         try:
             await PermissionServer.create_obj(data, session)
-            logger.info(f'inser {data.name}:{data.code} success!')
+            logger.info('inser %s:%s success!', data.name, data.code)
         except Exception as e:
-            logger.error(f'insert data: {data.model_dump()} fail, detail is {e}')
+            logger.error('insert data: %s fail, detail is %s', data, e)
 
 
 @async_session_wrapper
@@ -0,0 +1,240 @@
+'''
+用户批量导入导出
+
+导入: 流式读取CSV/JSONL文件，按批次使用UserCreateSchema校验，在进程池中加密密码，
+     按批次提交事务(PostgreSQL+asyncpg使用COPY，其他数据库使用executemany)，每批提交后写入断点，失败后重新执行会从断点继续
+导出: 使用服务端游标流式读取并逐批写出，内存占用与数据总量无关
+'''
+import os
+import csv
+import json
+import time
+import asyncio
+from uuid import uuid4
+from datetime import datetime
+from typing import Iterator, Optional, TextIO
+from concurrent.futures import ProcessPoolExecutor
+
+from pydantic import ValidationError
+from sqlalchemy import insert, select
+
+from db import async_engine, AsyncSessionLocal
+from common.log import logger
+from models.user import UserModel
+from models.enums import GenderEnum
+from models.role import RoleModel
+from schemas.user import UserCreateSchema
+
+USER_FIELDS = ('name', 'nickname', 'gender', 'email', 'phone', 'avatar', 'address', 'introduce')
+EXPORT_FIELDS = (*USER_FIELDS, 'rid', 'enable')
+# 批量写入时显式给出所有列，COPY不会使用ORM的默认值
+INSERT_COLUMNS = (
+    'uuid', 'ctime', 'utime', 'created_by', 'updated_by', 'is_delete', 'enable', 'meta',
+    'hashed_password', *USER_FIELDS, 'rid',
+)
+TRUE_VALUES = ('1', 'true', 'yes', 'on')
+
+
+def hash_passwords(passwords: list[str]) -> list[str]:
+    ''' 在子进程中执行，批量加密密码 '''
+    return [UserModel.pwd_context.hash(password) for password in passwords]
+
+
+def detect_format(path: str, fmt: Optional[str]) -> str:
+    if fmt:
+        return fmt
+    return 'csv' if path.lower().endswith('.csv') else 'jsonl'
+
+
+def iter_rows(path: str, fmt: str) -> Iterator[dict]:
+    ''' 流式读取文件中的每一行数据 '''
+    with open(path, 'r', encoding='utf-8-sig', newline='') as fp:
+        if fmt == 'csv':
+            for row in csv.DictReader(fp):
+                # CSV中的空字符串视为没有填写
+                yield {k: v for k, v in row.items() if k and v != ''}
+        else:
+            for line in fp:
+                if line.strip():
+                    yield json.loads(line)
+
+
+def iter_batches(rows: Iterator[dict], batch_size: int, skip: int = 0) -> Iterator[list[dict]]:
+    batch = []
+    for index, row in enumerate(rows):
+        if index < skip:
+            continue
+        batch.append(row)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+######################## 断点 ########################
+def get_checkpoint_path(path: str) -> str:
+    return f'{path}.checkpoint.json'
+
+
+def load_checkpoint(path: str, restart: bool) -> dict:
+    ''' 读取断点，文件发生变化时拒绝继续，避免跳过错误的行 '''
+    stat = os.stat(path)
+    checkpoint = {'size': stat.st_size, 'mtime': stat.st_mtime, 'rows': 0, 'inserted': 0, 'skipped': 0, 'invalid': 0}
+    checkpoint_path = get_checkpoint_path(path)
+    if restart or not os.path.exists(checkpoint_path):
+        return checkpoint
+    with open(checkpoint_path, 'r', encoding='utf-8') as fp:
+        saved = json.load(fp)
+    if (saved['size'], saved['mtime']) != (stat.st_size, stat.st_mtime):
+        raise Exception(f'文件在上次导入后发生了变化，请确认后使用--restart重新导入: {path}')
+    logger.info('resume import from checkpoint, %s rows already processed', saved['rows'])
+    return saved
+
+
+def save_checkpoint(path: str, checkpoint: dict) -> None:
+    checkpoint_path = get_checkpoint_path(path)
+    with open(checkpoint_path + '.tmp', 'w', encoding='utf-8') as fp:
+        json.dump(checkpoint, fp)
+    os.replace(checkpoint_path + '.tmp', checkpoint_path)
+
+
+######################## 导入 ########################
+def validate_batch(
+    batch: list[dict], start_row: int, default_rid: Optional[int], role_ids: set[int], error_fp: TextIO
+) -> tuple[list[dict], list[str]]:
+    ''' 校验一批数据，返回待写入的记录和对应的明文密码，不合法的数据写入错误文件 '''
+    records, passwords, names = [], [], set()
+    now = datetime.now()
+    for offset, row in enumerate(batch):
+        try:
+            schema = UserCreateSchema.model_validate(row)
+            rid = int(row['rid']) if row.get('rid') not in (None, '') else default_rid
+            if rid is not None and rid not in role_ids:
+                raise ValueError(f'角色不存在: {rid}')
+            if schema.name in names:
+                raise ValueError(f'文件中存在重复的用户名: {schema.name}')
+        except (ValidationError, ValueError) as e:
+            data = {k: v for k, v in row.items() if k != 'password'}
+            error_fp.write(json.dumps({'row': start_row + offset + 1, 'data': data, 'error': str(e)}, ensure_ascii=False) + '\n')
+            continue
+        names.add(schema.name)
+        enable = row.get('enable', True)
+        records.append({
+            **schema.model_dump(include=set(USER_FIELDS)),
+            'uuid': uuid4(), 'ctime': now, 'utime': now, 'created_by': None, 'updated_by': None,
+            'gender': schema.gender or GenderEnum.UNKNOWN, 'is_delete': False, 'meta': None, 'rid': rid,
+            'enable': enable if isinstance(enable, bool) else str(enable).lower() in TRUE_VALUES,
+        })
+        passwords.append(schema.password)
+    return records, passwords
+
+
+async def write_records(records: list[dict]) -> int:
+    ''' 在一个事务中写入一批用户，已存在的用户名跳过，返回写入的数量 '''
+    async with AsyncSessionLocal() as session:
+        exists = set(await session.scalars(
+            select(UserModel.name).filter(UserModel.name.in_([record['name'] for record in records]), UserModel.is_delete == False)
+        ))
+        records = [record for record in records if record['name'] not in exists]
+        if not records:
+            return 0
+
+        if async_engine.dialect.name == 'postgresql' and async_engine.dialect.driver == 'asyncpg':
+            connection = await session.connection()
+            raw_connection = await connection.get_raw_connection()
+            await raw_connection.driver_connection.copy_records_to_table(
+                UserModel.__tablename__, columns=INSERT_COLUMNS,
+                records=[
+                    # 枚举列按名称保存
+                    tuple(record[k].name if k == 'gender' and record[k] is not None else record[k] for k in INSERT_COLUMNS)
+                    for record in records
+                ]
+            )
+        else:
+            await session.execute(insert(UserModel.__table__), records)
+        await session.commit()
+        return len(records)
+
+
+async def import_users(
+    path: str, fmt: Optional[str] = None, batch_size: int = 1000, workers: Optional[int] = None,
+    rid: Optional[int] = None, restart: bool = False
+) -> dict:
+    ''' 从CSV/JSONL文件批量导入用户，返回导入统计 '''
+    fmt = detect_format(path, fmt)
+    checkpoint = load_checkpoint(path, restart)
+    async with AsyncSessionLocal() as session:
+        role_ids = set(await session.scalars(select(RoleModel.id).filter(RoleModel.is_delete == False)))
+    if rid is not None and rid not in role_ids:
+        raise Exception(f'角色不存在: {rid}')
+
+    loop = asyncio.get_running_loop()
+    workers = workers or os.cpu_count() or 1
+    start, resumed_rows = time.perf_counter(), checkpoint['rows']
+
+    async def flush(row_count: int, records: list[dict], hashing: asyncio.Future) -> None:
+        hashed_passwords = [item for chunk in await hashing for item in chunk]
+        for record, hashed_password in zip(records, hashed_passwords):
+            record['hashed_password'] = hashed_password
+        inserted = await write_records(records) if records else 0
+        checkpoint['rows'] += row_count
+        checkpoint['inserted'] += inserted
+        checkpoint['skipped'] += len(records) - inserted
+        checkpoint['invalid'] += row_count - len(records)
+        save_checkpoint(path, checkpoint)
+        logger.info(
+            'imported %s rows (%s inserted, %s skipped, %s invalid), %.0f rows/s', checkpoint['rows'],
+            checkpoint['inserted'], checkpoint['skipped'], checkpoint['invalid'],
+            (checkpoint['rows'] - resumed_rows) / max(time.perf_counter() - start, 1e-9)
+        )
+
+    with ProcessPoolExecutor(workers) as pool, open(f'{path}.errors.jsonl', 'a', encoding='utf-8') as error_fp:
+        pending = None
+        row_index = checkpoint['rows']
+        for batch in iter_batches(iter_rows(path, fmt), batch_size, skip=checkpoint['rows']):
+            records, passwords = validate_batch(batch, row_index, rid, role_ids, error_fp)
+            row_index += len(batch)
+            chunk_size = max(1, -(-len(passwords) // workers))
+            hashing = asyncio.gather(*[
+                loop.run_in_executor(pool, hash_passwords, passwords[i:i + chunk_size])
+                for i in range(0, len(passwords), chunk_size)
+            ])
+            # 当前批次加密密码的同时写入上一批次
+            if pending:
+                await flush(*pending)
+            pending = (len(batch), records, hashing)
+        if pending:
+            await flush(*pending)
+    return checkpoint
+
+
+######################## 导出 ########################
+def format_value(value):
+    if hasattr(value, 'value'):
+        return value.value
+    return value
+
+
+async def export_users(path: str, fmt: Optional[str] = None, batch_size: int = 1000) -> int:
+    ''' 流式导出所有未删除的用户，返回导出的数量 '''
+    fmt = detect_format(path, fmt)
+    stmt = select(*[getattr(UserModel, field) for field in EXPORT_FIELDS])\
+        .filter(UserModel.is_delete == False).order_by(UserModel.id).execution_options(yield_per=batch_size)
+
+    total = 0
+    with open(path, 'w', encoding='utf-8', newline='') as fp:
+        writer = csv.writer(fp) if fmt == 'csv' else None
+        if writer:
+            writer.writerow(EXPORT_FIELDS)
+        async with AsyncSessionLocal() as session:
+            result = await session.stream(stmt)
+            async for rows in result.partitions():
+                rows = [[format_value(value) for value in row] for row in rows]
+                if writer:
+                    writer.writerows(rows)
+                else:
+                    fp.writelines(json.dumps(dict(zip(EXPORT_FIELDS, row)), ensure_ascii=False) + '\n' for row in rows)
+                total += len(rows)
+                logger.info('exported %s users', total)
+    return total
@@ -0,0 +1,48 @@
+from typing import Sequence, Optional
+from sqlalchemy.future import select
+
+from db import AsyncSession
+from models.department import DepartmentModel
+from common.exception import ApiException
+from common.utils import get_db_model_fields
+from common.data_scope import get_scope_filters
+from schemas.department import DepartmentCreateSchema
+
+
+async def get_obj_by_query(query: dict, session: AsyncSession) -> Optional[DepartmentModel]:
+    ''' 基于查询参数获取部门，只能查到当前用户数据范围内的部门 '''
+    fields = get_db_model_fields(DepartmentModel)
+    query = {k: v for k, v in query.items() if k in fields}
+    result = await session.execute(
+        select(DepartmentModel).filter_by(**query)
+        .filter(DepartmentModel.is_delete==False, *get_scope_filters(DepartmentModel))
+    )
+    return result.scalars().first()
+
+
+async def get_all(session: AsyncSession) -> Sequence[DepartmentModel]:
+    ''' 数据范围内的所有部门，按路径排序，上级部门在下级部门之前 '''
+    result = await session.execute(
+        select(DepartmentModel)
+        .filter(DepartmentModel.is_delete==False, *get_scope_filters(DepartmentModel))
+        .order_by(DepartmentModel.path)
+    )
+    return result.scalars().all()
+
+
+async def create_department(data: DepartmentCreateSchema, session: AsyncSession) -> DepartmentModel:
+    parent_path = '/'
+    if data.parent_id is not None:
+        parent = await get_obj_by_query({'id': data.parent_id}, session)
+        if parent is None:
+            raise ApiException('上级部门不存在')
+        parent_path = str(parent.path)
+
+    obj = DepartmentModel(name=data.name, parent_id=data.parent_id)
+    session.add(obj)
+    # 路径包含部门自身的ID，需要先生成ID
+    await session.flush()
+    setattr(obj, 'path', f'{parent_path}{obj.id}/')
+    await session.commit()
+    await session.refresh(obj)
+    return obj
@@ -9,6 +9,8 @@ from models.role import RoleModel
 from models.permission import PermissionModel
 from common.exception import ApiException
 from common.utils import get_db_model_fields
+from common.audit import record_audit
+from common.single_flight import invalidate
 from schemas.permission import PermissionCreateSchema, PermissionUpdateSchema
 from common.pagination import PaginationQuerySchema, PaginationSchema, pagination
 
@@ -21,7 +23,9 @@ async def delete_by_id(id: int, session: AsyncSession):
     # 逻辑删除
     setattr(obj, 'is_delete', True)
     await session.commit()
+    invalidate('permission', 'role')
     await session.refresh(obj)
+    record_audit('delete', obj)
 
 
 async def change_status(id: int, enable: bool, session: AsyncSession) -> PermissionModel:
@@ -29,9 +33,12 @@ async def change_status(id: int, enable: bool, session: AsyncSession) -> Permiss
     if not obj:
         raise ApiException('权限不存在')
 
+    before = obj.enable
     setattr(obj, 'enable', enable)
     await session.commit()
+    invalidate('permission')
     await session.refresh(obj)
+    record_audit('change_status', obj, {'before': before, 'after': enable})
     return obj
 
 
@@ -45,6 +52,7 @@ async def update_by_id(id: int, data: PermissionUpdateSchema, session: AsyncSess
             continue
         setattr(obj, k, v)
     await session.commit()
+    invalidate('permission', 'role')
     await session.refresh(obj)
     return obj
 
@@ -75,6 +83,7 @@ async def create_obj(data: PermissionCreateSchema, session: AsyncSession) -> Per
     obj = PermissionModel(**data.model_dump())
     session.add(obj)
     await session.commit()
+    invalidate('permission')
     await session.refresh(obj)
     return obj
 
@@ -1,13 +1,18 @@
 from typing import Sequence, Optional
-from sqlalchemy import or_
+from sqlalchemy import or_, func, case, delete, insert
 from sqlalchemy.future import select
 
-from db import AsyncSession
+from db import AsyncSession, AsyncSessionLocal
 from models.user import UserModel
 from models.role import RoleModel
-from models.permission import PermissionModel
+from models.permission import PermissionModel, PermissionEnum
+from models.role_permission import RolePermissionModel
 from common.exception import ApiException
 from common.utils import get_db_model_fields
+from common.audit import record_audit
+from common.data_scope import get_scope_filters
+from common.dataloader import DataLoader, can_batch, load_into_session
+from common.single_flight import invalidate
 from schemas.role import RoleCreateSchema, RoleUpdateSchema
 from common.pagination import PaginationQuerySchema, PaginationSchema, pagination
 
@@ -22,7 +27,9 @@ async def delete_by_id(id: int, session: AsyncSession):
     # 逻辑删除
     setattr(obj, 'is_delete', True)
     await session.commit()
+    invalidate('role')
     await session.refresh(obj)
+    record_audit('delete', obj)
 
 
 async def dispatch_permission(id: int, permission_ids: list[int], session: AsyncSession) -> RoleModel:
@@ -31,9 +38,15 @@ async def dispatch_permission(id: int, permission_ids: list[int], session: Async
         raise ApiException('角色不存在')
     
     permission_objs = await PermissionServer.all_permission_by_ids(permission_ids, session)
-    obj.permissions = permission_objs
+    before = sorted(p.id for p in obj.permissions)
+    # 按角色ID整体替换关联行，通过关系集合修改时按加载时的行删除，并发分配同一个角色会因删除行数不符抛出StaleDataError
+    await session.execute(delete(RolePermissionModel).filter(RolePermissionModel.rid == id))
+    if permission_objs:
+        await session.execute(insert(RolePermissionModel), [{'rid': id, 'pid': p.id} for p in permission_objs])
     await session.commit()
+    invalidate('role')
     await session.refresh(obj)
+    record_audit('dispatch_permission', obj, {'before': before, 'after': sorted(p.id for p in permission_objs)})
     return obj
 
 
@@ -42,9 +55,12 @@ async def change_status(id: int, enable: bool, session: AsyncSession) -> RoleMod
     if not obj:
         raise ApiException('角色不存在')
 
+    before = obj.enable
     setattr(obj, 'enable', enable)
     await session.commit()
+    invalidate('role')
     await session.refresh(obj)
+    record_audit('change_status', obj, {'before': before, 'after': enable})
     return obj
 
 
@@ -62,6 +78,7 @@ async def update_by_id(id: int, data: RoleUpdateSchema, session: AsyncSession) -
             continue
         setattr(obj, k, v)
     await session.commit()
+    invalidate('role')
     await session.refresh(obj)
     return obj
 
@@ -75,11 +92,25 @@ async def check_role_exist(name: str, code: str, session: AsyncSession) -> bool:
     return obj is not None
 
 
+async def load_roles_by_ids(ids: list[int]) -> dict[int, RoleModel]:
+    ''' 批量按ID查询角色，供跨请求的批量加载使用 '''
+    async with AsyncSessionLocal() as session:
+        result = await session.execute(select(RoleModel).filter(RoleModel.id.in_(ids), RoleModel.is_delete==False))
+        return {obj.id: obj for obj in result.scalars().all()}
+
+
+role_loader = DataLoader('role', load_roles_by_ids)
+
+
 async def get_obj_by_query(query: dict, session: AsyncSession) -> RoleModel:
     # 过滤掉不存在的参数
     fields = get_db_model_fields(RoleModel)
     query = {k: v for k, v in query.items() if k in fields}
 
+    # 只按ID查询且session还没有占用连接时，与其他请求的查询合并为一次批量查询
+    if can_batch(session) and query.keys() == {'id'} and query['id'] is not None:
+        return await load_into_session(role_loader, RoleModel, query['id'], session)
+
     result = await session.execute(select(RoleModel).filter_by(**query).filter(RoleModel.is_delete==False))
     obj = result.scalars().first()
     return obj
@@ -93,6 +124,7 @@ async def create_obj(data: RoleCreateSchema, session: AsyncSession) -> RoleModel
     obj = RoleModel(**data.model_dump())
     session.add(obj)
     await session.commit()
+    invalidate('role')
     await session.refresh(obj)
     return obj
 
@@ -110,3 +142,34 @@ async def all_role_list_by_enable(keyword: Optional[str], session: AsyncSession)
 
 async def pagelist(schema: PaginationQuerySchema, session: AsyncSession) -> tuple[PaginationSchema, Sequence[RoleModel]]:
     return await pagination(RoleModel, schema, session)
+
+
+async def get_role_counts(ids: list[int], session: AsyncSession) -> dict[int, dict]:
+    ''' 一次分组聚合查询获取角色的用户数和各类型的权限数，两个聚合分别在子查询中完成，避免连接后行数相乘
+    用户数只统计当前请求数据范围内的用户
+    '''
+    user_counts = select(UserModel.rid, func.count().label('user_count'))\
+        .filter(UserModel.is_delete==False, UserModel.rid.in_(ids), *get_scope_filters(UserModel))\
+        .group_by(UserModel.rid).subquery()
+    type_counts = [
+        func.sum(case((PermissionModel.type==permission_type, 1), else_=0)).label(permission_type.value)
+        for permission_type in PermissionEnum
+    ]
+    permission_counts = select(RolePermissionModel.rid, *type_counts)\
+        .join(PermissionModel, PermissionModel.id==RolePermissionModel.pid)\
+        .filter(RolePermissionModel.is_delete==False, PermissionModel.is_delete==False, RolePermissionModel.rid.in_(ids))\
+        .group_by(RolePermissionModel.rid).subquery()
+    stmt = select(
+        RoleModel.id, func.coalesce(user_counts.c.user_count, 0),
+        *[func.coalesce(permission_counts.c[permission_type.value], 0) for permission_type in PermissionEnum]
+    ).outerjoin(user_counts, user_counts.c.rid==RoleModel.id)\
+        .outerjoin(permission_counts, permission_counts.c.rid==RoleModel.id)\
+        .filter(RoleModel.id.in_(ids))
+    result = await session.execute(stmt)
+    return {
+        row[0]: {
+            'user_count': row[1],
+            'permission_counts': {permission_type.value: count for permission_type, count in zip(PermissionEnum, row[2:])},
+        }
+        for row in result.all()
+    }
@@ -1,7 +1,8 @@
+import asyncio
 from typing import Sequence, Optional
 from sqlalchemy.future import select
 
-from db import AsyncSession
+from db import AsyncSession, AsyncSessionLocal
 from models.user import UserModel
 from models.role import RoleModel
 from models.permission import PermissionModel
@@ -9,9 +10,14 @@ from models.role_permission import RolePermissionModel
 
 from common.exception import ApiException
 from common.utils import get_db_model_fields
+from common.audit import record_audit
+from common.dataloader import DataLoader, can_batch, load_into_session
+from common.data_scope import get_scope_filters
+from common.single_flight import invalidate
 from common.pagination import PaginationQuerySchema, PaginationSchema, pagination
 
 import services.role as RoleService
+import services.department as DepartmentService
 from schemas.user import UserCreateSchema, UserUpdateSchema, UserChangePasswordSchema
 
 
@@ -23,7 +29,10 @@ async def delete_by_id(id: int, session: AsyncSession):
     # 逻辑删除
     setattr(obj, 'is_delete', True)
     await session.commit()
+    # 角色列表中的用户数发生变化
+    invalidate('role')
     await session.refresh(obj)
+    record_audit('delete', obj)
 
 
 async def change_status(id: int, enable: bool, session: AsyncSession) -> UserModel:
@@ -31,9 +40,11 @@ async def change_status(id: int, enable: bool, session: AsyncSession) -> UserMod
     if not obj:
         raise ApiException('用户不存在')
 
+    before = obj.enable
     setattr(obj, 'enable', enable)
     await session.commit()
     await session.refresh(obj)
+    record_audit('change_status', obj, {'before': before, 'after': enable})
     return obj
 
 
@@ -45,6 +56,7 @@ async def update_by_id(id: int, data: UserUpdateSchema, session: AsyncSession) -
     # 用户名唯一，故如果用户名需要修改，需要先判定用户名是否可用
     if not await check_name(id, data.name, session):
         raise ApiException('用户名已存在，请换个用户名')
+    await check_department(data.did, session)
 
     for k, v in data.model_dump().items():
         if v is None:
@@ -60,7 +72,8 @@ async def update_pwd_by_id(id: int, data: UserChangePasswordSchema, session: Asy
     if not obj:
         raise ApiException('用户不存在')
     
-    obj.password = data.password
+    # bcrypt在线程中执行，不阻塞事件循环
+    obj.hashed_password = await asyncio.to_thread(UserModel.hash_pwd, data.password)
     await session.commit()
     await session.refresh(obj)
     return obj
@@ -70,17 +83,39 @@ async def check_name(id: int, name: Optional[str], session: AsyncSession) -> boo
     if not name:
         return True
     
-    obj = await get_obj_by_query({'name': name}, session)
+    # 用户名全局唯一，不受数据范围限制
+    obj = await get_obj_by_query({'name': name}, session, scoped=False)
     return obj is None or getattr(obj, 'id') == id
 
 
-async def get_obj_by_query(query: dict, session: AsyncSession) -> UserModel:
-    ''' 基于查询参数获取用户信息 '''
+async def check_department(did: Optional[int], session: AsyncSession) -> None:
+    ''' 用户只能分配到当前用户数据范围内的部门 '''
+    if did is not None and await DepartmentService.get_obj_by_query({'id': did}, session) is None:
+        raise ApiException('部门不存在')
+
+
+async def load_users_by_ids(ids: list[int]) -> dict[int, UserModel]:
+    ''' 批量按ID查询用户，供跨请求的批量加载使用 '''
+    async with AsyncSessionLocal() as session:
+        result = await session.execute(select(UserModel).filter(UserModel.id.in_(ids), UserModel.is_delete==False))
+        return {obj.id: obj for obj in result.scalars().all()}
+
+
+user_loader = DataLoader('user', load_users_by_ids)
+
+
+async def get_obj_by_query(query: dict, session: AsyncSession, scoped: bool = True) -> UserModel:
+    ''' 基于查询参数获取用户信息，scoped为True时只能查到当前用户数据范围内的用户 '''
     # 过滤掉不存在的参数
     fields = get_db_model_fields(UserModel)
     query = {k: v for k, v in query.items() if k in fields}
+    scope_filters = get_scope_filters(UserModel) if scoped else []
+
+    # 只按ID查询且session还没有占用连接时，与其他请求的查询合并为一次批量查询，有数据范围限制时直接查询
+    if can_batch(session) and not scope_filters and query.keys() == {'id'} and query['id'] is not None:
+        return await load_into_session(user_loader, UserModel, query['id'], session)
 
-    result = await session.execute(select(UserModel).filter_by(**query).filter(UserModel.is_delete==False))
+    result = await session.execute(select(UserModel).filter_by(**query).filter(UserModel.is_delete==False, *scope_filters))
     obj = result.scalars().first()
     return obj
 
@@ -92,11 +127,14 @@ async def create_user(data: UserCreateSchema, session: AsyncSession) -> UserMode
     )
     if result.scalars().first():
         raise ApiException('该用户已存在')
+    await check_department(data.did, session)
     
-    # 创建用户
-    user = UserModel(**data.model_dump())
+    # 创建用户，bcrypt在线程中执行，不阻塞事件循环
+    hashed_password = await asyncio.to_thread(UserModel.hash_pwd, data.password)
+    user = UserModel(**data.model_dump(exclude={'password'}), hashed_password=hashed_password)
     session.add(user)
     await session.commit()
+    invalidate('role')
     await session.refresh(user)
     return user
 
@@ -110,9 +148,12 @@ async def user_dispatch_role(id: int, role_id: int, session: AsyncSession) -> Us
     if role is None:
         raise ApiException('角色不存在')
 
+    before = user.rid
     user.role = role
     await session.commit()
+    invalidate('role')
     await session.refresh(user)
+    record_audit('dispatch_role', user, {'before': before, 'after': role.id})
     return user
 
 